@@ -0,0 +1,84 @@
+import math
+import os
+from collections.abc import Callable
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+# Line charts with one trace per area (county, municipality, postcode). Large municipalities have hundreds
+# of postcodes, so these figures are kept bounded: areas beyond the largest CHART_MAX_SERIES are summed into
+# one "Others" series, series are thinned to at most CHART_MAX_POINTS x values, and figures with more than
+# CHART_WEBGL_POINTS points are drawn with WebGL instead of SVG and without markers.
+CHART_MAX_SERIES = int(os.environ.get("CHART_MAX_SERIES", "20"))
+CHART_MAX_POINTS = int(os.environ.get("CHART_MAX_POINTS", "120"))
+CHART_WEBGL_POINTS = 1000
+OTHERS_LABEL = "Others"
+
+
+def top_series(
+    df: pd.DataFrame,
+    series: str,
+    weight: str,
+    sums: list[str],
+    *,
+    x: str = "dt",
+    n: int = CHART_MAX_SERIES,
+    combine: Callable[[pd.DataFrame], pd.DataFrame] | None = None,
+) -> pd.DataFrame:
+    """Keep the `n` series (values of `series`) with the largest `weight` at the last `x` value and sum
+    the other series into one OTHERS_LABEL series per `x` value.
+
+    Only the `sums` columns are summed, `combine` adds the other columns (e.g. ratios) to the summed rows.
+    """
+    # replacing a single series by "Others" would not make the chart any smaller
+    if df[series].nunique() <= n + 1:
+        return df
+    last = df[df[x] == df[x].max()]
+    top = last.groupby(series, observed=True)[weight].sum().nlargest(n).index
+    is_top = df[series].isin(top)
+    others = df[~is_top].groupby(x, as_index=False)[sums].sum()
+    others[series] = OTHERS_LABEL
+    if combine is not None:
+        others = combine(others)
+    return pd.concat([df[is_top], others], ignore_index=True)
+
+
+def thin_x(df: pd.DataFrame, x: str = "dt", max_points: int = CHART_MAX_POINTS) -> pd.DataFrame:
+    # every k-th x value, counted back from the last one so the latest value is always shown
+    values = np.sort(df[x].unique())
+    if len(values) <= max_points:
+        return df
+    return df[df[x].isin(values[:: -math.ceil(len(values) / max_points)])]
+
+
+def area_line_chart(
+    df: pd.DataFrame,
+    y: str,
+    series: str,
+    *,
+    title: str,
+    y_title: str,
+    x: str = "dt",
+    height: int = 1000,
+    percent: bool = False,
+) -> go.Figure:
+    """px.line with one trace per value of `series`, thinned and drawn with WebGL when it is large."""
+    df = thin_x(df, x)
+    webgl = len(df) > CHART_WEBGL_POINTS
+    fig = px.line(
+        df,
+        x=x,
+        y=y,
+        color=series,
+        markers=not webgl,
+        render_mode="webgl" if webgl else "svg",
+        title=title,
+        labels={y: y_title, x: "Date"},
+        height=height,
+    )
+    fig.update_layout(yaxis_title=y_title, xaxis_title="Date", legend_title=series)
+    if percent:
+        fig.update_yaxes(tickformat=".0%")
+    return fig
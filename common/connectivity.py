@@ -1,19 +1,117 @@
+import inspect
 import logging
+import math
 import os
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
 
-from google.cloud import bigquery, storage
+import streamlit as st
+from google.cloud import bigquery, bigquery_storage, storage
 from sadsconnectivity.sql_server import create_psc_iam_engine, create_read_engine
-from sqlalchemy import Engine, create_engine
+from sqlalchemy import Engine, create_engine, text
 
-try:
-    if "K_SERVICE" in os.environ:
-        sql_engine: Engine = create_psc_iam_engine()
-    else:
-        sql_engine: Engine = create_read_engine()
+# Clients are created on first use and shared by all sessions through st.cache_resource,
+# so importing this module is cheap and concurrent sessions reuse the same pools.
+SQL_POOL_SIZE = int(os.environ.get("SQL_POOL_SIZE", "5"))
+SQL_MAX_OVERFLOW = int(os.environ.get("SQL_MAX_OVERFLOW", "5"))
+SQL_POOL_TIMEOUT_SECONDS = int(os.environ.get("SQL_POOL_TIMEOUT_SECONDS", "10"))
+SQL_POOL_RECYCLE_SECONDS = int(os.environ.get("SQL_POOL_RECYCLE_SECONDS", "1800"))
+SQL_CONNECT_TIMEOUT_SECONDS = int(os.environ.get("SQL_CONNECT_TIMEOUT_SECONDS", "10"))
+SQL_RETRY_SECONDS = int(os.environ.get("SQL_RETRY_SECONDS", "60"))
 
-except Exception as _e:
-    logging.warning(f"Could not connect to the database: {_e} - using a fake in-memory database instead.")
-    sql_engine = create_engine("sqlite:///:memory:")
+_SQL_ENGINE_OPTIONS = {
+    "pool_size": SQL_POOL_SIZE,
+    "max_overflow": SQL_MAX_OVERFLOW,
+    "pool_timeout": SQL_POOL_TIMEOUT_SECONDS,
+    "pool_recycle": SQL_POOL_RECYCLE_SECONDS,
+    "pool_pre_ping": True,
+}
+_sql_failed_at = -math.inf
 
-bq_client = bigquery.Client()
-storage_client = storage.Client()
+
+def _check_connection(engine: Engine) -> None:
+    # The connection attempt runs in a separate thread so a server that does not answer fails after
+    # SQL_CONNECT_TIMEOUT_SECONDS instead of the (much longer) driver timeout.
+    def connect() -> None:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sql_connect")
+    try:
+        executor.submit(connect).result(timeout=SQL_CONNECT_TIMEOUT_SECONDS)
+    finally:
+        executor.shutdown(wait=False)
+
+
+def _engine_options(factory: Callable[..., Engine]) -> dict[str, Any]:
+    # only the pool options the sadsconnectivity factory accepts, the others keep the factory defaults
+    parameters = inspect.signature(factory).parameters
+    if any(p.kind is inspect.Parameter.VAR_KEYWORD for p in parameters.values()):
+        return _SQL_ENGINE_OPTIONS
+    options = {name: value for name, value in _SQL_ENGINE_OPTIONS.items() if name in parameters}
+    if len(options) < len(_SQL_ENGINE_OPTIONS):
+        logging.info(f"{factory.__name__} does not accept {sorted(_SQL_ENGINE_OPTIONS.keys() - options.keys())}")
+    return options
+
+
+@st.cache_resource(show_spinner=False)
+def _connected_sql_engine() -> Engine:
+    # raises when the database cannot be reached, and st.cache_resource does not cache exceptions
+    factory = create_psc_iam_engine if "K_SERVICE" in os.environ else create_read_engine
+    engine = factory(**_engine_options(factory))
+    try:
+        _check_connection(engine)
+    except Exception:
+        engine.dispose()
+        raise
+    return engine
+
+
+@st.cache_resource(show_spinner=False)
+def _fallback_sql_engine() -> Engine:
+    return create_engine("sqlite:///:memory:")
+
+
+def get_sql_engine() -> Engine:
+    # Without a database the fake in-memory one is used, but only until the next attempt: the real
+    # engine is tried again SQL_RETRY_SECONDS after a failure instead of being replaced for the process.
+    global _sql_failed_at
+    if time.monotonic() - _sql_failed_at >= SQL_RETRY_SECONDS:
+        try:
+            return _connected_sql_engine()
+        except Exception as e:
+            _sql_failed_at = time.monotonic()
+            logging.warning(f"Could not connect to the database: {e!r} - using a fake in-memory database instead.")
+    return _fallback_sql_engine()
+
+
+@st.cache_resource(show_spinner=False)
+def get_bq_client() -> bigquery.Client:
+    return bigquery.Client()
+
+
+@st.cache_resource(show_spinner=False)
+def get_bqstorage_client() -> bigquery_storage.BigQueryReadClient:
+    return bigquery_storage.BigQueryReadClient()
+
+
+@st.cache_resource(show_spinner=False)
+def get_storage_client() -> storage.Client:
+    return storage.Client()
+
+
+_ACCESSORS = {
+    "sql_engine": get_sql_engine,
+    "bq_client": get_bq_client,
+    "bqstorage_client": get_bqstorage_client,
+    "storage_client": get_storage_client,
+}
+
+
+def __getattr__(name: str) -> Any:  # noqa: ANN401
+    # Keeps `from common.connectivity import bq_client` etc. working, the client is created on first access
+    if name in _ACCESSORS:
+        return _ACCESSORS[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,17 +1,132 @@
+import os
+import threading
+import time
+from collections.abc import Callable, Hashable, Iterator, Mapping
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import Any
+
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 import streamlit as st
 from google.cloud import bigquery
+from google.cloud.bigquery.table import RowIterator
 from sqlalchemy import TextClause, text
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
-from common.connectivity import bq_client, sql_engine
+from common.connectivity import get_bq_client, get_bqstorage_client, get_sql_engine
+from common.frame_cache import FINGERPRINT_ATTR, adopt_fingerprint, stamp_query_fingerprint
+from common.query_budget import DOWNGRADED_ATTR, enforce_query_budget
+from common.query_builder import QueryParams
+from common.result_cache import query_cache_key, read_cached_frame, write_cached_frame
+from common.telemetry import bind_page, current_page, record_frame, track, update_current_record
 
 # We need to use st.cache_data to cache the results of the queries
 # This, however, is automatically done on the API client library side
 # so we only need to do it for the  queries here
+# st.cache_data only lives as long as the process, so BigQuery results are also persisted
+# as Parquet (see common.result_cache) and survive restarts and new Cloud Run instances
+
+# Size of the thread pool that runs submitted queries, shared by all sessions of the process
+MAX_CONCURRENT_QUERIES = int(os.environ.get("BQ_MAX_CONCURRENT_QUERIES", "16"))
+
+
+def _arrow_types_mapper(pa_type: pa.DataType) -> pd.ArrowDtype | None:
+    # Dictionary encoded columns become pandas categoricals, all other columns stay Arrow backed
+    if pa.types.is_dictionary(pa_type):
+        return None
+    return pd.ArrowDtype(pa_type)
+
+
+def _dictionary_encode_strings(batch: pa.RecordBatch | pa.Table) -> pa.RecordBatch | pa.Table:
+    columns = [
+        pc.dictionary_encode(column)
+        if pa.types.is_string(column.type) or pa.types.is_large_string(column.type)
+        else column
+        for column in batch.columns
+    ]
+    return type(batch).from_arrays(columns, names=batch.schema.names)
+
+
+def _record_job(rows: RowIterator, df: pd.DataFrame, build_start: float) -> None:
+    update_current_record(
+        cache="miss",
+        job_id=rows.job_id,
+        total_bytes_processed=rows.total_bytes_processed,
+        slot_millis=rows.slot_millis,
+        rows=len(df),
+        dataframe_ms=(time.perf_counter() - build_start) * 1000,
+    )
+
+
+def _fetch_dataframe(qry_str: str, job_config: bigquery.QueryJobConfig | None = None) -> pd.DataFrame:
+    rows = get_bq_client().query_and_wait(qry_str, job_config=job_config)
+    build_start = time.perf_counter()
+    df = rows.to_dataframe()
+    _record_job(rows, df, build_start)
+    return df
+
+
+def _fetch_arrow_frame(qry_str: str, job_config: bigquery.QueryJobConfig | None = None) -> pd.DataFrame:
+    # Results are streamed through the BigQuery Storage Read API as Arrow record batches.
+    # String columns are dictionary encoded batch by batch, so repeated values such as county,
+    # municipality or product names are only held once in memory.
+    rows = get_bq_client().query_and_wait(qry_str, job_config=job_config)
+    build_start = time.perf_counter()
+    batches = [
+        _dictionary_encode_strings(batch) for batch in rows.to_arrow_iterable(bqstorage_client=get_bqstorage_client())
+    ]
+    table = pa.Table.from_batches(batches) if batches else _dictionary_encode_strings(rows.to_arrow())
+    df = table.to_pandas(types_mapper=_arrow_types_mapper)
+    _record_job(rows, df, build_start)
+    return df
+
+
+def _query_job_config(params: QueryParams) -> bigquery.QueryJobConfig | None:
+    if not params:
+        return None
+    return bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ArrayQueryParameter(name, bq_type, list(value))
+            if isinstance(value, list | tuple)
+            else bigquery.ScalarQueryParameter(name, bq_type, value)
+            for name, bq_type, value in params
+        ]
+    )
+
+
+def _uncache_downgraded(cached: Callable, df: pd.DataFrame, *args: Any) -> None:  # noqa: ANN401
+    # st.cache_data has no per-call opt out, so a downgraded result is dropped again right away
+    if df.attrs.get(DOWNGRADED_ATTR):
+        cached.clear(*args)
+
+
+def _cached_bigquery_frame(qry_str: str, params: QueryParams = (), *, arrow: bool = False) -> pd.DataFrame:
+    key_params = {name: [bq_type, value] for name, bq_type, value in params} or None
+    key = query_cache_key(qry_str, {"params": key_params, "arrow": True} if arrow else key_params)
+    df = read_cached_frame(key)
+    if df is None:
+        update_current_record(cache="miss")
+        job_config = _query_job_config(params)
+        run_str = enforce_query_budget(qry_str, job_config)
+        df = _fetch_arrow_frame(run_str, job_config) if arrow else _fetch_dataframe(run_str, job_config)
+        if run_str == qry_str:
+            stamp_query_fingerprint(df, key)
+            write_cached_frame(key, df)
+        else:
+            # a result of the pre-aggregated source is only for the session over its budget, so it is
+            # not stored under the key of the original query (see _uncache_downgraded)
+            stamp_query_fingerprint(df, query_cache_key(run_str, key_params))
+            df.attrs[DOWNGRADED_ATTR] = True
+    else:
+        update_current_record(cache="parquet", rows=len(df))
+        if FINGERPRINT_ATTR not in df.attrs:
+            stamp_query_fingerprint(df, key)
+    return df
 
 
 @st.cache_data
-def example_sql_function(country_code: str) -> pd.DataFrame:
+def _example_sql_frame(country_code: str) -> pd.DataFrame:
     query: TextClause = text(
         """SELECT
             country_code, mnc, network_name_detailed
@@ -19,10 +134,11 @@ def example_sql_function(country_code: str) -> pd.DataFrame:
             financial_forecast.mobile_network_detailed
         WHERE country_code = :cc"""
     )
+    update_current_record(cache="miss")
     try:
         return pd.read_sql(
             query,
-            con=sql_engine,
+            con=get_sql_engine(),
             params={"cc": country_code},
         )
     except Exception as e:
@@ -30,8 +146,16 @@ def example_sql_function(country_code: str) -> pd.DataFrame:
         return pd.DataFrame()
 
 
+def example_sql_function(country_code: str) -> pd.DataFrame:
+    with track("sql", "financial_forecast.mobile_network_detailed") as record:
+        record.cache = "memory"
+        df = _example_sql_frame(country_code)
+        record_frame(record, df)
+        return df
+
+
 @st.cache_data
-def example_bigquery_function(country: str) -> pd.DataFrame:
+def _example_bigquery_frame(country: str) -> pd.DataFrame:
     query_string = """
     SELECT topic, sub_topic, COUNT(*) AS counter
     FROM `spectrum-analytics-secure.facebook_insights.dashboard_data`
@@ -40,26 +164,160 @@ def example_bigquery_function(country: str) -> pd.DataFrame:
     GROUP BY ALL
     """
     try:
-        return bq_client.query_and_wait(
-            query_string,
-            job_config=bigquery.QueryJobConfig(
-                query_parameters=[bigquery.ScalarQueryParameter("country", "STRING", country)]
-            ),
-        ).to_dataframe()
+        return _cached_bigquery_frame(query_string, params=(("country", "STRING", country),))
     except Exception as e:
         st.error(f"An error occurred while querying BigQuery: {e}")
         return pd.DataFrame()
 
 
+def example_bigquery_function(country: str) -> pd.DataFrame:
+    with track("bigquery", "facebook_insights.dashboard_data") as record:
+        record.cache = "memory"
+        df = adopt_fingerprint(_example_bigquery_frame(country))
+        _uncache_downgraded(_example_bigquery_frame, df, country)
+        record_frame(record, df)
+        return df
+
+
 # General BigQuery queries
 
 
-@st.cache_data
-def general_bigquery_query(qry_str: str) -> pd.DataFrame:
+# Exceptions are not cached by st.cache_data, so a failed query is retried on the next rerun.
+# No spinner, as this is also called from the worker threads of run_bigquery_queries.
+@st.cache_data(show_spinner=False)
+def _general_bigquery_frame(qry_str: str, params: QueryParams = ()) -> pd.DataFrame:
+    return _cached_bigquery_frame(qry_str, params)
+
+
+# Parameters are (name, BigQuery type, value) tuples, see common.query_builder.
+# Unlike general_bigquery_query a failed query raises, e.g. so that loaders do not cache an empty result.
+def strict_bigquery_query(qry_str: str, params: QueryParams = ()) -> pd.DataFrame:
+    with track("bigquery", qry_str) as record:
+        record.cache = "memory"
+        df = adopt_fingerprint(_general_bigquery_frame(qry_str, params))
+        _uncache_downgraded(_general_bigquery_frame, df, qry_str, params)
+        record_frame(record, df)
+        return df
+
+
+def general_bigquery_query(qry_str: str, params: QueryParams = ()) -> pd.DataFrame:
+    try:
+        return strict_bigquery_query(qry_str, params)
+    except Exception as e:
+        st.error(f"An error occurred while querying BigQuery: {e}")
+        return pd.DataFrame()
+
+
+# Non-blocking queries
+# Jobs run on one thread pool shared by all sessions. Jobs submitted from a job run inline on its worker,
+# as a job waiting for jobs queued behind it could otherwise hold all workers and deadlock. Submitted
+# functions must not write to the page: rendering happens on the script thread.
+QUERY_THREAD_PREFIX = "query"
+
+
+@st.cache_resource(show_spinner=False)
+def _query_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=MAX_CONCURRENT_QUERIES, thread_name_prefix=QUERY_THREAD_PREFIX)
+
+
+def _on_query_worker() -> bool:
+    return threading.current_thread().name.startswith(f"{QUERY_THREAD_PREFIX}_")
+
+
+def submit_query(func: Callable, *args: Any, **kwargs: Any) -> Future:  # noqa: ANN401
+    """Run `func(*args, **kwargs)` in the background and return its Future right away."""
+    if _on_query_worker():
+        # the worker already carries the script context and page of its job
+        job: Future = Future()
+        try:
+            job.set_result(func(*args, **kwargs))
+        except Exception as e:
+            job.set_exception(e)
+        return job
+
+    ctx = get_script_run_ctx(suppress_warning=True)
+    page = current_page()
+
+    def run() -> Any:  # noqa: ANN401
+        add_script_run_ctx(threading.current_thread(), ctx)
+        with bind_page(page):
+            return func(*args, **kwargs)
+
+    return _query_executor().submit(run)
+
+
+def _split_query(query: str | tuple[str, QueryParams]) -> tuple[str, QueryParams]:
+    return (query, ()) if isinstance(query, str) else query
+
+
+def submit_bigquery_query(qry_str: str, params: QueryParams = ()) -> Future[pd.DataFrame]:
+    return submit_query(strict_bigquery_query, qry_str, params)
+
+
+def submit_bigquery_queries(
+    queries: Mapping[Hashable, str | tuple[str, QueryParams]],
+) -> dict[Hashable, Future[pd.DataFrame]]:
+    return {key: submit_bigquery_query(*_split_query(query)) for key, query in queries.items()}
+
+
+def query_result(job: Future[pd.DataFrame], label: str = "") -> pd.DataFrame:
+    # Waits for a submitted query. Errors are shown on the page and give an empty result.
+    try:
+        return job.result()
+    except Exception as e:
+        st.error(f"An error occurred while querying{f' ({label})' if label else ''}: {e}")
+        return pd.DataFrame()
+
+
+def iter_completed(jobs: Mapping[Hashable, Future[pd.DataFrame]]) -> Iterator[tuple[Hashable, pd.DataFrame]]:
+    """Yield (key, result) pairs in the order the jobs finish, so a page can render each section as soon as
+    its data lands (typically into an st.empty() placeholder created up front)."""
+    keys = {job: key for key, job in jobs.items()}
+    for job in as_completed(keys):
+        yield keys[job], query_result(job, str(keys[job]))
+
+
+def run_bigquery_queries(
+    queries: Mapping[Hashable, str | tuple[str, QueryParams]],
+    *,
+    skip_failed: bool = False,
+) -> dict[Hashable, pd.DataFrame]:
+    # Independent queries are run concurrently so a page waits for its slowest query instead of the sum
+    # of all of them. A failing query only empties its own result, the others are returned as usual.
+    # With skip_failed the failed queries are left out of the result instead.
+    if not queries:
+        return {}
+    results: dict[Hashable, pd.DataFrame] = {}
+    with st.spinner(f"Running {len(queries)} BigQuery queries..."):
+        for key, job in submit_bigquery_queries(queries).items():
+            try:
+                results[key] = job.result()
+            except Exception as e:
+                st.error(f"An error occurred while querying BigQuery ({key}): {e}")
+                if not skip_failed:
+                    results[key] = pd.DataFrame()
+    return results
+
+
+# Arrow backed variant for large results: strings come back as categoricals and all other
+# columns as pd.ArrowDtype. Pass `columns` to only select (and transfer) the columns a page needs.
+@st.cache_data(show_spinner=False)
+def _arrow_bigquery_frame(qry_str: str, params: QueryParams = ()) -> pd.DataFrame:
+    return _cached_bigquery_frame(qry_str, params, arrow=True)
+
+
+def arrow_bigquery_query(
+    qry_str: str, columns: tuple[str, ...] | None = None, params: QueryParams = ()
+) -> pd.DataFrame:
+    if columns:
+        qry_str = f"SELECT {', '.join(f'`{c}`' for c in columns)} FROM ({qry_str})"
     try:
-        return bq_client.query_and_wait(
-            qry_str,
-        ).to_dataframe()
+        with track("bigquery.arrow", qry_str) as record:
+            record.cache = "memory"
+            df = adopt_fingerprint(_arrow_bigquery_frame(qry_str, params))
+            _uncache_downgraded(_arrow_bigquery_frame, df, qry_str, params)
+            record_frame(record, df)
+            return df
     except Exception as e:
         st.error(f"An error occurred while querying BigQuery: {e}")
         return pd.DataFrame()
@@ -0,0 +1,108 @@
+import io
+import re
+import zipfile
+from collections.abc import Callable, Mapping
+from typing import IO
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import streamlit as st
+from openpyxl import Workbook
+from pandas.api.types import infer_dtype
+
+from common.tables import column_label
+
+# Excel and Parquet export of report tables. Frames are written in chunks of EXPORT_CHUNK_ROWS rows:
+# Excel through an openpyxl write-only workbook, which streams rows to disk instead of keeping a cell
+# object per value, and Parquet as one row group per chunk. Exports are only built when asked for.
+EXPORT_CHUNK_ROWS = 10_000
+EXCEL_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def _flat_frame(df: pd.DataFrame) -> pd.DataFrame:
+    # index levels become columns and MultiIndex columns are flattened, as in render_table
+    if isinstance(df.index, pd.MultiIndex) or df.index.name is not None:
+        df = df.reset_index()
+    return df.set_axis([column_label(column) for column in df.columns], axis=1)
+
+
+def _chunks(df: pd.DataFrame) -> list[pd.DataFrame]:
+    return [df.iloc[start : start + EXPORT_CHUNK_ROWS] for start in range(0, len(df), EXPORT_CHUNK_ROWS)]
+
+
+def _sheet_title(name: str, used: set[str]) -> str:
+    # Excel sheet names are at most 31 characters, without []:*?/\
+    title = re.sub(r"[\[\]:*?/\\]", " ", name)[:31] or "Sheet"
+    base, n = title, 1
+    while title in used:
+        n += 1
+        title = f"{base[: 31 - len(str(n)) - 1]} {n}"
+    used.add(title)
+    return title
+
+
+def write_excel(sheets: Mapping[str, pd.DataFrame], target: IO[bytes]) -> None:
+    """Write every frame in `sheets` to its own sheet of one workbook."""
+    workbook = Workbook(write_only=True)
+    used: set[str] = set()
+    for name, df in sheets.items():
+        sheet = workbook.create_sheet(_sheet_title(name, used))
+        df = _flat_frame(df)
+        sheet.append(list(df.columns))
+        for chunk in _chunks(df):
+            # Python values, missing values as empty cells
+            for row in chunk.astype(object).where(chunk.notna(), None).to_numpy().tolist():
+                sheet.append(row)
+    workbook.save(target)
+
+
+def write_parquet(df: pd.DataFrame, target: IO[bytes]) -> None:
+    df = _flat_frame(df)
+    # label columns that mix types (e.g. "Total" next to ids) are written as text
+    mixed = [c for c in df.columns if df[c].dtype == object and infer_dtype(df[c], skipna=True).startswith("mixed")]
+    df = df.astype(dict.fromkeys(mixed, str))
+    chunks = _chunks(df) or [df]
+    first = pa.Table.from_pandas(chunks[0], preserve_index=False)
+    with pq.ParquetWriter(target, first.schema) as writer:
+        writer.write_table(first)
+        for chunk in chunks[1:]:
+            writer.write_table(pa.Table.from_pandas(chunk, schema=first.schema, preserve_index=False))
+
+
+def _export_bytes(sheets: Mapping[str, pd.DataFrame], file_format: str) -> bytes:
+    buffer = io.BytesIO()
+    if file_format == "Excel":
+        write_excel(sheets, buffer)
+    elif len(sheets) == 1:
+        write_parquet(next(iter(sheets.values())), buffer)
+    else:
+        # one Parquet file per sheet
+        with zipfile.ZipFile(buffer, "w") as archive:
+            for name, df in sheets.items():
+                part = io.BytesIO()
+                write_parquet(df, part)
+                archive.writestr(f"{name}.parquet", part.getvalue())
+    return buffer.getvalue()
+
+
+def export_buttons(build_sheets: Callable[[], Mapping[str, pd.DataFrame]], file_stem: str, key: str) -> None:
+    """Excel/Parquet download of the frames returned by `build_sheets` (sheet name -> frame).
+
+    `build_sheets` is only called when the user asks for the file, not on every rerun.
+    """
+    col_format, col_prepare, col_download = st.columns([2, 1, 1], vertical_alignment="bottom")
+    file_format = col_format.radio("Export as", ["Excel", "Parquet"], horizontal=True, key=f"{key}_format")
+    if col_prepare.button("Prepare file", key=f"{key}_prepare"):
+        sheets = build_sheets()
+        if file_format == "Excel":
+            file_name, mime = f"{file_stem}.xlsx", EXCEL_MIME
+        elif len(sheets) == 1:
+            file_name, mime = f"{file_stem}.parquet", "application/octet-stream"
+        else:
+            file_name, mime = f"{file_stem}.zip", "application/zip"
+        with st.spinner("Writing file..."):
+            data = _export_bytes(sheets, file_format)
+        col_download.download_button(
+            "Download", data, file_name=file_name, mime=mime, on_click="ignore", key=f"{key}_download"
+        )
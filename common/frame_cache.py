@@ -0,0 +1,175 @@
+import functools
+import hashlib
+import json
+import time
+import uuid
+import weakref
+from collections.abc import Callable
+from typing import Any
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+# Content fingerprints for DataFrames, used as O(1) cache keys for transformations of query results.
+# Query results are stamped with (query hash, load time) when they are loaded, derived frames with the
+# fingerprints of their inputs plus the transformation parameters. The fingerprint lives in df.attrs,
+# so it survives st.cache_data copies and the Parquet cache.
+# pandas copies attrs onto every frame derived from a stamped one (filters, merges, copies that are then
+# modified), so a stamp is only trusted on the frame object it was put on. Any other frame is hashed in
+# full once, unless the caches below hand it out as an unmodified copy (adopt_fingerprint).
+FINGERPRINT_ATTR = "fingerprint"
+_SIGNATURE_SAMPLE_ROWS = 64
+_shared_frames: list[Callable] = []
+_stamp_owners: weakref.WeakValueDictionary[str, pd.DataFrame] = weakref.WeakValueDictionary()
+
+
+def _content_hash(df: pd.DataFrame) -> bytes:
+    try:
+        return pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes()
+    except TypeError:
+        # unhashable cell values such as lists
+        return df.astype(str).to_csv().encode("utf-8")
+
+
+def _signature(df: pd.DataFrame) -> str:
+    # cheap check that the owner of a stamp still has the shape, columns and sampled rows it was stamped with
+    positions = np.unique(np.linspace(0, len(df) - 1, num=min(len(df), _SIGNATURE_SAMPLE_ROWS), dtype=int))
+    material = f"{df.shape}|{list(df.columns)}|{list(df.dtypes.astype(str))}".encode()
+    return hashlib.sha256(material + _content_hash(df.iloc[positions])).hexdigest()
+
+
+def _material(part: Any) -> Any:  # noqa: ANN401
+    if isinstance(part, pd.DataFrame):
+        return frame_fingerprint(part)
+    if isinstance(part, list | tuple):
+        return [_material(p) for p in part]
+    if isinstance(part, dict):
+        return {str(k): _material(v) for k, v in part.items()}
+    return part
+
+
+def _hash_parts(parts: tuple) -> str:
+    return hashlib.sha256(json.dumps(_material(parts), default=repr).encode("utf-8")).hexdigest()
+
+
+def _own_stamp(df: pd.DataFrame, stamp: dict) -> None:
+    owner = uuid.uuid4().hex
+    df.attrs[FINGERPRINT_ATTR] = {**stamp, "owner": owner}
+    _stamp_owners[owner] = df
+
+
+def stamp_fingerprint(df: pd.DataFrame, *parts: Any) -> pd.DataFrame:  # noqa: ANN401
+    """Stamp `df` with a fingerprint built from `parts` (DataFrames contribute their own fingerprint)."""
+    _own_stamp(df, {"fingerprint": _hash_parts(parts), "signature": _signature(df)})
+    return df
+
+
+def adopt_fingerprint(df: pd.DataFrame) -> pd.DataFrame:
+    """Trust the stamp `df` carries. Only for unmodified copies of a stamped frame, such as the frames
+    returned by st.cache_data or read back from the Parquet cache."""
+    stamp = df.attrs.get(FINGERPRINT_ATTR)
+    if isinstance(stamp, dict) and "fingerprint" in stamp and _stamp_owners.get(stamp.get("owner")) is not df:
+        _own_stamp(df, stamp)
+    return df
+
+
+def stamp_query_fingerprint(df: pd.DataFrame, query_key: str) -> pd.DataFrame:
+    return stamp_fingerprint(df, "query", query_key, time.time())
+
+
+def frame_fingerprint(df: pd.DataFrame) -> str:
+    stamp = df.attrs.get(FINGERPRINT_ATTR)
+    if (
+        isinstance(stamp, dict)
+        and _stamp_owners.get(stamp.get("owner")) is df
+        and stamp.get("signature") == _signature(df)
+    ):
+        return stamp["fingerprint"]
+    # Not stamped, or a stamp copied from another frame: hash the full content once and keep the result
+    stamp_fingerprint(df, list(map(str, df.columns)), hashlib.sha256(_content_hash(df)).hexdigest())
+    return df.attrs[FINGERPRINT_ATTR]["fingerprint"]
+
+
+def _stamped(func: Callable, *, load_time: bool = False) -> Callable:
+    @functools.wraps(func)
+    def stamped(*args: Any, **kwargs: Any) -> Any:  # noqa: ANN401
+        result = func(*args, **kwargs)
+        extra = (time.time(),) if load_time else ()
+        if isinstance(result, pd.DataFrame):
+            stamp_fingerprint(result, func.__qualname__, args, sorted(kwargs.items()), *extra)
+        elif isinstance(result, dict):
+            # e.g. one frame per level, each stamped with its key
+            for key, value in result.items():
+                if isinstance(value, pd.DataFrame):
+                    stamp_fingerprint(value, func.__qualname__, args, sorted(kwargs.items()), key, *extra)
+        return result
+
+    return stamped
+
+
+def _adopted(result: Any) -> Any:  # noqa: ANN401
+    if isinstance(result, pd.DataFrame):
+        return adopt_fingerprint(result)
+    if isinstance(result, dict):
+        return {key: _adopted(value) for key, value in result.items()}
+    return result
+
+
+def derived_frame(func: Callable) -> Callable:
+    """st.cache_data for transformations of DataFrames, keyed by the fingerprints of the input frames
+    instead of their content. DataFrame results are stamped so they can be passed on to other derived frames.
+    """
+    cached = st.cache_data(show_spinner=False, hash_funcs={pd.DataFrame: frame_fingerprint})(_stamped(func))
+
+    @functools.wraps(func)
+    def copy(*args: Any, **kwargs: Any) -> Any:  # noqa: ANN401
+        # st.cache_data returns an unpickled copy of the stamped result
+        return _adopted(cached(*args, **kwargs))
+
+    copy.clear = cached.clear
+    return copy
+
+
+def derived_resource(func: Callable) -> Callable:
+    """st.cache_resource keyed like derived_frame, for read-only objects built from query results
+    (e.g. indexes) that should be shared instead of copied on every rerun."""
+    return st.cache_resource(show_spinner=False, max_entries=8, hash_funcs={pd.DataFrame: frame_fingerprint})(func)
+
+
+def _shallow_copy(result: Any) -> Any:  # noqa: ANN401
+    if isinstance(result, pd.DataFrame):
+        # without copy-on-write a shallow copy would let callers write into the shared arrays
+        return adopt_fingerprint(result.copy(deep=not pd.get_option("mode.copy_on_write")))
+    if isinstance(result, dict):
+        return {key: _shallow_copy(value) for key, value in result.items()}
+    return result
+
+
+def shared_frame(func: Callable | None = None, *, max_entries: int = 16) -> Callable:
+    """Like derived_frame, but the result is held once per process with st.cache_resource instead of being
+    unpickled for every caller. Callers get a shallow copy that shares the cached arrays. With copy-on-write
+    (enabled in st_app.py) a caller that modifies its frame only copies the columns it changes.
+
+    At most `max_entries` argument combinations are held; use `@shared_frame(max_entries=...)` to keep
+    fewer of a large frame. Exceptions are not cached, so a loader should let a failed query raise.
+    """
+    if func is None:
+        return functools.partial(shared_frame, max_entries=max_entries)
+    # stamped with the load time, so frames derived from an earlier load are not reused after a clear
+    cached = st.cache_resource(
+        show_spinner=False, max_entries=max_entries, hash_funcs={pd.DataFrame: frame_fingerprint}
+    )(_stamped(func, load_time=True))
+    _shared_frames.append(cached)
+
+    @functools.wraps(func)
+    def view(*args: Any, **kwargs: Any) -> Any:  # noqa: ANN401
+        return _shallow_copy(cached(*args, **kwargs))
+
+    view.clear = cached.clear
+    return view
+
+
+def clear_shared_frames() -> None:
+    for cached in _shared_frames:
+        cached.clear()
@@ -0,0 +1,72 @@
+import contextlib
+import threading
+from collections.abc import Mapping
+from datetime import UTC, datetime
+
+import pandas as pd
+
+from common.frame_cache import stamp_fingerprint
+
+# Compact dtypes for query results, applied once when a page loads its base frames.
+# A schema maps column names to dtypes: "category" for repeated strings and ids (geo hierarchy, products,
+# packages), "int32" for period keys and "float32" for measures that stay exact in float32, such as
+# subscriber counts, or that are widened before they are summed. Columns not in the schema are kept as is.
+# Group by categorical columns with observed=True. Frames that are merged with each other are normalized
+# together, so their categorical merge keys share categories and stay categorical in the result.
+_footprints: dict[str, dict] = {}
+_footprints_lock = threading.Lock()
+
+
+def frame_memory_bytes(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def _cast(column: pd.Series, dtype: str | pd.CategoricalDtype) -> pd.Series:
+    if isinstance(dtype, str) and dtype.startswith("int") and column.isna().any():
+        # nullable integer instead of failing on missing values
+        return column.astype(dtype.capitalize())
+    return column.astype(dtype)
+
+
+def normalize_frame(df: pd.DataFrame, schema: Mapping[str, str | pd.CategoricalDtype], name: str) -> pd.DataFrame:
+    """Cast the columns of `df` listed in `schema` and record the memory footprint under `name`."""
+    casts = {column: _cast(df[column], dtype) for column, dtype in schema.items() if column in df.columns}
+    # the fingerprint of the input carries over, so the result is still an O(1) cache key
+    normalized = stamp_fingerprint(df.assign(**casts), "normalize_frame", df, schema)
+    with _footprints_lock:
+        _footprints[name] = {
+            "frame": name,
+            "rows": len(df),
+            "mb_before": frame_memory_bytes(df) / 1e6,
+            "mb_after": frame_memory_bytes(normalized) / 1e6,
+            "normalized_at": datetime.now(UTC),
+        }
+    return normalized
+
+
+def fill_numeric(df: pd.DataFrame, value: float = 0) -> pd.DataFrame:
+    # fillna for frames with categorical columns, which cannot take a fill value outside their categories
+    return df.fillna(dict.fromkeys(df.select_dtypes("number").columns, value))
+
+
+def normalize_frames(
+    frames: Mapping[str, pd.DataFrame], schema: Mapping[str, str], name: str
+) -> dict[str, pd.DataFrame]:
+    """normalize_frame for frames that are merged with each other, with shared categories per column."""
+    shared_schema = {}
+    for column, dtype in schema.items():
+        present = [df[column] for df in frames.values() if column in df.columns]
+        if dtype == "category" and present:
+            categories = pd.Index(pd.concat(present, ignore_index=True).dropna().unique())
+            with contextlib.suppress(TypeError):  # mixed types keep their order of appearance
+                categories = categories.sort_values()
+            shared_schema[column] = pd.CategoricalDtype(categories)
+        else:
+            shared_schema[column] = dtype
+    return {key: normalize_frame(df, shared_schema, f"{name}.{key}") for key, df in frames.items()}
+
+
+def frame_footprints() -> pd.DataFrame:
+    with _footprints_lock:
+        footprints = list(_footprints.values())
+    return pd.DataFrame(footprints, columns=["frame", "rows", "mb_before", "mb_after", "normalized_at"])
@@ -0,0 +1,41 @@
+from collections.abc import Hashable
+
+import numpy as np
+import pandas as pd
+
+from common.frame_cache import derived_resource
+
+# Drill-down lookups for geo selectors (fylke -> kommune -> postnummer). The rows of a frame are sorted
+# once by an area column, so the rows of one area are a contiguous slice instead of a boolean mask over
+# the whole frame. Within an area the rows keep their original order.
+
+
+class GeoIndex:
+    """Row ranges of `df` per value of the `by` column."""
+
+    def __init__(self, df: pd.DataFrame, by: str) -> None:
+        codes, keys = pd.factorize(df[by])
+        order = np.argsort(codes, kind="stable")
+        # rows with a missing value (code -1) sort first and are left out
+        bounds = np.searchsorted(codes[order], np.arange(len(keys) + 1))
+        self.frame = df.iloc[order]
+        self._keys = list(keys)
+        self._ranges = {key: (bounds[i], bounds[i + 1]) for i, key in enumerate(self._keys)}
+
+    def keys(self) -> list:
+        # in order of first appearance in the frame
+        return self._keys
+
+    def rows(self, key: Hashable) -> pd.DataFrame:
+        start, stop = self._ranges.get(key, (0, 0))
+        return self.frame.iloc[start:stop]
+
+    def values(self, key: Hashable, column: str) -> np.ndarray:
+        # e.g. the ids of all areas with the name `key`
+        return self.rows(key)[column].unique()
+
+
+# built once per dataset and shared by all reruns
+@derived_resource
+def geo_index(df: pd.DataFrame, by: str) -> GeoIndex:
+    return GeoIndex(df, by)
@@ -0,0 +1,244 @@
+from collections.abc import Iterable, Mapping
+from dataclasses import dataclass
+from typing import Self
+
+import numpy as np
+import pandas as pd
+
+# In-memory cube over the SDU invoice summary (month, subscription package, package ids, product, area).
+# It is built once per loaded dataset from rows at postcode grain. Every geo level is pre-aggregated
+# into integer-coded NumPy arrays, so product filters, geo level switches, area drill-downs and
+# subscriber thresholds are answered with bincounts instead of regrouping the raw frame. Cubes over
+# disjoint months, such as one per year, are combined without rebuilding them.
+# Total subscribers follow the page definition: per (month, package ids, package, area), the largest
+# number of unique subscribers over all products, independent of the products selected. Rollups sum
+# these maxima over the package ids.
+MONTH = "PERIOD_YEAR_MONTH"
+PACKAGE = "subscription_package"
+PACKAGE_IDS = "subscription_package_ids"
+PRODUCT = "product_id"
+PRODUCT_NAME = "product_name"
+
+
+@dataclass(frozen=True)
+class _Level:
+    areas: pd.DataFrame  # one row per area, columns of the level
+    # (month, package, package ids, area) cells with the total subscribers over all products; the
+    # package ids only separate the cells, they are not needed after the build
+    cell_month: np.ndarray
+    cell_package: np.ndarray
+    cell_area: np.ndarray
+    cell_total_subs: np.ndarray
+    cell_group: np.ndarray  # (month, package, area) of the cell
+    # facts: one entry per (cell, product)
+    fact_cell: np.ndarray
+    fact_product: np.ndarray
+    fact_rev: np.ndarray
+    fact_subs: np.ndarray
+
+
+def _codes(values: pd.Series | pd.Index) -> tuple[np.ndarray, np.ndarray]:
+    codes, uniques = pd.factorize(values, sort=True, use_na_sentinel=False)
+    return codes.astype(np.int64), np.asarray(uniques)
+
+
+def _merge_labels(labels: list[np.ndarray]) -> tuple[np.ndarray, list[np.ndarray]]:
+    # sorted union of the labels of several cubes, and per cube the position of its labels in the union
+    union = pd.Index(np.concatenate(labels)).unique().sort_values()
+    return np.asarray(union), [union.get_indexer(part) for part in labels]
+
+
+def _build_level(
+    df: pd.DataFrame,
+    columns: list[str],
+    month: np.ndarray,
+    package: np.ndarray,
+    package_ids: np.ndarray,
+    product: np.ndarray,
+    n_packages: int,
+    n_package_ids: int,
+    n_products: int,
+) -> _Level:
+    grouped = df.groupby(columns, sort=True, dropna=True, observed=True)
+    # rows with a missing area column are left out, as in a groupby on the raw frame
+    area = grouped.ngroup().fillna(-1).to_numpy(dtype=np.int64)
+    areas = grouped.size().index.to_frame(index=False)
+    keep = area >= 0
+    n_areas = max(len(areas), 1)
+
+    # sum the rows per (month, package, package ids, product, area)
+    cell_prefix = (month[keep] * n_packages + package[keep]) * n_package_ids + package_ids[keep]
+    key = (cell_prefix * n_products + product[keep]) * n_areas + area[keep]
+    facts, inverse = np.unique(key, return_inverse=True)
+    rev = np.bincount(inverse, weights=df["rev_tot"].fillna(0).to_numpy(dtype=float)[keep], minlength=len(facts))
+    subs = np.bincount(inverse, weights=df["unique_subs"].fillna(0).to_numpy(dtype=float)[keep], minlength=len(facts))
+    fact_area = facts % n_areas
+    rest = facts // n_areas
+    fact_product = rest % n_products
+    rest //= n_products
+
+    # (month, package, package ids, area) cells, total subscribers = max over products
+    cells, fact_cell = np.unique(rest * n_areas + fact_area, return_inverse=True)
+    order = np.argsort(fact_cell, kind="stable")
+    starts = np.flatnonzero(np.r_[True, np.diff(fact_cell[order]) != 0])
+    total_subs = np.maximum.reduceat(subs[order], starts) if len(order) else np.zeros(0)
+    cell_rest = cells // n_areas // n_package_ids
+    _, cell_group = np.unique(cell_rest * n_areas + cells % n_areas, return_inverse=True)
+
+    return _Level(
+        areas=areas,
+        cell_month=cell_rest // n_packages,
+        cell_package=cell_rest % n_packages,
+        cell_area=cells % n_areas,
+        cell_total_subs=total_subs,
+        cell_group=cell_group,
+        fact_cell=fact_cell,
+        fact_product=fact_product,
+        fact_rev=rev,
+        fact_subs=subs,
+    )
+
+
+def _concat_levels(
+    levels: list[_Level], month_maps: list[np.ndarray], package_maps: list[np.ndarray], product_maps: list[np.ndarray]
+) -> _Level:
+    parts = [level.areas.astype(object) for level in levels]
+    areas = pd.concat(parts).drop_duplicates()
+    areas = areas.sort_values(list(areas.columns)).reset_index(drop=True)
+    area_index = pd.MultiIndex.from_frame(areas)
+    area_maps = [area_index.get_indexer(pd.MultiIndex.from_frame(part)) for part in parts]
+    cell_offsets = np.cumsum([0, *(len(level.cell_month) for level in levels[:-1])])
+    group_offsets = np.cumsum([0, *(level.cell_group.max(initial=-1) + 1 for level in levels[:-1])])
+
+    def remapped(field: str, maps: list[np.ndarray]) -> np.ndarray:
+        return np.concatenate([codes[getattr(level, field)] for level, codes in zip(levels, maps, strict=True)])
+
+    return _Level(
+        areas=areas,
+        cell_month=remapped("cell_month", month_maps),
+        cell_package=remapped("cell_package", package_maps),
+        cell_area=remapped("cell_area", area_maps),
+        cell_total_subs=np.concatenate([level.cell_total_subs for level in levels]),
+        cell_group=np.concatenate(
+            [level.cell_group + offset for level, offset in zip(levels, group_offsets, strict=True)]
+        ),
+        fact_cell=np.concatenate(
+            [level.fact_cell + offset for level, offset in zip(levels, cell_offsets, strict=True)]
+        ),
+        fact_product=remapped("fact_product", product_maps),
+        fact_rev=np.concatenate([level.fact_rev for level in levels]),
+        fact_subs=np.concatenate([level.fact_subs for level in levels]),
+    )
+
+
+class InvoiceCube:
+    """Pre-aggregated invoice summary for every level in `levels` (name -> area columns, id column first)."""
+
+    def __init__(self, df: pd.DataFrame, levels: Mapping[str, list[str]]) -> None:
+        month, self.months = _codes(df[MONTH])
+        package, self.packages = _codes(df[PACKAGE])
+        package_ids, _ = _codes(df[PACKAGE_IDS])
+        n_package_ids = max(package_ids.max(initial=0) + 1, 1)
+        product, self.products = _codes(df[PRODUCT])
+        # products are reported by name, several ids can share one
+        names = df[PRODUCT_NAME].groupby(product, sort=True).first()
+        self.product_name_codes, self.product_names = _codes(names.astype(str))
+        self.levels = {
+            name: _build_level(
+                df, columns, month, package, package_ids, product, len(self.packages), n_package_ids, len(self.products)
+            )
+            for name, columns in levels.items()
+        }
+
+    @classmethod
+    def concat(cls, cubes: list[Self]) -> Self:
+        """Combine cubes over disjoint months (e.g. one per year) without going back to their rows."""
+        if len(cubes) == 1:
+            return cubes[0]
+        cube = cls.__new__(cls)
+        cube.months, month_maps = _merge_labels([c.months for c in cubes])
+        cube.packages, package_maps = _merge_labels([c.packages for c in cubes])
+        cube.products, product_maps = _merge_labels([c.products for c in cubes])
+        names = pd.concat([c.product_table()[PRODUCT_NAME] for c in cubes], ignore_index=True)
+        names = names.groupby(np.concatenate(product_maps), sort=True).first()
+        cube.product_name_codes, cube.product_names = _codes(names)
+        cube.levels = {
+            name: _concat_levels([c.levels[name] for c in cubes], month_maps, package_maps, product_maps)
+            for name in cubes[0].levels
+        }
+        return cube
+
+    def product_table(self) -> pd.DataFrame:
+        return pd.DataFrame({PRODUCT: self.products, PRODUCT_NAME: self.product_names[self.product_name_codes]})
+
+    def areas(self, level: str) -> pd.DataFrame:
+        return self.levels[level].areas
+
+    def _fact_mask(self, data: _Level, products: Iterable | None, area_id: object) -> np.ndarray:
+        mask = np.ones(len(data.fact_cell), dtype=bool)
+        if products is not None:
+            mask &= np.isin(self.products, list(products))[data.fact_product]
+        if area_id is not None:
+            id_column = data.areas.columns[0]
+            mask &= (data.areas[id_column] == area_id).to_numpy()[data.cell_area[data.fact_cell]]
+        return mask
+
+    def rollup(
+        self,
+        level: str,
+        by: str,
+        products: Iterable | None = None,
+        area_id: object = None,
+        min_subs: float = 0,
+    ) -> pd.DataFrame:
+        """Sum rev_tot, unique_subs and total_subs per month and `by` ("area", "subscription_package"
+        or "product_name") on `level`, for the selected products (all if None) and area id (all if None).
+
+        total_subs counts the packages (summed over their package ids) that have rows for the selected
+        products in each area, so it is not reported per product. Rows with total_subs below `min_subs` are dropped.
+        """
+        data = self.levels[level]
+        mask = self._fact_mask(data, products, area_id)
+
+        if by == PRODUCT_NAME:
+            group = self.product_name_codes[data.fact_product[mask]]
+            key = data.cell_month[data.fact_cell[mask]] * len(self.product_names) + group
+            labels = pd.DataFrame({PRODUCT_NAME: self.product_names})
+            return self._frame(key, labels, data.fact_rev[mask], data.fact_subs[mask])
+
+        n_cells = len(data.cell_month)
+        cell_rows = np.bincount(data.fact_cell[mask], minlength=n_cells)
+        cell_rev = np.bincount(data.fact_cell[mask], weights=data.fact_rev[mask], minlength=n_cells)
+        cell_subs = np.bincount(data.fact_cell[mask], weights=data.fact_subs[mask], minlength=n_cells)
+        # every package ids cell of a (month, package, area) counts once one of them has the products
+        group_rows = np.bincount(data.cell_group, weights=cell_rows, minlength=len(data.cell_group))
+        present = group_rows[data.cell_group] > 0
+        if by == "area":
+            labels = data.areas
+            group = data.cell_area[present]
+        elif by == PACKAGE:
+            labels = pd.DataFrame({PACKAGE: self.packages})
+            group = data.cell_package[present]
+        else:
+            raise ValueError(f"Unknown rollup dimension: {by}")
+        key = data.cell_month[present] * len(labels) + group
+        frame = self._frame(key, labels, cell_rev[present], cell_subs[present], data.cell_total_subs[present])
+        return frame[frame["total_subs"] >= min_subs].reset_index(drop=True) if min_subs else frame
+
+    def _frame(
+        self,
+        key: np.ndarray,
+        labels: pd.DataFrame,
+        rev: np.ndarray,
+        subs: np.ndarray,
+        total_subs: np.ndarray | None = None,
+    ) -> pd.DataFrame:
+        size = len(self.months) * len(labels)
+        rows = np.flatnonzero(np.bincount(key, minlength=size))
+        frame = labels.iloc[rows % len(labels)].reset_index(drop=True)
+        frame.insert(0, MONTH, self.months[rows // len(labels)])
+        frame["rev_tot"] = np.bincount(key, weights=rev, minlength=size)[rows]
+        frame["unique_subs"] = np.bincount(key, weights=subs, minlength=size)[rows]
+        if total_subs is not None:
+            frame["total_subs"] = np.bincount(key, weights=total_subs, minlength=size)[rows]
+        return frame
@@ -0,0 +1,275 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from common.data_queries import query_result, submit_bigquery_query
+from common.monthly_store import load_monthly
+
+# Invoice line ("fakturalinje") data for Fiber SDU subscriptions
+
+INVOICE_LINE_SUMMARY_STORE = "invoice_line_summary_v1"
+INVOICE_LINE_SUMMARY_KEYS = ["PERIOD_YEAR_MONTH", "subscription_type", "subscription_line"]
+INVOICE_LINE_SUMMARY_MEASURES = ["subscription_units", "tv_subs", "tilknytninger", "tilknytning_rev"]
+
+TV_PACKAGE = "Grunnpakke TV"
+# subscription types that are left out of the subscription type selection by default
+HIDDEN_SUBSCRIPTION_TYPES = (TV_PACKAGE, "Digital Grunnpakke B2B")
+
+
+def _abo_sql(month_condition: str) -> str:
+    return f"""
+  WITH
+    subs AS (
+      SELECT
+        b.ABONNENT_NR,
+        b.PERIOD_YEAR_MONTH,
+        s.billing_segment,
+        pd.SOURCE_SYSTEM_NAME,
+        pd.SOURCE_PRODUCT_ID_1,
+        b.PRODUKT_NR,
+        pd.PRODUCT_NAME,
+        SUM(
+          CASE
+            WHEN INVOICE_TERM = "T" THEN AMOUNT
+            ELSE 0
+            END)
+          - SUM(
+            CASE
+              WHEN INVOICE_TERM = "T" THEN DISCOUNT
+              ELSE 0
+              END) AS SUB_REVENUE_RECURRING_EXCL_MVA_TOTAL,
+        SUM(
+          CASE
+            WHEN INVOICE_TERM = "E" THEN AMOUNT
+            ELSE 0
+            END)
+          - SUM(
+            CASE
+              WHEN INVOICE_TERM = "E" THEN DISCOUNT
+              ELSE 0
+              END) AS SUB_REVENUE_NONRECURRING_EXCL_MVA_TOTAL
+      FROM
+        `spectrum-analytics-secure.fiber_rev_no_test_mirror.BILLING_PERIOD_FACT` b
+      INNER JOIN
+        `spectrum-analytics-secure.fiber_rev_no_test_mirror.VI_MAT_FIBER_SUBS` s
+        ON
+          b.ABONNENT_NR = s.ABONNENT_NR
+          AND b.PERIOD_YEAR_MONTH = s.PERIOD_YEAR_MONTH
+      LEFT JOIN
+        `spectrum-analytics-secure.fiber_rev_no_test_mirror.PRODUCT_DIM` AS pd
+        ON
+          pd.SOURCE_PRODUCT_ID_1 = CAST(b.PRODUKT_NR AS string)
+      WHERE
+        pd.SOURCE_SYSTEM_NAME = "KAS"
+        AND b.PERIOD_YEAR_MONTH {month_condition}
+        AND s.billing_segment = "SDU"
+      GROUP BY
+        ALL
+    ),
+    subsc_type AS (
+      SELECT DISTINCT
+        bpf.ABONNENT_NR,
+        bpf.PERIOD_YEAR_MONTH,
+        pvt.PRODUCT_NAME,
+        pvt.SOURCE_PRODUCT_ID_1
+      FROM
+        `spectrum-analytics-secure.fiber_rev_no_test_mirror.BILLING_PERIOD_FACT`
+          AS bpf
+      INNER JOIN
+        `spectrum-analytics-secure.fiber_rev_no_test_mirror.PRODUCT_V_TMP` AS pvt
+        ON CAST(bpf.PRODUKT_NR AS STRING) = pvt.SOURCE_PRODUCT_ID_1
+      WHERE bpf.PERIOD_YEAR_MONTH {month_condition}
+      and pvt.SOURCE_SYSTEM_NAME = "KAS"
+      and pvt.TECHNOLOGY = "FIBER"
+    ),
+    tv_subsc AS (
+      SELECT DISTINCT
+        tv_bpf.ABONNENT_NR,
+        tv_bpf.PERIOD_YEAR_MONTH,
+        tv_pvt.PRODUCT_NAME,
+      FROM
+        `spectrum-analytics-secure.fiber_rev_no_test_mirror.BILLING_PERIOD_FACT`
+          AS tv_bpf
+      INNER JOIN
+        `spectrum-analytics-secure.fiber_rev_no_test_mirror.PRODUCT_V_TMP`
+          AS tv_pvt
+        ON CAST(tv_bpf.PRODUKT_NR AS STRING) = tv_pvt.SOURCE_PRODUCT_ID_1
+      WHERE
+        tv_bpf.PERIOD_YEAR_MONTH {month_condition}
+        AND tv_pvt.SOURCE_SYSTEM_NAME = "KAS"
+        AND (tv_pvt.PRODUCT_NAME in ("Grunnpakke TV", "T-We & Streaming"))
+
+    )
+  SELECT
+    subs.billing_segment segment,
+    subs.SOURCE_SYSTEM_NAME,
+    subs.PERIOD_YEAR_MONTH,
+    subs.PRODUKT_NR,
+    subs.PRODUCT_NAME AS invoice_line_name,
+    subsc_type.SOURCE_PRODUCT_ID_1,
+    subsc_type.PRODUCT_NAME AS subscription_type,
+    Case when COALESCE(tv_subsc.PRODUCT_NAME, "NO") = "NO" then "NO" else "YES" end AS tv_subsc,
+    COUNT(subs.ABONNENT_NR) AS units,
+    Round(
+      sum(SUB_REVENUE_RECURRING_EXCL_MVA_TOTAL)
+        + sum(SUB_REVENUE_NONRECURRING_EXCL_MVA_TOTAL),
+      0) AS tot_rev_nok_ex_vat,
+    Round(
+      1.25 * (
+        sum(SUB_REVENUE_RECURRING_EXCL_MVA_TOTAL)
+        + sum(SUB_REVENUE_NONRECURRING_EXCL_MVA_TOTAL)),
+      0) AS tot_rev_nok_incl_vat,
+  FROM subs
+  LEFT JOIN subsc_type
+    ON
+      subsc_type.ABONNENT_NR = subs.ABONNENT_NR
+      AND subsc_type.PERIOD_YEAR_MONTH = subs.PERIOD_YEAR_MONTH
+  LEFT JOIN tv_subsc
+    ON
+      tv_subsc.ABONNENT_NR = subs.ABONNENT_NR
+      AND tv_subsc.PERIOD_YEAR_MONTH = subs.PERIOD_YEAR_MONTH
+  GROUP BY ALL
+  ORDER BY
+    sum(SUB_REVENUE_RECURRING_EXCL_MVA_TOTAL),
+    subs.PERIOD_YEAR_MONTH,
+    COUNT(subs.ABONNENT_NR) DESC,
+    subs.PRODUCT_NAME
+    """
+
+
+def abo_query(year_month: int) -> str:
+    return _abo_sql(f"= {year_month}")
+
+
+# The same aggregates for the months in the INT64 array parameter @months, in one scan grouped by month
+ABO_MONTHS_QUERY = _abo_sql("IN UNNEST(@months)")
+
+
+@st.cache_data(show_spinner=False)
+def product_taxonomy(names: tuple[str, ...]) -> pd.DataFrame:
+    """Flags per distinct invoice line name (the index), matched once and shared by all tabs."""
+    name = pd.Series(names, index=pd.Index(names, name="invoice_line_name"), dtype=object)
+    lower = name.str.lower()
+    return pd.DataFrame(
+        {
+            "tv_package": name == TV_PACKAGE,
+            "tv_subscription": (name == TV_PACKAGE) | name.str.contains("T-We & Streaming", na=False, regex=False),
+            "mentions_tv": lower.str.contains("tv", na=False, regex=False),
+            "rabatt": lower.str.contains("rabatt", na=False, regex=False),
+            "tilknytning": lower.str.contains("tilknytning", na=False, regex=False),
+            "bb_tv_rabatt": name == "Bredbåndsrabatt med TV",
+            "kabeltv_rabatt": name == "Rabatt Kabel-TV",
+        },
+        dtype=bool,
+    )
+
+
+def name_flags(names: pd.Series) -> pd.DataFrame:
+    # product_taxonomy flags per row, looked up by the name's code instead of matching every row
+    codes, distinct = pd.factorize(names)
+    taxonomy = product_taxonomy(tuple(distinct))
+    # missing names (code -1) take the extra all-False row
+    flags = np.vstack([taxonomy.to_numpy(dtype=bool), np.zeros((1, taxonomy.shape[1]), dtype=bool)])
+    return pd.DataFrame(flags[codes], index=names.index, columns=taxonomy.columns)
+
+
+def summarise_invoice_lines(df: pd.DataFrame) -> pd.DataFrame:
+    # Reduce abo_query results to the monthly "Time development" measures per subscription type.
+    # subscription_line keeps the invoice lines that are subscriptions themselves, so the total number
+    # of subscriptions can still be restricted to the selected subscription types afterwards.
+    names = df["invoice_line_name"]
+    is_subscription_line = names.isin(set(df["subscription_type"].dropna()))
+    flags = name_flags(names)
+    is_tv = flags["tv_subscription"]
+    is_tilknytning = flags["tilknytning"] & (df["tot_rev_nok_ex_vat"] > 0)
+    summary = pd.DataFrame(
+        {
+            "PERIOD_YEAR_MONTH": df["PERIOD_YEAR_MONTH"],
+            "subscription_type": df["subscription_type"],
+            "subscription_line": names.where(is_subscription_line, ""),
+            "subscription_units": df["units"].where(is_subscription_line, 0),
+            "tv_subs": df["units"].where(is_tv, 0),
+            "tilknytninger": df["units"].where(is_tilknytning, 0),
+            "tilknytning_rev": df["tot_rev_nok_ex_vat"].where(is_tilknytning, 0),
+        }
+    )
+    return summary.groupby(INVOICE_LINE_SUMMARY_KEYS, as_index=False, dropna=False)[INVOICE_LINE_SUMMARY_MEASURES].sum()
+
+
+def classify_invoice_lines(df: pd.DataFrame) -> pd.DataFrame:
+    # Tag every abo_query row once with its share of each breakdown component (units or revenue, else 0).
+    # Components can overlap, e.g. a positive TV line counts both as TV revenue and as positive revenue.
+    flags = name_flags(df["invoice_line_name"])
+    name = df["invoice_line_name"].to_numpy(dtype=object)
+    units, revenue = df["units"], df["tot_rev_nok_ex_vat"]
+    is_headline = name == df["subscription_type"].to_numpy(dtype=object)
+    return pd.DataFrame(
+        {
+            "subscription_type": df["subscription_type"],
+            "tv_subsc": df["tv_subsc"],
+            "total_subs": units.where(is_headline, 0),
+            "tv_subs": units.where(flags["tv_package"], 0),
+            "net_total": revenue,
+            "headline": revenue.where(is_headline, 0),
+            "tv_rev": revenue.where(flags["mentions_tv"] & (revenue > 0), 0),
+            "positive": revenue.where(revenue > 0, 0),
+            "negative": revenue.where(revenue < 0, 0),
+            "bb_tv_rabatt": revenue.where(flags["bb_tv_rabatt"], 0),
+            "kabeltv_rabatt": revenue.where(flags["kabeltv_rabatt"], 0),
+            "rabatt": revenue.where(flags["rabatt"], 0),
+        }
+    )
+
+
+def subscription_breakdown(df: pd.DataFrame) -> pd.DataFrame:
+    """Sums of the classify_invoice_lines components per (subscription_type, tv_subsc).
+
+    Besides the "YES" and "NO" rows every subscription type has a "YES&NO" row with the sums over all its
+    invoice lines. Types (and TV flags) without invoice lines have no row.
+    """
+    by_flag = classify_invoice_lines(df).groupby(["subscription_type", "tv_subsc"], observed=True, dropna=False).sum()
+    both = by_flag.groupby(level="subscription_type", observed=True).sum()
+    both.index = pd.MultiIndex.from_arrays([both.index, ["YES&NO"] * len(both)], names=by_flag.index.names)
+    return pd.concat([by_flag, both]).sort_index()
+
+
+def breakdown_table(totals: pd.Series) -> pd.DataFrame:
+    # revenue lines of one subscription_breakdown row, in total and per subscription
+    revenues = pd.Series(
+        {
+            "Total net revenues": totals["net_total"],
+            "Headline price": totals["headline"],
+            "TV revenues": totals["tv_rev"],
+            "Other revenues": totals["positive"] - totals["headline"] - totals["tv_rev"],
+            "Rabatt-GrunnpakkeTV": totals["bb_tv_rabatt"],
+            "Rabatt-KabelTV": totals["kabeltv_rabatt"],
+            "Andre Rabatter": totals["rabatt"] - totals["bb_tv_rabatt"] - totals["kabeltv_rabatt"],
+            "Other negative items": totals["negative"] - totals["rabatt"],
+        },
+        dtype=float,
+    )
+    return pd.DataFrame(
+        {
+            "Total_revenues_ex_vat": revenues,
+            "Total_subscriptions": float(totals["total_subs"]),
+            "NOK_per_sub_ex_vat": revenues / totals["total_subs"],
+        }
+    )
+
+
+def _compute_invoice_line_summary(months: list[int]) -> dict[int, pd.DataFrame]:
+    with st.spinner(f"Loading invoice lines for {len(months)} months..."):
+        df = query_result(submit_bigquery_query(ABO_MONTHS_QUERY, (("months", "INT64", months),)), "invoice lines")
+    if df.empty:
+        # failed (or no data at all): nothing is stored and the months are retried on the next call
+        return {}
+    empty = pd.DataFrame(columns=INVOICE_LINE_SUMMARY_KEYS + INVOICE_LINE_SUMMARY_MEASURES)
+    # split back into one entry per month (summarised per month, as the subscription lines are the
+    # subscription types of that month), months without invoice lines are stored empty
+    by_month = {ym: summarise_invoice_lines(part) for ym, part in df.groupby("PERIOD_YEAR_MONTH", sort=False)}
+    return {ym: by_month.get(ym, empty) for ym in months}
+
+
+def load_invoice_line_summary(months: list[int]) -> pd.DataFrame:
+    # Only months that are not materialized yet hit BILLING_PERIOD_FACT, closed months are reused
+    return load_monthly(INVOICE_LINE_SUMMARY_STORE, months, _compute_invoice_line_summary)
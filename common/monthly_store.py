@@ -0,0 +1,140 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Iterable, Mapping
+from datetime import datetime
+
+import pandas as pd
+import streamlit as st
+
+from common.result_cache import query_cache_key, read_cached_frame, write_cached_frame
+
+# Incremental per-month materialization of derived data.
+# Every month is stored as its own entry in the persistent result cache, together with the time it was
+# computed. The MONTHLY_STORE_MEMORY_MONTHS most recently used months (over all names) are also kept in
+# process memory. Billing for a month keeps landing after the month ends, so a
+# month is only final (never recomputed) when it was computed MONTHLY_STORE_CLOSE_GRACE_DAYS or more
+# after it closed. Until then it is recomputed once it is older than MONTHLY_STORE_OPEN_MONTH_TTL_SECONDS.
+# Empty results for the current and the previous month are not persisted.
+MONTHLY_STORE_OPEN_MONTH_TTL_SECONDS = int(os.environ.get("MONTHLY_STORE_OPEN_MONTH_TTL_SECONDS", str(60 * 60)))
+MONTHLY_STORE_CLOSE_GRACE_DAYS = int(os.environ.get("MONTHLY_STORE_CLOSE_GRACE_DAYS", "15"))
+MONTHLY_STORE_MEMORY_MONTHS = int(os.environ.get("MONTHLY_STORE_MEMORY_MONTHS", "120"))
+COMPUTED_AT_ATTR = "monthly_store_computed_at"
+
+
+def current_year_month() -> int:
+    today = datetime.now()
+    return today.year * 100 + today.month
+
+
+def previous_year_month(year_month: int) -> int:
+    year, month = divmod(year_month, 100)
+    return year_month - 1 if month > 1 else (year - 1) * 100 + 12
+
+
+def _final_from(year_month: int) -> float:
+    # first moment a computation of the month counts as final: the end of the month plus the grace period
+    year, month = divmod(year_month, 100)
+    month_end = datetime(year + month // 12, month % 12 + 1, 1)
+    return month_end.timestamp() + MONTHLY_STORE_CLOSE_GRACE_DAYS * 24 * 60 * 60
+
+
+def _is_recent(year_month: int) -> bool:
+    return year_month >= previous_year_month(current_year_month())
+
+
+def _is_final(year_month: int, df: pd.DataFrame, computed_at: float) -> bool:
+    # an empty result for a recent month usually means its billing has not landed yet
+    return computed_at >= _final_from(year_month) and not (df.empty and _is_recent(year_month))
+
+
+def _is_fresh(year_month: int, df: pd.DataFrame, computed_at: float, now: float) -> bool:
+    return _is_final(year_month, df, computed_at) or now - computed_at <= MONTHLY_STORE_OPEN_MONTH_TTL_SECONDS
+
+
+@st.cache_resource(show_spinner=False)
+def _memory_store() -> tuple[OrderedDict[tuple[str, int], tuple[pd.DataFrame, float]], threading.Lock]:
+    return OrderedDict(), threading.Lock()
+
+
+def _memory_get(name: str, year_month: int) -> tuple[pd.DataFrame, float] | None:
+    frames, lock = _memory_store()
+    with lock:
+        entry = frames.get((name, year_month))
+        if entry is not None:
+            frames.move_to_end((name, year_month))
+        return entry
+
+
+def _memory_put(name: str, year_month: int, entry: tuple[pd.DataFrame, float]) -> None:
+    frames, lock = _memory_store()
+    with lock:
+        frames[(name, year_month)] = entry
+        frames.move_to_end((name, year_month))
+        while len(frames) > MONTHLY_STORE_MEMORY_MONTHS:
+            frames.popitem(last=False)
+
+
+def _month_key(name: str, year_month: int) -> str:
+    return query_cache_key(f"monthly_store:{name}", {"year_month": year_month})
+
+
+def _read_month(name: str, year_month: int) -> tuple[pd.DataFrame, float] | None:
+    df = read_cached_frame(_month_key(name, year_month), ttl_seconds=None)
+    # entries written without a compute time are recomputed once
+    if df is None or COMPUTED_AT_ATTR not in df.attrs:
+        return None
+    return df, float(df.attrs.pop(COMPUTED_AT_ATTR))
+
+
+def _write_month(name: str, year_month: int, df: pd.DataFrame, computed_at: float) -> None:
+    if df.empty and _is_recent(year_month):
+        return
+    stored = df.copy(deep=False)
+    stored.attrs[COMPUTED_AT_ATTR] = computed_at
+    write_cached_frame(_month_key(name, year_month), stored)
+
+
+def load_monthly(
+    name: str,
+    months: Iterable[int],
+    compute: Callable[[list[int]], Mapping[int, pd.DataFrame]],
+) -> pd.DataFrame:
+    """Return the stored frames for `months`, computing only the months that are not materialized yet.
+
+    `compute` gets the missing months and returns one frame per month it could compute. Months it
+    leaves out (e.g. failed queries) are not stored and will be retried on the next call; an outdated
+    stored frame of such a month is returned meanwhile.
+    """
+    months = list(dict.fromkeys(months))
+    found: dict[int, pd.DataFrame] = {}
+    outdated: dict[int, pd.DataFrame] = {}
+    missing: list[int] = []
+    now = time.time()
+    for year_month in months:
+        entry = _memory_get(name, year_month)
+        if entry is None:
+            entry = _read_month(name, year_month)
+            if entry is not None:
+                _memory_put(name, year_month, entry)
+        if entry is not None and _is_fresh(year_month, entry[0], entry[1], now):
+            found[year_month] = entry[0]
+            continue
+        if entry is not None:
+            outdated[year_month] = entry[0]
+        missing.append(year_month)
+
+    if missing:
+        computed_at = time.time()
+        for year_month, df in compute(missing).items():
+            _write_month(name, year_month, df, computed_at)
+            found[year_month] = df
+            _memory_put(name, year_month, (df, computed_at))
+        found = {**outdated, **found}
+
+    parts = [found[year_month] for year_month in months if year_month in found]
+    if not parts:
+        return pd.DataFrame()
+    non_empty = [df for df in parts if not df.empty]
+    return pd.concat(non_empty or parts[:1], ignore_index=True)
@@ -0,0 +1,79 @@
+from collections.abc import Iterable, Mapping
+
+import numpy as np
+import pandas as pd
+
+# Multi-measure pivots for the report pages: every measure is pivoted in one pass over shared row and
+# column codes, and the result is a single frame with one column block per measure.
+TOTAL_LABEL = "Total"
+
+
+def _total_row_label(index: list[str]) -> tuple[str, ...]:
+    return (TOTAL_LABEL, *[""] * (len(index) - 1))
+
+
+def measure_pivot(
+    df: pd.DataFrame,
+    index: list[str],
+    blocks: Mapping[str, str | tuple[str, str]],
+    *,
+    columns: str = "PERIOD_YEAR_MONTH",
+    total_mean: Iterable[str] = (),
+    sort_by: str | None = None,
+    total_row: bool = True,
+) -> pd.DataFrame:
+    """Pivot `df` to one row per `index` value and one column per `columns` value for each block.
+
+    A block is a value column, or a (numerator, denominator) pair of value columns shown as their ratio
+    (0 where the denominator is 0). `df` has one row per (index, columns) pair, missing pairs are 0.
+    The first row is a "Total" row with the column sums (means for the value columns in `total_mean`),
+    ratios are computed from the totals. Without `total_row` there is no "Total" row and the row labels
+    keep their type. `sort_by` names the block whose last column orders the other rows ascending. The
+    columns are a (block, column value) MultiIndex.
+    """
+    grouped = df.groupby(index, sort=True, dropna=False, observed=True)
+    row = grouped.ngroup().to_numpy()
+    row_labels = grouped.size().index
+    col, col_labels = pd.factorize(df[columns], sort=True)
+    shape = (len(row_labels), len(col_labels))
+    cell = row * shape[1] + col
+
+    total_mean = set(total_mean)
+    grids = {}
+    for spec in blocks.values():
+        for value in (spec,) if isinstance(spec, str) else spec:
+            if value not in grids:
+                grid = np.bincount(cell, weights=df[value].to_numpy(dtype=float), minlength=shape[0] * shape[1])
+                grid = grid.reshape(shape)
+                if total_row:
+                    total = grid.mean(axis=0) if value in total_mean and shape[0] else grid.sum(axis=0)
+                    grid = np.vstack([total, grid])
+                grids[value] = grid
+
+    values = []
+    for spec in blocks.values():
+        if isinstance(spec, str):
+            values.append(grids[spec])
+        else:
+            numerator, denominator = grids[spec[0]], grids[spec[1]]
+            values.append(np.divide(numerator, denominator, out=np.zeros(numerator.shape), where=denominator != 0))
+
+    offset = int(total_row)
+    order = np.arange(shape[0] + offset)
+    if sort_by is not None and shape[1]:
+        sort_values = values[list(blocks).index(sort_by)]
+        order[offset:] = offset + np.argsort(sort_values[offset:, -1], kind="stable")
+
+    # labels are shown as text, so ids next to the "Total" label do not give mixed-type index levels
+    if not total_row:
+        row_index = row_labels
+    elif len(index) == 1:
+        row_index = pd.Index([TOTAL_LABEL, *map(str, row_labels)], name=index[0])
+    else:
+        labels = [_total_row_label(index), *(tuple(map(str, label)) for label in row_labels)]
+        row_index = pd.MultiIndex.from_tuples(labels, names=index)
+    return pd.DataFrame(
+        np.hstack(values)[order] if values else np.empty((len(order), 0)),
+        index=row_index[order],
+        columns=pd.MultiIndex.from_product([list(blocks), col_labels], names=[None, columns]),
+    )
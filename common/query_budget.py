@@ -0,0 +1,136 @@
+import os
+import threading
+import time
+from collections import deque
+
+from google.cloud import bigquery
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from common.connectivity import get_bq_client
+from common.telemetry import current_record, update_current_record
+
+# Dry-run cost estimates and byte budgets for BigQuery queries.
+# With dry runs enabled every query that is not served from a cache is first dry-run to estimate the bytes
+# it will scan. A query over BQ_QUERY_BUDGET_GB, or one that would take the calling page over
+# BQ_PAGE_BUDGET_GB for the current session within the last BQ_PAGE_BUDGET_WINDOW_SECONDS, is rewritten to
+# a pre-aggregated source when one is known and refused otherwise. A budget of 0 means no limit. Setting a
+# budget turns dry runs on.
+BQ_QUERY_BUDGET_GB = float(os.environ.get("BQ_QUERY_BUDGET_GB", "0"))
+BQ_PAGE_BUDGET_GB = float(os.environ.get("BQ_PAGE_BUDGET_GB", "0"))
+BQ_PAGE_BUDGET_WINDOW_SECONDS = int(os.environ.get("BQ_PAGE_BUDGET_WINDOW_SECONDS", str(60 * 60)))
+BQ_DRY_RUN_ENABLED = os.environ.get("BQ_DRY_RUN_ENABLED", "0") != "0" or BQ_QUERY_BUDGET_GB > 0 or BQ_PAGE_BUDGET_GB > 0
+
+# Views that scan their base tables on every query, and the materialized table with the same columns
+PRE_AGGREGATED_SOURCES = {
+    "`spectrum-analytics-secure.fiber_rev_no_test_mirror.VI_PRODUCT_POSTNR_SUMMARY`": (
+        "`spectrum-analytics-secure.fiber_rev_no_test_mirror.VI_PRODUCT_POSTNR_SUMMARY_MAT`"
+    ),
+}
+
+# results of a rewritten query carry this attr, they must not be cached for other sessions
+DOWNGRADED_ATTR = "downgraded"
+
+# (session, page) -> (time, estimated bytes) per query in the budget window. Entries are dropped when
+# they leave the window, so sessions that have ended do not stay in here.
+_spent_bytes: dict[tuple[str, str], deque[tuple[float, int]]] = {}
+_spent_lock = threading.Lock()
+
+
+class QueryBudgetExceededError(Exception):
+    pass
+
+
+def estimate_query_bytes(qry_str: str, job_config: bigquery.QueryJobConfig | None = None) -> int:
+    dry_run_config = bigquery.QueryJobConfig(
+        dry_run=True,
+        use_query_cache=False,
+        query_parameters=job_config.query_parameters if job_config else [],
+    )
+    return get_bq_client().query(qry_str, job_config=dry_run_config).total_bytes_processed or 0
+
+
+def _session_id() -> str:
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return ctx.session_id if ctx else ""
+
+
+def _page() -> str:
+    record = current_record()
+    return record.page if record else "unknown"
+
+
+def _downgrade(qry_str: str) -> str | None:
+    downgraded = qry_str
+    for source, pre_aggregated in PRE_AGGREGATED_SOURCES.items():
+        downgraded = downgraded.replace(source, pre_aggregated)
+    return downgraded if downgraded != qry_str else None
+
+
+def _prune_spent(now: float) -> None:
+    # called with _spent_lock held
+    cutoff = now - BQ_PAGE_BUDGET_WINDOW_SECONDS
+    for key in list(_spent_bytes):
+        entries = _spent_bytes[key]
+        while entries and entries[0][0] < cutoff:
+            entries.popleft()
+        if not entries:
+            del _spent_bytes[key]
+
+
+def _spent(key: tuple[str, str]) -> int:
+    with _spent_lock:
+        _prune_spent(time.monotonic())
+        return sum(spent for _, spent in _spent_bytes.get(key, ()))
+
+
+def _over_budget(key: tuple[str, str], estimated_bytes: int) -> str | None:
+    if BQ_QUERY_BUDGET_GB and estimated_bytes > BQ_QUERY_BUDGET_GB * 1e9:
+        return f"the query budget of {BQ_QUERY_BUDGET_GB:g} GB"
+    spent = _spent(key)
+    if BQ_PAGE_BUDGET_GB and spent + estimated_bytes > BQ_PAGE_BUDGET_GB * 1e9:
+        return f"the page budget of {BQ_PAGE_BUDGET_GB:g} GB for this session ({spent / 1e9:.1f} GB used)"
+    return None
+
+
+def enforce_query_budget(qry_str: str, job_config: bigquery.QueryJobConfig | None = None) -> str:
+    """Dry-run `qry_str` and return the query to run: the query itself, or a downgraded variant using
+    a pre-aggregated source when it is over budget. Raises QueryBudgetExceededError if neither fits."""
+    if not BQ_DRY_RUN_ENABLED:
+        return qry_str
+    key = (_session_id(), _page())
+    estimated_bytes = estimate_query_bytes(qry_str, job_config)
+    update_current_record(estimated_bytes=estimated_bytes)
+    exceeded = _over_budget(key, estimated_bytes)
+    if exceeded:
+        downgraded = _downgrade(qry_str)
+        if downgraded is None:
+            raise QueryBudgetExceededError(f"Query would scan {estimated_bytes / 1e9:.1f} GB, over {exceeded}.")
+        estimated_bytes = estimate_query_bytes(downgraded, job_config)
+        update_current_record(estimated_bytes=estimated_bytes, downgraded=True)
+        if _over_budget(key, estimated_bytes):
+            raise QueryBudgetExceededError(
+                f"Query would scan {estimated_bytes / 1e9:.1f} GB even on the pre-aggregated source, over {exceeded}."
+            )
+        qry_str = downgraded
+    with _spent_lock:
+        _spent_bytes.setdefault(key, deque()).append((time.monotonic(), estimated_bytes))
+    return qry_str
+
+
+def session_budget_usage() -> dict[str, int]:
+    # Estimated bytes per page run by the current session within the budget window
+    session_id = _session_id()
+    with _spent_lock:
+        _prune_spent(time.monotonic())
+        return {
+            page: sum(spent for _, spent in entries)
+            for (session, page), entries in _spent_bytes.items()
+            if session == session_id
+        }
+
+
+def reset_session_budget() -> None:
+    session_id = _session_id()
+    with _spent_lock:
+        for key in [key for key in _spent_bytes if key[0] == session_id]:
+            del _spent_bytes[key]
@@ -0,0 +1,67 @@
+import re
+from dataclasses import dataclass, replace
+from typing import Any
+
+# A query parameter as (name, BigQuery type, value). Lists and tuples become ARRAY parameters.
+QueryParam = tuple[str, str, Any]
+QueryParams = tuple[QueryParam, ...]
+
+_IDENTIFIER_RE = re.compile(r"^\w+$")
+_NON_WORD_RE = re.compile(r"\W")
+
+
+@dataclass(frozen=True)
+class QueryBuilder:
+    """Small composable builder for parameterized BigQuery aggregate queries.
+
+    Every method returns a new builder, so a base query can be shared and specialised per view.
+    Group-by columns, filters and aggregates are all pushed into the warehouse.
+    """
+
+    table: str
+    alias: str = "t"
+    columns: tuple[str, ...] = ()
+    aggregates: tuple[str, ...] = ()
+    filters: tuple[str, ...] = ()
+    params: QueryParams = ()
+
+    def _qualify(self, column: str) -> str:
+        return f"{self.alias}.{column}" if _IDENTIFIER_RE.match(column) else column
+
+    def _param_name(self, column: str) -> str:
+        return f"{_NON_WORD_RE.sub('_', column)}_{len(self.params)}".lower()
+
+    def select(self, *columns: str) -> "QueryBuilder":
+        # bare column names are qualified with the table alias, other expressions are used as given
+        return replace(self, columns=self.columns + tuple(self._qualify(c) for c in columns))
+
+    def aggregate(self, function: str, column: str, alias: str) -> "QueryBuilder":
+        return replace(self, aggregates=(*self.aggregates, f"{function}({self._qualify(column)}) AS {alias}"))
+
+    def sum(self, column: str, alias: str | None = None) -> "QueryBuilder":
+        return self.aggregate("SUM", column, alias or column)
+
+    def where_equal(self, column: str, value: Any, bq_type: str) -> "QueryBuilder":  # noqa: ANN401
+        name = self._param_name(column)
+        return replace(
+            self,
+            filters=(*self.filters, f"{self._qualify(column)} = @{name}"),
+            params=(*self.params, (name, bq_type, value)),
+        )
+
+    def where_in(self, column: str, values: list | tuple, bq_type: str) -> "QueryBuilder":
+        name = self._param_name(column)
+        return replace(
+            self,
+            filters=(*self.filters, f"{self._qualify(column)} IN UNNEST(@{name})"),
+            params=(*self.params, (name, bq_type, tuple(values))),
+        )
+
+    def build(self) -> tuple[str, QueryParams]:
+        select_list = ",\n  ".join(self.columns + self.aggregates)
+        sql = f"SELECT\n  {select_list}\nFROM\n  `{self.table}` AS {self.alias}"
+        if self.filters:
+            sql += "\nWHERE\n  " + "\n  AND ".join(self.filters)
+        if self.aggregates and self.columns:
+            sql += "\nGROUP BY ALL"
+        return sql, self.params
@@ -0,0 +1,115 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from common.connectivity import get_storage_client
+
+# Persistent result cache shared by all processes/instances.
+# Results are stored as zstd-compressed Parquet, either in the GCS bucket given by QUERY_CACHE_BUCKET
+# (shared between Cloud Run instances) or on local disk under QUERY_CACHE_DIR.
+QUERY_CACHE_ENABLED = os.environ.get("QUERY_CACHE_ENABLED", "1") != "0"
+QUERY_CACHE_DIR = Path(os.environ.get("QUERY_CACHE_DIR", ".query_cache"))
+QUERY_CACHE_BUCKET = os.environ.get("QUERY_CACHE_BUCKET", "")
+QUERY_CACHE_PREFIX = os.environ.get("QUERY_CACHE_PREFIX", "query_cache")
+QUERY_CACHE_TTL_SECONDS = int(os.environ.get("QUERY_CACHE_TTL_SECONDS", str(12 * 60 * 60)))
+
+# Quoted literals and identifiers are kept verbatim, any other run of whitespace is collapsed
+_SQL_TOKEN_RE = re.compile(r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|`[^`]*`)|\s+""")
+
+
+def normalize_sql(qry_str: str) -> str:
+    return _SQL_TOKEN_RE.sub(lambda m: m.group(1) or " ", qry_str).strip()
+
+
+def query_cache_key(qry_str: str, params: dict | None = None) -> str:
+    payload = normalize_sql(qry_str)
+    if params is not None:
+        payload += "\n" + json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _local_path(key: str) -> Path:
+    return QUERY_CACHE_DIR / f"{key}.parquet"
+
+
+def _blob_name(key: str) -> str:
+    return f"{QUERY_CACHE_PREFIX}/{key}.parquet"
+
+
+def read_cached_frame(key: str, ttl_seconds: int | None = QUERY_CACHE_TTL_SECONDS) -> pd.DataFrame | None:
+    """Return the cached result for `key`, or None if missing or older than `ttl_seconds`."""
+    if not QUERY_CACHE_ENABLED:
+        return None
+    try:
+        if QUERY_CACHE_BUCKET:
+            blob = get_storage_client().bucket(QUERY_CACHE_BUCKET).get_blob(_blob_name(key))
+            if blob is None:
+                return None
+            if ttl_seconds is not None and time.time() - blob.updated.timestamp() > ttl_seconds:
+                return None
+            return pd.read_parquet(io.BytesIO(blob.download_as_bytes()))
+
+        path = _local_path(key)
+        if not path.exists():
+            return None
+        if ttl_seconds is not None and time.time() - path.stat().st_mtime > ttl_seconds:
+            return None
+        return pd.read_parquet(path)
+    except Exception as e:
+        logging.warning(f"Could not read cached query result {key}: {e}")
+        return None
+
+
+def write_cached_frame(key: str, df: pd.DataFrame) -> None:
+    if not QUERY_CACHE_ENABLED:
+        return
+    try:
+        buffer = io.BytesIO()
+        df.to_parquet(buffer, compression="zstd", index=True)
+        if QUERY_CACHE_BUCKET:
+            blob = get_storage_client().bucket(QUERY_CACHE_BUCKET).blob(_blob_name(key))
+            blob.upload_from_string(buffer.getvalue(), content_type="application/vnd.apache.parquet")
+            return
+
+        QUERY_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        path = _local_path(key)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_bytes(buffer.getvalue())
+        tmp_path.replace(path)
+    except Exception as e:
+        logging.warning(f"Could not write cached query result {key}: {e}")
+
+
+def invalidate_cached_key(key: str) -> None:
+    try:
+        if QUERY_CACHE_BUCKET:
+            blob = get_storage_client().bucket(QUERY_CACHE_BUCKET).get_blob(_blob_name(key))
+            if blob is not None:
+                blob.delete()
+        else:
+            _local_path(key).unlink(missing_ok=True)
+    except Exception as e:
+        logging.warning(f"Could not invalidate cached query result {key}: {e}")
+
+
+def invalidate_cached_query(qry_str: str, params: dict | None = None) -> None:
+    invalidate_cached_key(query_cache_key(qry_str, params))
+
+
+def clear_query_cache() -> None:
+    try:
+        if QUERY_CACHE_BUCKET:
+            for blob in get_storage_client().list_blobs(QUERY_CACHE_BUCKET, prefix=f"{QUERY_CACHE_PREFIX}/"):
+                blob.delete()
+        elif QUERY_CACHE_DIR.exists():
+            for path in QUERY_CACHE_DIR.glob("*.parquet"):
+                path.unlink(missing_ok=True)
+    except Exception as e:
+        logging.warning(f"Could not clear the query result cache: {e}")
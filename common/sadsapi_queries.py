@@ -0,0 +1,10 @@
+from sadsapi import financial, gsmai
+from sadsapi.spectrum import confidential
+
+from common.telemetry import instrumented
+
+# SADS API calls used by the pages, wrapped so they show up in the query telemetry
+get_company_info = instrumented("sadsapi")(financial.get_company_info)
+get_datasets = instrumented("sadsapi")(gsmai.get_datasets)
+get_gsmai_data = instrumented("sadsapi")(gsmai.get_gsmai_data)
+make_spectrum_api_call = instrumented("sadsapi")(confidential.make_spectrum_api_call)
@@ -0,0 +1,92 @@
+import math
+import os
+from collections.abc import Hashable, Iterable, Mapping
+
+import pandas as pd
+import streamlit as st
+
+# Rendering of report tables. Numbers are formatted in the browser through st.column_config instead of
+# pandas Styler, which formats every cell in Python and was the slowest step for pivots at postcode level.
+# Tables with more than TABLE_PAGE_SIZE rows are sorted and paged on the server, so only one page is sent
+# to the browser. Styler is only used for highlighted columns, and then only on the rendered page.
+TABLE_PAGE_SIZE = int(os.environ.get("TABLE_PAGE_SIZE", "250"))
+HIGHLIGHT_COLOR = "#e0e0e0"
+
+# "localized" and "percent" take their number of decimals from the step
+NUMBER_FORMATS = {
+    "integer": {"format": "%.0f"},
+    "thousands": {"format": "localized", "step": 1},
+    "thousands_1": {"format": "localized", "step": 0.1},
+    "percent": {"format": "percent", "step": 0.001},
+}
+
+
+def column_label(column: Hashable) -> str:
+    # MultiIndex columns (e.g. measure_pivot blocks) are flattened to "block | month"
+    if isinstance(column, tuple):
+        return " | ".join(str(level) for level in column if str(level))
+    return str(column)
+
+
+def table_height(rows: int) -> int:
+    # height that shows all rows without scrolling
+    return 35 * rows + 38
+
+
+def _page(table: pd.DataFrame, key: str, pinned_rows: int) -> pd.DataFrame:
+    col_sort, col_order, col_page = st.columns([3, 1, 1])
+    sort_by = col_sort.selectbox(
+        "Sort by", [None, *table.columns], format_func=lambda c: "-" if c is None else c, key=f"{key}_sort"
+    )
+    descending = col_order.toggle("Descending", key=f"{key}_descending")
+    pages = max(math.ceil((len(table) - pinned_rows) / TABLE_PAGE_SIZE), 1)
+    page = col_page.number_input(f"Page (of {pages})", min_value=1, max_value=pages, key=f"{key}_page")
+
+    body = table.iloc[pinned_rows:]
+    if sort_by is not None:
+        body = body.sort_values(sort_by, ascending=not descending, kind="stable")
+    start = (page - 1) * TABLE_PAGE_SIZE
+    return pd.concat([table.iloc[:pinned_rows], body.iloc[start : start + TABLE_PAGE_SIZE]])
+
+
+def render_table(
+    df: pd.DataFrame,
+    formats: str | Mapping[Hashable, str] = "thousands",
+    *,
+    key: str,
+    highlight: Iterable[Hashable] = (),
+    pinned_rows: int = 0,
+    fit_rows: bool = False,
+    hide_index: bool | None = None,
+) -> None:
+    """Show `df` with st.dataframe, formatting numbers with NUMBER_FORMATS.
+
+    `formats` is one format for all numeric columns, or a mapping from column to format. The columns in
+    `highlight` get a grey background. The first `pinned_rows` rows (e.g. a Total row) stay on top of
+    every page. With `fit_rows` the table is as high as the rows it shows. `key` identifies the sort
+    and page widgets of large tables.
+    """
+    labels = {column: column_label(column) for column in df.columns}
+    if isinstance(formats, str):
+        formats = dict.fromkeys(df.select_dtypes("number").columns, formats)
+    column_config = {
+        labels[column]: st.column_config.NumberColumn(**NUMBER_FORMATS[number_format])
+        for column, number_format in formats.items()
+    }
+
+    table = df.set_axis(list(labels.values()), axis=1)
+    if len(table) > TABLE_PAGE_SIZE + pinned_rows:
+        table = _page(table, key, pinned_rows)
+
+    highlighted = [labels[column] for column in highlight]
+    data = (
+        table.style.set_properties(subset=highlighted, **{"background-color": HIGHLIGHT_COLOR})
+        if highlighted
+        else table
+    )
+    st.dataframe(
+        data,
+        column_config=column_config,
+        hide_index=hide_index,
+        height=table_height(len(table)) if fit_rows else "auto",
+    )
@@ -0,0 +1,159 @@
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+from collections import deque
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any
+
+import pandas as pd
+from google.cloud import logging as cloud_logging
+
+from common.result_cache import normalize_sql
+
+# Query telemetry: one record per data access call (BigQuery, SQL Server, SADS API).
+# Records are written as structured logs (Cloud Logging on Cloud Run) and kept in a bounded in-process
+# buffer that is shown on the diagnostics page.
+TELEMETRY_BUFFER_SIZE = int(os.environ.get("QUERY_TELEMETRY_BUFFER_SIZE", "1000"))
+TELEMETRY_QUERY_CHARS = 300
+
+
+@dataclass
+class QueryRecord:
+    source: str
+    query: str
+    page: str
+    started_at: datetime = field(default_factory=lambda: datetime.now(UTC))
+    # "memory" (st.cache_data hit), "parquet" (persistent cache hit), "miss" or "" when not cached by us
+    cache: str = ""
+    wall_ms: float = 0.0
+    dataframe_ms: float | None = None
+    rows: int | None = None
+    job_id: str | None = None
+    total_bytes_processed: int | None = None
+    slot_millis: int | None = None
+    # dry-run estimate, and whether the query was moved to a pre-aggregated source (see common.query_budget)
+    estimated_bytes: int | None = None
+    downgraded: bool = False
+    error: str | None = None
+
+
+_records: deque[QueryRecord] = deque(maxlen=TELEMETRY_BUFFER_SIZE)
+_records_lock = threading.Lock()
+_local = threading.local()
+
+
+@functools.cache
+def _telemetry_logger() -> logging.Logger:
+    if "K_SERVICE" in os.environ:
+        try:
+            cloud_logging.Client().setup_logging(log_level=logging.INFO)
+        except Exception as e:
+            logging.warning(f"Could not set up Cloud Logging for query telemetry: {e}")
+    return logging.getLogger("query_telemetry")
+
+
+def current_page() -> str:
+    # The calling page is the first gui_pages script on the stack. Worker threads have no page on
+    # their stack, they get the page of the submitting script through bind_page().
+    page = getattr(_local, "page", None)
+    if page is not None:
+        return page
+    frame = inspect.currentframe()
+    while frame is not None:
+        path = Path(frame.f_code.co_filename)
+        if path.parent.name == "gui_pages":
+            return path.stem
+        frame = frame.f_back
+    return "unknown"
+
+
+@contextmanager
+def bind_page(page: str) -> Iterator[None]:
+    previous = getattr(_local, "page", None)
+    _local.page = page
+    try:
+        yield
+    finally:
+        _local.page = previous
+
+
+def current_record() -> QueryRecord | None:
+    return getattr(_local, "record", None)
+
+
+def update_current_record(**fields: Any) -> None:  # noqa: ANN401
+    record = current_record()
+    if record is not None:
+        for name, value in fields.items():
+            setattr(record, name, value)
+
+
+def _publish(record: QueryRecord) -> None:
+    with _records_lock:
+        _records.append(record)
+    payload = asdict(record)
+    payload["started_at"] = record.started_at.isoformat()
+    _telemetry_logger().info(
+        f"{record.source} query on {record.page}: {record.wall_ms:.0f} ms", extra={"json_fields": payload}
+    )
+
+
+@contextmanager
+def track(source: str, query: str = "", page: str | None = None) -> Iterator[QueryRecord]:
+    """Time a data access call and publish its record. Code running inside can fill in details
+    through update_current_record(); the cache field defaults to "memory" for cached calls."""
+    record = QueryRecord(
+        source=source,
+        query=normalize_sql(query)[:TELEMETRY_QUERY_CHARS],
+        page=page or current_page(),
+    )
+    previous = current_record()
+    _local.record = record
+    start = time.perf_counter()
+    try:
+        yield record
+    except Exception as e:
+        record.error = str(e)
+        raise
+    finally:
+        record.wall_ms = (time.perf_counter() - start) * 1000
+        _local.record = previous
+        _publish(record)
+
+
+def record_frame(record: QueryRecord, result: object) -> None:
+    if isinstance(result, pd.DataFrame):
+        record.rows = len(result)
+
+
+def instrumented(source: str) -> Callable[[Callable], Callable]:
+    # Decorator for data access functions that are not BigQuery queries (e.g. SADS API calls)
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:  # noqa: ANN401
+            with track(source, func.__name__) as record:
+                result = func(*args, **kwargs)
+                record_frame(record, result)
+                return result
+
+        return wrapper
+
+    return decorator
+
+
+def query_records() -> pd.DataFrame:
+    with _records_lock:
+        records = list(_records)
+    return pd.DataFrame([asdict(r) for r in records], columns=list(QueryRecord.__dataclass_fields__))
+
+
+def clear_query_records() -> None:
+    with _records_lock:
+        _records.clear()
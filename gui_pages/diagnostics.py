@@ -0,0 +1,141 @@
+import pandas as pd
+import streamlit as st
+
+from common.frame_cache import clear_shared_frames
+from common.frame_schema import frame_footprints
+from common.query_budget import (
+    BQ_DRY_RUN_ENABLED,
+    BQ_PAGE_BUDGET_GB,
+    BQ_PAGE_BUDGET_WINDOW_SECONDS,
+    BQ_QUERY_BUDGET_GB,
+    reset_session_budget,
+    session_budget_usage,
+)
+from common.result_cache import clear_query_cache
+from common.telemetry import clear_query_records, query_records
+
+st.subheader("Query diagnostics")
+st.info(
+    "Every BigQuery, SQL Server and SADS API call made by this app instance is recorded here. "
+    "Use it to find the pages and queries that cost the most time and bytes."
+)
+
+records = query_records()
+
+col1, col2, col3 = st.columns(3)
+if col1.button("Clear records"):
+    clear_query_records()
+    st.rerun()
+if col2.button("Clear in-memory cache"):
+    st.cache_data.clear()
+    clear_shared_frames()
+if col3.button("Clear persistent cache"):
+    clear_query_cache()
+
+with st.expander("BigQuery byte budget", expanded=False):
+    if not BQ_DRY_RUN_ENABLED:
+        st.write("Dry runs are disabled. Set `BQ_DRY_RUN_ENABLED=1` or a budget to estimate bytes before running.")
+    else:
+        st.write(
+            f"Query budget: {BQ_QUERY_BUDGET_GB or 'unlimited'} GB, "
+            f"page budget per session: {BQ_PAGE_BUDGET_GB or 'unlimited'} GB "
+            f"per {BQ_PAGE_BUDGET_WINDOW_SECONDS // 60} minutes."
+        )
+        usage = pd.Series(session_budget_usage(), name="estimated_gb", dtype=float).div(1e9)
+        st.dataframe(usage.rename_axis("page").reset_index(), hide_index=True)
+        if st.button("Reset my budget"):
+            reset_session_budget()
+            st.rerun()
+
+with st.expander("Memory footprint of normalized frames", expanded=False):
+    footprints = frame_footprints()
+    if footprints.empty:
+        st.write("No frames normalized yet.")
+    else:
+        st.dataframe(
+            footprints.assign(saved_pct=1 - footprints["mb_after"] / footprints["mb_before"]),
+            hide_index=True,
+            use_container_width=True,
+            column_config={
+                "mb_before": st.column_config.NumberColumn("MB before", format="%.1f"),
+                "mb_after": st.column_config.NumberColumn("MB after", format="%.1f"),
+                "saved_pct": st.column_config.NumberColumn("Saved", format="percent"),
+                "normalized_at": st.column_config.DatetimeColumn("Normalized", format="YYYY-MM-DD HH:mm:ss"),
+            },
+        )
+
+if records.empty:
+    st.write("No queries recorded yet. Open one of the other pages first.")
+    st.stop()
+
+records["gb_processed"] = records["total_bytes_processed"].fillna(0) / 1e9
+records["slot_seconds"] = records["slot_millis"].fillna(0) / 1000
+records["estimated_gb"] = records["estimated_bytes"].fillna(0) / 1e9
+
+with st.expander("Summary per page and source", expanded=True):
+    summary = (
+        records.assign(
+            memory_hits=records["cache"].eq("memory"),
+            parquet_hits=records["cache"].eq("parquet"),
+            misses=records["cache"].eq("miss"),
+            errors=records["error"].notna(),
+        )
+        .groupby(["page", "source"])
+        .agg(
+            calls=("query", "size"),
+            memory_hits=("memory_hits", "sum"),
+            parquet_hits=("parquet_hits", "sum"),
+            misses=("misses", "sum"),
+            errors=("errors", "sum"),
+            estimated_gb=("estimated_gb", "sum"),
+            gb_processed=("gb_processed", "sum"),
+            slot_seconds=("slot_seconds", "sum"),
+            downgraded=("downgraded", "sum"),
+            mean_wall_ms=("wall_ms", "mean"),
+            max_wall_ms=("wall_ms", "max"),
+        )
+        .reset_index()
+        .sort_values("gb_processed", ascending=False)
+    )
+    st.dataframe(summary, hide_index=True, use_container_width=True)
+
+with st.expander("Most expensive queries", expanded=True):
+    per_query = (
+        records.groupby(["source", "query"])
+        .agg(
+            calls=("query", "size"),
+            misses=("cache", lambda cache: cache.eq("miss").sum()),
+            estimated_gb=("estimated_gb", "sum"),
+            gb_processed=("gb_processed", "sum"),
+            slot_seconds=("slot_seconds", "sum"),
+            total_wall_ms=("wall_ms", "sum"),
+        )
+        .reset_index()
+        .sort_values("total_wall_ms", ascending=False)
+    )
+    st.dataframe(per_query, hide_index=True, use_container_width=True)
+
+with st.expander("Recent calls", expanded=False):
+    pages = st.multiselect("Page", sorted(records["page"].unique()))
+    recent = records[records["page"].isin(pages)] if pages else records
+    st.dataframe(
+        recent.sort_values("started_at", ascending=False).drop(
+            columns=["total_bytes_processed", "slot_millis", "estimated_bytes"]
+        ),
+        hide_index=True,
+        use_container_width=True,
+        column_config={
+            "started_at": st.column_config.DatetimeColumn("Started", format="YYYY-MM-DD HH:mm:ss"),
+            "wall_ms": st.column_config.NumberColumn("Wall ms", format="%.0f"),
+            "dataframe_ms": st.column_config.NumberColumn("DataFrame ms", format="%.0f"),
+            "gb_processed": st.column_config.NumberColumn("GB processed", format="%.3f"),
+            "estimated_gb": st.column_config.NumberColumn("Estimated GB", format="%.3f"),
+            "slot_seconds": st.column_config.NumberColumn("Slot s", format="%.1f"),
+        },
+    )
+    st.download_button(
+        "Download as CSV",
+        recent.to_csv(index=False).encode("utf-8"),
+        file_name=f"query_telemetry_{pd.Timestamp.now():%Y%m%d_%H%M}.csv",
+        mime="text/csv",
+    )
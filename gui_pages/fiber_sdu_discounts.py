@@ -1,12 +1,19 @@
 # --- Imports ---
 from datetime import datetime
 
-import numpy as np
 import pandas as pd
 import plotly.express as px
 import streamlit as st
 
-from common.data_queries import general_bigquery_query
+from common.data_queries import general_bigquery_query, query_result, strict_bigquery_query, submit_query
+from common.export import export_buttons
+from common.frame_cache import derived_resource, shared_frame
+from common.frame_schema import normalize_frame
+from common.geo_index import geo_index
+from common.invoice_cube import InvoiceCube
+from common.pivot import measure_pivot
+from common.query_builder import QueryBuilder, QueryParams
+from common.tables import render_table
 
 DEFAULT_PRODUCTS_LIST = ["2292", "12292", "9955", "19955", "9990", "9950", "229201", "102292"]
 
@@ -16,40 +23,52 @@ geo_dict = {
     "Fylke": ["fylke_id", "fylke"],
     "Nasjonalt": ["country"],
 }
+# column blocks of the discount tables: average per subscriber, total discounts and total subscribers
+AVG_BLOCK = "Average rabatt per subscriber, NOK"
+REV_BLOCK = "Totale rabatter, NOK"
+SUBS_BLOCK = "Totale kunder"
+DISCOUNT_BLOCKS = {AVG_BLOCK: ("rev_tot", "total_subs"), REV_BLOCK: "rev_tot", SUBS_BLOCK: "total_subs"}
+
+# all geo columns are loaded once, switching geo level only rolls up the cube
+GEO_COLUMNS = tuple(dict.fromkeys(col for columns in geo_dict.values() for col in columns))
+
+
+INVOICE_SUMMARY_TABLE = "spectrum-analytics-secure.fiber_rev_no_test_mirror.VI_PRODUCT_POSTNR_SUMMARY_MAT"
+# geo columns that are not stored in the summary table
+geo_select_expr = {"country": '"Norway" AS country'}
+# measures are summed in float64 by the cube, so float32 is enough to hold them
+INVOICE_SCHEMA = {
+    "PERIOD_YEAR_MONTH": "int32",
+    "product_id": "int32",
+    "product_name": "category",
+    "subscription_package": "category",
+    "subscription_package_ids": "category",
+    **dict.fromkeys(GEO_COLUMNS, "category"),
+    "rev_tot": "float32",
+    "unique_subs": "float32",
+}
 
 
-@st.cache_data()
-def invoice_postcode_query(year) -> str:
-    return f"""
-SELECT
-  vpps.PERIOD_YEAR_MONTH,
-  LEFT(cast(vpps.PERIOD_YEAR_MONTH as STRING),4) as year,
-  RIGHT(cast(vpps.PERIOD_YEAR_MONTH as STRING),2) as month,
-  "Norway" AS country,
-  vpps.product_id,
-  vpps.product_name,
-  vpps.subscription_package_ids,
-  vpps.subscription_package,
-  vpps.billing_segment,
-  vpps.fylke,
-  vpps.fylke_id,
-  vpps.kommune,
-  vpps.kommune_id,
-  vpps.postcode,
-  vpps.post_office,
-  sum(vpps.rev_non_recur) AS rev_non_rec,
-  sum(vpps.rev_recur) AS rev_rec,
-  sum(vpps.total_rev) AS rev_tot,
-  sum(vpps.unique_subs) AS unique_subs,
-  sum(vpps.observations) AS observations
-FROM
-  `spectrum-analytics-secure.fiber_rev_no_test_mirror.VI_PRODUCT_POSTNR_SUMMARY_MAT`
-    AS vpps
-WHERE
-  vpps.PERIOD_YEAR_MONTH in ({", ".join(str(int(f"{year}{month:02d}")) for month in range(1, 13))})
-  AND vpps.billing_segment = 'SDU'
-GROUP BY ALL
-      """
+def invoice_postcode_query(year: int) -> tuple[str, QueryParams]:
+    # Only the columns the page uses are selected. The rows stay at postcode grain for every geo level:
+    # total subscribers are a max over products per area, which cannot be summed up from coarser rows,
+    # so the cube builds every level from postcode cells.
+    return (
+        QueryBuilder(INVOICE_SUMMARY_TABLE, alias="vpps")
+        .select(
+            "PERIOD_YEAR_MONTH",
+            "product_id",
+            "product_name",
+            "subscription_package_ids",
+            "subscription_package",
+            *(geo_select_expr.get(col, col) for col in GEO_COLUMNS),
+        )
+        .sum("total_rev", "rev_tot")
+        .sum("unique_subs")
+        .where_in("PERIOD_YEAR_MONTH", [year * 100 + month for month in range(1, 13)], "INT64")
+        .where_equal("billing_segment", "SDU", "STRING")
+        .build()
+    )
 
 
 @st.cache_data()
@@ -61,34 +80,21 @@ ORDER BY PERIOD_YEAR_MONTH DESC
 """
 
 
-@st.cache_data()
-def get_invoice_postcode_data(year_month: int) -> pd.DataFrame:
-    query = invoice_postcode_query(year_month)
-    return general_bigquery_query(query)
+# built once per loaded year, widget changes only slice and roll up the cube
+@derived_resource
+def year_cube(df: pd.DataFrame) -> InvoiceCube:
+    return InvoiceCube(df, geo_dict)
 
 
-@st.cache_data()
-
-# calculate total subscribers per subscription package per month
-def calculate_total_subscribers(_df: pd.DataFrame, geo_level) -> pd.DataFrame:
-    subscription_df = (
-        _df.groupby(["PERIOD_YEAR_MONTH", "subscription_package_ids", "subscription_package", "product_id"] + geo_level)
-        .agg({"unique_subs": "sum"})
-        .reset_index()
-    )
-    subscription_subs_df = (
-        subscription_df.groupby(
-            ["PERIOD_YEAR_MONTH", "subscription_package_ids", "subscription_package"] + geo_level, as_index=False
-        )
-        .agg({"unique_subs": "max"})
-        .rename(columns={"unique_subs": "total_subs"})
-    )
-    return subscription_subs_df
+# the selected years are combined at cube level, their rows are never concatenated
+@derived_resource
+def invoice_cube(*year_frames: pd.DataFrame) -> InvoiceCube:
+    return InvoiceCube.concat([year_cube(df) for df in year_frames])
 
 
 # Create product selection
-def create_ordered_product_dict(_df: pd.DataFrame) -> dict:
-    products = _df[["product_id", "product_name"]].drop_duplicates().astype(str)
+def create_ordered_product_dict(df: pd.DataFrame) -> dict:
+    products = df[["product_id", "product_name"]].drop_duplicates().astype(str)
     products_sorted = products.sort_values(by="product_name", ascending=True)
     product_dict = dict(zip(products_sorted["product_id"], products_sorted["product_name"]))
     default_product_list_filtered = [pid for pid in DEFAULT_PRODUCTS_LIST if pid in product_dict.keys()]
@@ -96,23 +102,10 @@ def create_ordered_product_dict(_df: pd.DataFrame) -> dict:
     return product_dict, default_product_list_filtered
 
 
-def pivot_table_printer(_df: pd.DataFrame, column_name: str, index_name: list) -> pd.DataFrame:
-    _df_pivot = _df.pivot_table(index=index_name, columns="PERIOD_YEAR_MONTH", values=column_name, fill_value=0)
-
-    if column_name != "avg_rev_per_sub":
-        _df_pivot = _df_pivot.reindex(["Total"] + _df_pivot.index.tolist())
-        _df_pivot.loc["Total"] = _df_pivot.sum(numeric_only=True)
-    return _df_pivot
-
-
-def number_formatter(_df):
-    styled = _df.style.format(subset=_df.columns, formatter="{:,.0f}", na_rep="0")
-    # Apply grey background to "Totale rabatter, NOK" columns
-    if isinstance(_df.columns, pd.MultiIndex):
-        totale_rabatter_cols = [col for col in _df.columns if col[0] == "Totale rabatter, NOK"]
-        if totale_rabatter_cols:
-            styled = styled.set_properties(subset=totale_rabatter_cols, **{"background-color": "#e0e0e0"})
-    return styled
+def discount_table(df: pd.DataFrame, key: str) -> None:
+    # grey background on the "Totale rabatter, NOK" columns, the Total row stays on top
+    highlight = [col for col in df.columns if isinstance(col, tuple) and col[0] == REV_BLOCK]
+    render_table(df, key=key, highlight=highlight, pinned_rows=1)
 
 
 ###################################
@@ -130,20 +123,13 @@ year_selected = st.multiselect(
 )
 
 
-@st.cache_data()
-def selected_year__data(_years: list) -> pd.DataFrame:
-    lst_tmp = []
-    for _yr in _years:
-        df = get_invoice_postcode_data(_yr)
-        lst_tmp.append(df)
-    invoice_data_filtered = pd.concat(lst_tmp)
-    invoice_data_filtered["subscription_package_ids"] = invoice_data_filtered["subscription_package_ids"].astype(str)
-    invoice_data_filtered["subscription_package"] = invoice_data_filtered["subscription_package"].astype(str)
-
-    return invoice_data_filtered
-
-
-df_invoice_year = selected_year__data(year_selected)
+# One partition per year, held once per process and shared by all sessions. Adding a year to the
+# selection only loads that year.
+@shared_frame
+def invoice_year_data(year: int) -> pd.DataFrame:
+    # a failed query raises, so it is not cached
+    invoice_data = strict_bigquery_query(*invoice_postcode_query(year))
+    return normalize_frame(invoice_data, INVOICE_SCHEMA, f"fiber_sdu_invoice_summary.{year}")
 
 
 selected_geo = st.selectbox(
@@ -161,31 +147,21 @@ min_subs = st.slider(
     step=10,
 )
 
-invoice_data_filtered_raw = selected_year__data(year_selected)
-subscription_subs_df = calculate_total_subscribers(invoice_data_filtered_raw, selected_geo_ids)
-product_dict, default_product_list_filtered = create_ordered_product_dict(invoice_data_filtered_raw)
+# the years are independent queries, fetch them concurrently
+year_jobs = {_yr: submit_query(invoice_year_data, _yr) for _yr in sorted(year_selected)}
+year_frames = [query_result(job, str(_yr)) for _yr, job in year_jobs.items()]
+year_frames = [df for df in year_frames if not df.empty]
+if not year_frames:
+    st.warning("Ingen fakturadata for valgte år.")
+    st.stop()
 
-national_df = (
-    invoice_data_filtered_raw.groupby(["PERIOD_YEAR_MONTH", "subscription_package"], as_index=False)
-    .agg({"rev_tot": "sum", "unique_subs": "sum"})
-    .merge(subscription_subs_df, on=["PERIOD_YEAR_MONTH", "subscription_package"], how="left")
-)
+cube = invoice_cube(*year_frames)
+product_dict, default_product_list_filtered = create_ordered_product_dict(cube.product_table())
+geo_areas = cube.areas(selected_geo)
 
-national_gross_rev_piv = national_df.pivot_table(
-    index=["subscription_package"], columns="PERIOD_YEAR_MONTH", values="rev_tot", fill_value=0
-)
-national_total_subs_piv = national_df.pivot_table(
-    index=["subscription_package"], columns="PERIOD_YEAR_MONTH", values="total_subs", fill_value=0
-)
-# add sum row
-national_gross_rev_piv = national_gross_rev_piv.reindex(["Total"] + national_gross_rev_piv.index.tolist())
-national_gross_rev_piv.loc["Total"] = national_gross_rev_piv.sum(numeric_only=True)
-national_total_subs_piv = national_total_subs_piv.reindex(["Total"] + national_total_subs_piv.index.tolist())
-national_total_subs_piv.loc["Total"] = national_total_subs_piv.sum(numeric_only=True)
-# Replace 0 with NaN in denominator to avoid division by zero, then replace result NaN with 0
+national_df = cube.rollup("Nasjonalt", by="subscription_package")
 
-
-national_net_arpu_pivot = national_gross_rev_piv.div(national_total_subs_piv.replace(0, np.nan)).fillna(0)
+national_piv = measure_pivot(national_df, ["subscription_package"], DISCOUNT_BLOCKS)
 
 selected_product_ids = st.multiselect(
     "Velg produkt(er) for analyse:",
@@ -195,57 +171,17 @@ selected_product_ids = st.multiselect(
 )
 selected_product_ids = [int(x) for x in selected_product_ids]
 
-invoice_data_filtered = invoice_data_filtered_raw[invoice_data_filtered_raw["product_id"].isin(selected_product_ids)]
-
-sub_per_month = (
-    subscription_subs_df.groupby(["PERIOD_YEAR_MONTH", "subscription_package"], as_index=False)
-    .agg({"total_subs": "max"})
-    .groupby(["PERIOD_YEAR_MONTH"], as_index=False)
-    .agg({"total_subs": "sum"})
-)
-national_total_rabatter = (
-    invoice_data_filtered.groupby(["PERIOD_YEAR_MONTH", "product_name"], as_index=False)
-    .agg({"rev_tot": "sum", "unique_subs": "sum"})
-    .merge(sub_per_month, on=["PERIOD_YEAR_MONTH"], how="left")
+sub_per_month = national_df.groupby(["PERIOD_YEAR_MONTH"], as_index=False).agg({"total_subs": "sum"})
+national_total_rabatter = cube.rollup("Nasjonalt", by="product_name", products=selected_product_ids).merge(
+    sub_per_month, on=["PERIOD_YEAR_MONTH"], how="left"
 )
 
-national_rabatt_piv = national_total_rabatter.pivot_table(
-    index=["product_name"], columns="PERIOD_YEAR_MONTH", values="rev_tot", fill_value=0
+national_rabatt_piv = measure_pivot(
+    national_total_rabatter, ["product_name"], DISCOUNT_BLOCKS, total_mean=["total_subs"]
 )
-national_total_subs_rabatt_piv = national_total_rabatter.pivot_table(
-    index=["product_name"], columns="PERIOD_YEAR_MONTH", values="total_subs", fill_value=0
-)
-# add sum row
-national_rabatt_piv = national_rabatt_piv.reindex(["Total"] + national_rabatt_piv.index.tolist())
-national_rabatt_piv.loc["Total"] = national_rabatt_piv.sum(numeric_only=True)
 
-national_total_subs_rabatt_piv = national_total_subs_rabatt_piv.reindex(
-    ["Total"] + national_total_subs_rabatt_piv.index.tolist()
-)
-national_total_subs_rabatt_piv.loc["Total"] = national_total_subs_rabatt_piv.mean(numeric_only=True)
-# Replace 0 with NaN in denominator to
-national_avg_rabatt_piv = national_rabatt_piv.div(national_total_subs_rabatt_piv.replace(0, np.nan)).fillna(0)
-
-
-invoice_data_grp = invoice_data_filtered.groupby(
-    ["PERIOD_YEAR_MONTH", "subscription_package"] + selected_geo_ids, as_index=False
-).agg(
-    {
-        "rev_tot": "sum",
-        "unique_subs": "sum",
-    }
-)
 
-invoice_data_grp = (
-    invoice_data_grp.merge(
-        subscription_subs_df, on=["PERIOD_YEAR_MONTH", "subscription_package"] + selected_geo_ids, how="left"
-    )
-    .groupby(["PERIOD_YEAR_MONTH"] + selected_geo_ids, as_index=False)
-    .agg({"rev_tot": "sum", "unique_subs": "sum", "total_subs": "sum"})
-)
-
-invoice_data_grp["avg_rev_per_sub"] = invoice_data_grp["rev_tot"] / invoice_data_grp["total_subs"]
-invoice_data_grp = invoice_data_grp.query("total_subs >= @min_subs")
+invoice_data_grp = cube.rollup(selected_geo, by="area", products=selected_product_ids, min_subs=min_subs)
 
 
 with st.expander(
@@ -253,127 +189,59 @@ with st.expander(
     expanded=False,
 ):
     st.subheader("Nasjonal netto ARPU")
-    st.dataframe(number_formatter(national_net_arpu_pivot))
+    discount_table(national_piv[AVG_BLOCK], "national_arpu")
     st.subheader("Nasjonalt totalt antall abonnenter")
-    st.dataframe(number_formatter(national_total_subs_piv))
+    discount_table(national_piv[SUBS_BLOCK], "national_subs")
     st.subheader("Nasjonal netto inntekter")
-    st.dataframe(number_formatter(national_gross_rev_piv))
+    discount_table(national_piv[REV_BLOCK], "national_rev")
     st.subheader("Nasjonal gjennomsnittlig rabatt per abonnent for valgte produkter")
-    st.dataframe(number_formatter(national_avg_rabatt_piv))
+    discount_table(national_rabatt_piv[AVG_BLOCK], "national_rabatt_avg")
     st.subheader("Nasjonal totale rabatter for valgte produkter")
-    st.dataframe(number_formatter(national_rabatt_piv))
+    discount_table(national_rabatt_piv[REV_BLOCK], "national_rabatt_rev")
     st.subheader("Nasjonalt antall abonnenter for valgte produkter")
-    st.dataframe(number_formatter(national_total_subs_rabatt_piv))
+    discount_table(national_rabatt_piv[SUBS_BLOCK], "national_rabatt_subs")
 
 st.subheader(
     f"Gjennomsnittlig rabatt per abonnent i valgt geografisk nivå: {selected_geo.capitalize()} med minimum {min_subs} abonnenter"
 )
 
-geo_level_piv = pivot_table_printer(invoice_data_grp, "total_subs", selected_geo_ids)
-geo_rev_tot_piv = pivot_table_printer(invoice_data_grp, "rev_tot", selected_geo_ids)
-geo_avg_rev_piv = geo_rev_tot_piv.div(geo_level_piv.replace(0, np.nan)).fillna(0)
-geo_avg_rev_piv = geo_avg_rev_piv.sort_values(by=invoice_data_grp["PERIOD_YEAR_MONTH"].max(), ascending=True)
-idx = geo_avg_rev_piv.index.tolist()
+geo_all_df_merged = measure_pivot(invoice_data_grp, selected_geo_ids, DISCOUNT_BLOCKS, sort_by=AVG_BLOCK)
+discount_table(geo_all_df_merged, "geo_discounts")
 
-geo_avg_rev_piv_display = geo_avg_rev_piv.reindex(idx).fillna(0)
-geo_avg_rev_piv_display.columns = pd.MultiIndex.from_product(
-    [["Average rabatt per subscriber, NOK"], geo_avg_rev_piv_display.columns]
-)
 
-geo_rev_tot_piv_display = geo_rev_tot_piv.reindex(idx).fillna(0)
-geo_rev_tot_piv_display.columns = pd.MultiIndex.from_product(
-    [["Totale rabatter, NOK"], geo_rev_tot_piv_display.columns]
-)
+def discount_sheets() -> dict[str, pd.DataFrame]:
+    # the national summaries and the discount pivot of every geo level, for the selected products
+    sheets = {"Nasjonal oppsummering": national_piv, "Nasjonal valgte produkter": national_rabatt_piv}
+    for level, level_ids in geo_dict.items():
+        level_df = cube.rollup(level, by="area", products=selected_product_ids, min_subs=min_subs)
+        sheets[level] = measure_pivot(level_df, level_ids, DISCOUNT_BLOCKS, sort_by=AVG_BLOCK)
+    return sheets
 
-geo_level_piv_display = geo_level_piv.reindex(idx).fillna(0)
-geo_level_piv_display.columns = pd.MultiIndex.from_product([["Totale kunder"], geo_level_piv_display.columns])
 
-geo_all_df_merged = pd.concat([geo_avg_rev_piv_display, geo_rev_tot_piv_display, geo_level_piv_display], axis=1)
-geo_all_df_merged = geo_all_df_merged.fillna(0)
-st.dataframe(number_formatter(geo_all_df_merged))
+export_buttons(discount_sheets, f"fiber_sdu_rabatter_{'_'.join(map(str, sorted(year_selected)))}", key="discounts")
 # subscription package level analysis for selected geo level and min_subs
 st.subheader("Abonnementspakke nivå analyse for utvalgt geografi")
 
-if selected_geo == "Nasjonalt":
-    geo_area_options = invoice_data_filtered_raw["country"].unique().tolist()
-else:
-    geo_area_options = invoice_data_filtered_raw[selected_geo_ids[1]].unique().tolist()
+area_index = geo_index(geo_areas, selected_geo_ids[-1])
+geo_area_options = area_index.keys()
 
 selected_area = st.selectbox("Velg område for tidsserieanalyse:", options=geo_area_options)
 
 if selected_geo == "Nasjonalt":
     unique_id_numb = "Norway"
 else:
-    if (
-        len(
-            invoice_data_filtered_raw[invoice_data_filtered_raw[selected_geo_ids[1]] == selected_area][
-                selected_geo_ids[0]
-            ].unique()
-        )
-        > 1
-    ):
-        relevant_ids = invoice_data_filtered_raw[invoice_data_filtered_raw[selected_geo_ids[1]] == selected_area][
-            selected_geo_ids[0]
-        ].unique()
+    relevant_ids = area_index.values(selected_area, selected_geo_ids[0])
+    if len(relevant_ids) > 1:
         unique_id_numb = st.selectbox("Velg spesifikt ID for området:", options=relevant_ids)
     else:
-        unique_id_numb = invoice_data_filtered_raw[invoice_data_filtered_raw[selected_geo_ids[1]] == selected_area][
-            selected_geo_ids[0]
-        ].unique()[0]
+        unique_id_numb = relevant_ids[0]
         st.text(f"Valgt område har unikt ID: {unique_id_numb}")
 
-selected_area_df = invoice_data_filtered_raw[invoice_data_filtered_raw[selected_geo_ids[0]] == unique_id_numb]
-selected_area_df = selected_area_df[selected_area_df["product_id"].isin(selected_product_ids)]
-
-invoice_data_subscription = selected_area_df.groupby(
-    ["PERIOD_YEAR_MONTH", "subscription_package"] + selected_geo_ids, as_index=False
-).agg(
-    {
-        "rev_tot": "sum",
-        "unique_subs": "sum",
-    }
-)
-
-invoice_data_subscription = (
-    invoice_data_subscription.merge(
-        subscription_subs_df, on=["PERIOD_YEAR_MONTH", "subscription_package"] + selected_geo_ids, how="left"
-    )
-    .groupby(["PERIOD_YEAR_MONTH", "subscription_package"] + selected_geo_ids, as_index=False)
-    .agg({"rev_tot": "sum", "unique_subs": "sum", "total_subs": "sum"})
+invoice_data_subscription = cube.rollup(
+    selected_geo, by="subscription_package", products=selected_product_ids, area_id=unique_id_numb
 )
 
-invoice_data_subscription["avg_rev_per_sub"] = (
-    invoice_data_subscription["rev_tot"] / invoice_data_subscription["total_subs"]
-)
-
-
-tot_subs_selected_df = pivot_table_printer(
-    _df=invoice_data_subscription, column_name="total_subs", index_name=["subscription_package"]
-)
-
-
-tot_subs_selected_df_display = tot_subs_selected_df.fillna(0).copy()
-tot_subs_selected_df_display.columns = pd.MultiIndex.from_product(
-    [["Totale kunder"], tot_subs_selected_df_display.columns]
-)
-
-rev_tot_selected_df = pivot_table_printer(invoice_data_subscription, "rev_tot", index_name=["subscription_package"])
-rev_tot_selected_df_display = rev_tot_selected_df.fillna(0).copy()
-rev_tot_selected_df_display.columns = pd.MultiIndex.from_product(
-    [["Totale rabatter, NOK"], rev_tot_selected_df_display.columns]
-)
-
-# Replace 0 with NaN in denominator to avoid division by zero, then replace result NaN with 0
-avg_tot_selected_df = rev_tot_selected_df.div(tot_subs_selected_df.replace(0, np.nan))
-avg_tot_selected_df_display = avg_tot_selected_df.fillna(0).copy()
-avg_tot_selected_df_display.columns = pd.MultiIndex.from_product(
-    [["Average rabatt per subscriber, NOK"], avg_tot_selected_df_display.columns]
-)
-
-all_df_merged = pd.concat(
-    [avg_tot_selected_df_display, rev_tot_selected_df_display, tot_subs_selected_df_display], axis=1
-)
-all_df_merged = all_df_merged.fillna(0)
-st.dataframe(number_formatter(all_df_merged))
+all_df_merged = measure_pivot(invoice_data_subscription, ["subscription_package"], DISCOUNT_BLOCKS)
+discount_table(all_df_merged, "package_discounts")
 
 _col_21, _col_22, _col_23 = st.columns(3)
@@ -1,12 +1,35 @@
 # --- Imports ---
+import functools
+from datetime import datetime
+
 import numpy as np
 import pandas as pd
 import plotly.express as px
 import streamlit as st
-from datetime import datetime
 
-
-from common.data_queries import general_bigquery_query
+from common.charts import CHART_MAX_SERIES, area_line_chart, top_series
+from common.data_queries import (
+    query_result,
+    strict_bigquery_query,
+    submit_bigquery_queries,
+    submit_bigquery_query,
+    submit_query,
+)
+from common.export import export_buttons
+from common.frame_cache import derived_frame, shared_frame
+from common.frame_schema import fill_numeric, normalize_frames
+from common.geo_index import geo_index
+from common.invoice_lines import (
+    HIDDEN_SUBSCRIPTION_TYPES,
+    TV_PACKAGE,
+    abo_query,
+    breakdown_table,
+    load_invoice_line_summary,
+    subscription_breakdown,
+)
+from common.monthly_store import load_monthly
+from common.pivot import measure_pivot
+from common.tables import render_table
 
 
 # --- Chart/UI Helper Functions ---
@@ -33,35 +56,64 @@ def plot_in_columns(figs: list, columns: list):
 
 
 # --- Helper Functions ---
-def aggregate_geo(df: pd.DataFrame, group_cols: list) -> pd.DataFrame:
-    agg_dict = {
-        "rev_recur_tn": "sum",
-        "rev_non_recur_tn": "sum",
-        "rev_recur_vula": "sum",
-        "rev_non_recur_vula": "sum",
-        "abo_antall_tn": "sum",
-        "abo_antall_vula": "sum",
-    }
-    grp = df.groupby(group_cols).agg(agg_dict).reset_index()
-    grp["arpu_per_abo_tn"] = np.where(
-        grp["abo_antall_tn"] == 0,
-        0,
-        (grp["rev_recur_tn"] + grp["rev_non_recur_tn"]) / grp["abo_antall_tn"],
-    )
-    grp["arpu_per_abo_vula"] = np.where(
-        grp["abo_antall_vula"] == 0,
-        0,
-        (grp["rev_recur_vula"] + grp["rev_non_recur_vula"]) / grp["abo_antall_vula"],
-    )
+# merged and aggregated frames held per process, one per (rabatt selection, first month) in use
+GEO_FRAME_MAX_ENTRIES = 4
+GEO_MEASURES = [
+    "rev_recur_tn",
+    "rev_non_recur_tn",
+    "rev_recur_vula",
+    "rev_non_recur_vula",
+    "abo_antall_tn",
+    "abo_antall_vula",
+]
+# group columns per level, every level's columns are a subset of the postcode columns
+GEO_LEVELS = {
+    "County": ["COUNTY_ID", "COUNTY", "PERIOD_YEAR_MONTH"],
+    "Municipal": ["MUNICIPAL_ID", "MUNICIPAL", "COUNTY_ID", "COUNTY", "PERIOD_YEAR_MONTH"],
+    "Postcode": ["POSTCODE_ID", "POST_OFFICE", "MUNICIPAL_ID", "MUNICIPAL", "COUNTY_ID", "COUNTY", "PERIOD_YEAR_MONTH"],
+}
+
+
+def _ratio(numerator: pd.Series, denominator: pd.Series) -> np.ndarray:
+    # 0 where the denominator is 0, in the dtype of the division (float32 for float32 counts)
+    numerator, denominator = numerator.to_numpy(), denominator.to_numpy()
+    out = np.zeros(len(numerator), dtype=np.result_type(numerator, denominator, np.float16))
+    return np.divide(numerator, denominator, out=out, where=denominator != 0)
+
+
+def _add_ratios(grp: pd.DataFrame) -> pd.DataFrame:
+    # ARPU, total subs and VULA share from the GEO_MEASURES sums
+    grp["arpu_per_abo_tn"] = _ratio(grp["rev_recur_tn"] + grp["rev_non_recur_tn"], grp["abo_antall_tn"])
+    grp["arpu_per_abo_vula"] = _ratio(grp["rev_recur_vula"] + grp["rev_non_recur_vula"], grp["abo_antall_vula"])
     grp["total_subs"] = grp["abo_antall_tn"] + grp["abo_antall_vula"]
-    grp["vula_sub_share"] = np.where(
-        grp["total_subs"] == 0,
-        0,
-        grp["abo_antall_vula"] / grp["total_subs"],
-    )
+    grp["vula_sub_share"] = _ratio(grp["abo_antall_vula"], grp["total_subs"])
     return grp
 
 
+@shared_frame(max_entries=GEO_FRAME_MAX_ENTRIES)
+def aggregate_geo(df: pd.DataFrame, levels: dict[str, list[str]]) -> dict[str, pd.DataFrame]:
+    """Sums and ARPU/VULA share per area and month for every level in `levels` (name -> group columns).
+
+    The base rows are grouped once, at the level with the most columns; the other levels are summed from
+    those partial sums.
+    """
+    finest = max(levels.values(), key=len)
+    # missing keys are kept here and dropped per level, as a groupby on the base rows would
+    sums = df.groupby(finest, observed=True, dropna=False)[GEO_MEASURES].sum().reset_index()
+    result = {}
+    for name, group_cols in levels.items():
+        if group_cols == finest:
+            grp = sums.dropna(subset=group_cols).reset_index(drop=True)
+        else:
+            grp = sums.groupby(group_cols, observed=True)[GEO_MEASURES].sum().reset_index()
+        grp = _add_ratios(grp)
+        # sorted by area id and month, with the month as date for the charts
+        grp = grp.sort_values(by=[group_cols[0], "PERIOD_YEAR_MONTH"])
+        grp["dt"] = pd.to_datetime(grp["PERIOD_YEAR_MONTH"].astype(str), format="%Y%m")
+        result[name] = grp
+    return result
+
+
 tn_arpu_query = """
 SELECT
   gsa.billing_segment,
@@ -81,6 +133,7 @@ FROM
   `spectrum-analytics-secure.fiber_rev_no_test_mirror.geo_sub_arpu_terje_tempo` gsa
 WHERE
   gsa.stock_segment = "CDK FIBER SDU"
+  AND gsa.PERIOD_YEAR_MONTH BETWEEN @first_month AND @last_month
 GROUP BY
   ALL
 """
@@ -103,6 +156,7 @@ FROM
   `spectrum-analytics-secure.fiber_rev_no_test_mirror.GEO_SUB_RABATT_TERJE_TEMPO` gsa
 WHERE
   gsa.stock_segment = "CDK FIBER SDU"
+  AND gsa.PERIOD_YEAR_MONTH BETWEEN @first_month AND @last_month
 GROUP BY
   ALL
 """
@@ -126,129 +180,59 @@ SELECT
   gsa.POST_OFFICE
 FROM
   `spectrum-analytics-secure.fiber_rev_no_test_mirror.geo_vula_sub_arpu_terje_tempo` AS gsa
+WHERE
+  gsa.dt >= PARSE_DATE("%Y%m", CAST(@first_month AS STRING))
+  AND gsa.dt < DATE_ADD(PARSE_DATE("%Y%m", CAST(@last_month AS STRING)), INTERVAL 1 MONTH)
   group by ALL
 """
 
+# months with TN data, the period window of the page is chosen from these
+geo_month_query = """
+SELECT DISTINCT
+  gsa.PERIOD_YEAR_MONTH
+FROM
+  `spectrum-analytics-secure.fiber_rev_no_test_mirror.geo_sub_arpu_terje_tempo` gsa
+WHERE
+  gsa.stock_segment = "CDK FIBER SDU"
+ORDER BY
+  gsa.PERIOD_YEAR_MONTH DESC
+"""
+
+# The base tables are stored per month (see common.monthly_store), so extending the period window only
+# queries the months that are not stored yet. The queries are limited to the first and last missing month,
+# which lets BigQuery prune the partitions it scans.
+GEO_ARPU_QUERIES = {"tn_arpu": tn_arpu_query, "tn_rabatt": tn_rabatt_query, "vula_arpu": vula_arpu_qry}
+GEO_ARPU_STORE = "geo_tn_vula_arpu_v1"
 
-def abo_query(year_month: int) -> str:
-    return f"""
-  WITH
-    subs AS (
-      SELECT
-        b.ABONNENT_NR,
-        b.PERIOD_YEAR_MONTH,
-        s.billing_segment,
-        pd.SOURCE_SYSTEM_NAME,
-        pd.SOURCE_PRODUCT_ID_1,
-        b.PRODUKT_NR,
-        pd.PRODUCT_NAME,
-        SUM(
-          CASE
-            WHEN INVOICE_TERM = "T" THEN AMOUNT
-            ELSE 0
-            END)
-          - SUM(
-            CASE
-              WHEN INVOICE_TERM = "T" THEN DISCOUNT
-              ELSE 0
-              END) AS SUB_REVENUE_RECURRING_EXCL_MVA_TOTAL,
-        SUM(
-          CASE
-            WHEN INVOICE_TERM = "E" THEN AMOUNT
-            ELSE 0
-            END)
-          - SUM(
-            CASE
-              WHEN INVOICE_TERM = "E" THEN DISCOUNT
-              ELSE 0
-              END) AS SUB_REVENUE_NONRECURRING_EXCL_MVA_TOTAL
-      FROM
-        `spectrum-analytics-secure.fiber_rev_no_test_mirror.BILLING_PERIOD_FACT` b
-      INNER JOIN
-        `spectrum-analytics-secure.fiber_rev_no_test_mirror.VI_MAT_FIBER_SUBS` s
-        ON
-          b.ABONNENT_NR = s.ABONNENT_NR
-          AND b.PERIOD_YEAR_MONTH = s.PERIOD_YEAR_MONTH
-      LEFT JOIN
-        `spectrum-analytics-secure.fiber_rev_no_test_mirror.PRODUCT_DIM` AS pd
-        ON
-          pd.SOURCE_PRODUCT_ID_1 = CAST(b.PRODUKT_NR AS string)
-      WHERE
-        pd.SOURCE_SYSTEM_NAME = "KAS"
-        AND b.PERIOD_YEAR_MONTH = {year_month}
-        AND s.billing_segment = "SDU"
-      GROUP BY
-        ALL
-    ),
-    subsc_type AS (
-      SELECT DISTINCT
-        bpf.ABONNENT_NR,
-        bpf.PERIOD_YEAR_MONTH,
-        pvt.PRODUCT_NAME,
-        pvt.SOURCE_PRODUCT_ID_1
-      FROM
-        `spectrum-analytics-secure.fiber_rev_no_test_mirror.BILLING_PERIOD_FACT`
-          AS bpf
-      INNER JOIN
-        `spectrum-analytics-secure.fiber_rev_no_test_mirror.PRODUCT_V_TMP` AS pvt
-        ON CAST(bpf.PRODUKT_NR AS STRING) = pvt.SOURCE_PRODUCT_ID_1
-      WHERE bpf.PERIOD_YEAR_MONTH = {year_month}
-      and pvt.SOURCE_SYSTEM_NAME = "KAS"
-      and pvt.TECHNOLOGY = "FIBER"
-    ),
-    tv_subsc AS (
-      SELECT DISTINCT
-        tv_bpf.ABONNENT_NR,
-        tv_bpf.PERIOD_YEAR_MONTH,
-        tv_pvt.PRODUCT_NAME,
-      FROM
-        `spectrum-analytics-secure.fiber_rev_no_test_mirror.BILLING_PERIOD_FACT`
-          AS tv_bpf
-      INNER JOIN
-        `spectrum-analytics-secure.fiber_rev_no_test_mirror.PRODUCT_V_TMP`
-          AS tv_pvt
-        ON CAST(tv_bpf.PRODUKT_NR AS STRING) = tv_pvt.SOURCE_PRODUCT_ID_1
-      WHERE
-        tv_bpf.PERIOD_YEAR_MONTH = {year_month}
-        AND tv_pvt.SOURCE_SYSTEM_NAME = "KAS"
-        AND (tv_pvt.PRODUCT_NAME in ("Grunnpakke TV", "T-We & Streaming"))
 
-    )
-  SELECT
-    subs.billing_segment segment,
-    subs.SOURCE_SYSTEM_NAME,
-    subs.PERIOD_YEAR_MONTH,
-    subs.PRODUKT_NR,
-    subs.PRODUCT_NAME AS invoice_line_name,
-    subsc_type.SOURCE_PRODUCT_ID_1,
-    subsc_type.PRODUCT_NAME AS subscription_type,
-    Case when COALESCE(tv_subsc.PRODUCT_NAME, "NO") = "NO" then "NO" else "YES" end AS tv_subsc,
-    COUNT(subs.ABONNENT_NR) AS units,
-    Round(
-      sum(SUB_REVENUE_RECURRING_EXCL_MVA_TOTAL)
-        + sum(SUB_REVENUE_NONRECURRING_EXCL_MVA_TOTAL),
-      0) AS tot_rev_nok_ex_vat,
-    Round(
-      1.25 * (
-        sum(SUB_REVENUE_RECURRING_EXCL_MVA_TOTAL)
-        + sum(SUB_REVENUE_NONRECURRING_EXCL_MVA_TOTAL)),
-      0) AS tot_rev_nok_incl_vat,
-  FROM subs
-  LEFT JOIN subsc_type
-    ON
-      subsc_type.ABONNENT_NR = subs.ABONNENT_NR
-      AND subsc_type.PERIOD_YEAR_MONTH = subs.PERIOD_YEAR_MONTH
-  LEFT JOIN tv_subsc
-    ON
-      tv_subsc.ABONNENT_NR = subs.ABONNENT_NR
-      AND tv_subsc.PERIOD_YEAR_MONTH = subs.PERIOD_YEAR_MONTH
-  GROUP BY ALL
-  ORDER BY
-    sum(SUB_REVENUE_RECURRING_EXCL_MVA_TOTAL),
-    subs.PERIOD_YEAR_MONTH,
-    COUNT(subs.ABONNENT_NR) DESC,
-    subs.PRODUCT_NAME
-    """
+# compact dtypes of the base frames. Subscriber counts are float32, revenue stays float64 as it is summed
+# and shown as is.
+GEO_ARPU_SCHEMA = {
+    "billing_segment": "category",
+    "stock_segment": "category",
+    "segment": "category",
+    "project_segment": "category",
+    "PERIOD_YEAR_MONTH": "int32",
+    "COUNTY_ID": "category",
+    "COUNTY": "category",
+    "MUNICIPAL_ID": "category",
+    "MUNICIPAL": "category",
+    "POSTCODE_ID": "category",
+    "POST_OFFICE": "category",
+    "abo_antall": "float32",
+}
+
+
+def _compute_geo_months(name: str, months: list[int]) -> dict[int, pd.DataFrame]:
+    params = (("first_month", "INT64", min(months)), ("last_month", "INT64", max(months)))
+    # runs on a query worker (see tn_vula_arpu_frame); a failed query raises, so its months are not stored
+    df = strict_bigquery_query(GEO_ARPU_QUERIES[name], params)
+    month = df["YEAR"] * 100 + df["MONTH"] if name == "vula_arpu" else df["PERIOD_YEAR_MONTH"]
+    return {year_month: df[month == year_month].reset_index(drop=True) for year_month in months}
+
+
+def load_geo_months(name: str, months: list[int]) -> pd.DataFrame:
+    return load_monthly(f"{GEO_ARPU_STORE}.{name}", months, functools.partial(_compute_geo_months, name))
 
 
 def month_year_query() -> str:
@@ -292,79 +276,116 @@ GROUP BY ALL
 rabatt_run = st.radio("Kjøring bare på rabatter?", ("Nei", "Ja"), index=0, key="tn_rabatter_included")
 
 
-@st.cache_data(show_spinner=False)
-def cached_query(qry: str) -> pd.DataFrame:
-    return general_bigquery_query(qry)
-
+def submit_invoice_jobs(year_month: int) -> dict:
+    return submit_bigquery_queries(
+        {"invoice_lines": abo_query(year_month), "invoice_postcode": invoice_postcode_query(year_month)}
+    )
 
-tn_arpu_df_tmp = cached_query(tn_arpu_query)
-tn_arpu_df_tmp = tn_arpu_df_tmp[tn_arpu_df_tmp["billing_segment"] == "SDU"]
-tn_arpu_df_tmp = tn_arpu_df_tmp.drop(columns=["stock_segment"])
 
-tn_rabatt_df = cached_query(tn_rabatt_query)
-tn_rabatt_df = tn_rabatt_df[tn_rabatt_df["billing_segment"] == "SDU"]
-tn_rabatt_df = tn_rabatt_df.drop(columns=["stock_segment"])
+# The invoice line tabs only depend on the invoice month, so their queries are started before the
+# summary sections are built and run in the background while those render
+month_job = submit_bigquery_query(month_year_query())
+prefetch_month = st.session_state.get("invoice_line_year_month")
+invoice_jobs = {prefetch_month: submit_invoice_jobs(prefetch_month)} if prefetch_month else {}
 
-if rabatt_run == "Nei":
-    tn_arpu_df = tn_arpu_df_tmp.copy()
-else:
+rabatt_subs_only = None
+if rabatt_run == "Ja":
     rabatt_subs_only = st.radio("Kjøring kun med kunder med rabatt?", ("Nei", "Ja"), index=0, key="tn_rabatter_only")
-    if rabatt_subs_only == "Ja":
-        tn_arpu_df_tmp = tn_arpu_df_tmp.drop(columns=["rev_recur", "rev_non_recur", "arpu_per_abo", "abo_antall"])
-        tn_rabatt_df = tn_rabatt_df.drop(columns=["arpu_per_abo"])
-    else:
-        tn_arpu_df_tmp = tn_arpu_df_tmp.drop(columns=["rev_recur", "rev_non_recur", "arpu_per_abo"])
-        tn_rabatt_df = tn_rabatt_df.drop(columns=["arpu_per_abo", "abo_antall"])
 
-    tn_arpu_df = tn_arpu_df_tmp.merge(
-        tn_rabatt_df,
-        how="left",
-        on=[
-            "billing_segment",
-            "PERIOD_YEAR_MONTH",
-            "COUNTY_ID",
-            "COUNTY",
-            "MUNICIPAL_ID",
-            "MUNICIPAL",
-            "POSTCODE_ID",
-            "POST_OFFICE",
-        ],
-        suffixes=("_orig", "_rabatt"),
-    ).fillna(0)
-    tn_arpu_df["arpu_per_abo"] = (tn_arpu_df["rev_recur"] + tn_arpu_df["rev_non_recur"]) / tn_arpu_df["abo_antall"]
-
-vula_arpu_df_tmp = cached_query(vula_arpu_qry)
-vula_arpu_df_tmp = vula_arpu_df_tmp[vula_arpu_df_tmp["segment"] == "SDU"]
-vula_arpu_df = (
-    vula_arpu_df_tmp.groupby(
-        [
-            "YEAR",
-            "MONTH",
-            "COUNTY_ID",
-            "COUNTY",
-            "MUNICIPAL_ID",
-            "MUNICIPAL",
-            "POSTCODE_ID",
-            "POST_OFFICE",
-            "segment",
-        ]
-    )
-    .agg({"abo_antall": "sum", "rev_recur": "sum", "rev_non_recur": "sum"})
-    .reset_index()
+# the page only loads the months from the selected first month on
+month_options = query_result(submit_bigquery_query(geo_month_query), "available months")
+if month_options.empty:
+    st.stop()
+month_options = month_options["PERIOD_YEAR_MONTH"].sort_values(ascending=False).tolist()
+first_year_month_plot = st.selectbox(
+    "Select first year/month to plot from", options=month_options, index=min(24, len(month_options) - 1)
 )
 
 
-# create new column PERIOD_YEAR_MONTH in vula_arpu_df (as integer) and remove year and month columns
-vula_arpu_df["PERIOD_YEAR_MONTH"] = vula_arpu_df["YEAR"].astype(str) + vula_arpu_df["MONTH"].astype(str).str.zfill(2)
-vula_arpu_df["PERIOD_YEAR_MONTH"] = vula_arpu_df["PERIOD_YEAR_MONTH"].astype(int)
-vula_arpu_df = vula_arpu_df.drop(columns=["YEAR", "MONTH"])
+# Held once per process and shared by all sessions, the page works on views of it. The per-month base
+# tables stay in the monthly store, so only a few merged frames are kept.
+@shared_frame(max_entries=GEO_FRAME_MAX_ENTRIES)
+def tn_vula_arpu_frame(rabatt_run: str, rabatt_subs_only: str | None, months: tuple[int, ...]) -> pd.DataFrame:
+    # the three base tables are independent, load them concurrently; a failed query raises, so it is not cached
+    jobs = {name: submit_query(load_geo_months, name, list(months)) for name in GEO_ARPU_QUERIES}
+    base_data = {name: job.result() for name, job in jobs.items()}
+    # normalized together, the geo columns share their categories and stay categorical through the merges
+    base_data = normalize_frames(base_data, GEO_ARPU_SCHEMA, "geo_tn_vula_arpu")
+    tn_arpu_df_tmp = base_data["tn_arpu"]
+    tn_arpu_df_tmp = tn_arpu_df_tmp[tn_arpu_df_tmp["billing_segment"] == "SDU"]
+    tn_arpu_df_tmp = tn_arpu_df_tmp.drop(columns=["stock_segment"])
+
+    tn_rabatt_df = base_data["tn_rabatt"]
+    tn_rabatt_df = tn_rabatt_df[tn_rabatt_df["billing_segment"] == "SDU"]
+    tn_rabatt_df = tn_rabatt_df.drop(columns=["stock_segment"])
+
+    if rabatt_run == "Nei":
+        tn_arpu_df = tn_arpu_df_tmp
+    else:
+        if rabatt_subs_only == "Ja":
+            tn_arpu_df_tmp = tn_arpu_df_tmp.drop(columns=["rev_recur", "rev_non_recur", "arpu_per_abo", "abo_antall"])
+            tn_rabatt_df = tn_rabatt_df.drop(columns=["arpu_per_abo"])
+        else:
+            tn_arpu_df_tmp = tn_arpu_df_tmp.drop(columns=["rev_recur", "rev_non_recur", "arpu_per_abo"])
+            tn_rabatt_df = tn_rabatt_df.drop(columns=["arpu_per_abo", "abo_antall"])
+
+        tn_arpu_df = tn_arpu_df_tmp.merge(
+            tn_rabatt_df,
+            how="left",
+            on=[
+                "billing_segment",
+                "PERIOD_YEAR_MONTH",
+                "COUNTY_ID",
+                "COUNTY",
+                "MUNICIPAL_ID",
+                "MUNICIPAL",
+                "POSTCODE_ID",
+                "POST_OFFICE",
+            ],
+            suffixes=("_orig", "_rabatt"),
+        ).pipe(fill_numeric)
+        tn_arpu_df["arpu_per_abo"] = (tn_arpu_df["rev_recur"] + tn_arpu_df["rev_non_recur"]) / tn_arpu_df["abo_antall"]
+
+    vula_arpu_df_tmp = base_data["vula_arpu"]
+    vula_arpu_df_tmp = vula_arpu_df_tmp[vula_arpu_df_tmp["segment"] == "SDU"]
+    vula_arpu_df = (
+        vula_arpu_df_tmp.groupby(
+            [
+                "YEAR",
+                "MONTH",
+                "COUNTY_ID",
+                "COUNTY",
+                "MUNICIPAL_ID",
+                "MUNICIPAL",
+                "POSTCODE_ID",
+                "POST_OFFICE",
+                "segment",
+            ],
+            observed=True,
+        )
+        .agg({"abo_antall": "sum", "rev_recur": "sum", "rev_non_recur": "sum"})
+        .reset_index()
+    )
 
-tn_vula_arpu_df = tn_arpu_df.merge(
-    vula_arpu_df,
-    how="left",
-    on=["PERIOD_YEAR_MONTH", "COUNTY_ID", "COUNTY", "MUNICIPAL_ID", "MUNICIPAL", "POSTCODE_ID", "POST_OFFICE"],
-    suffixes=("_tn", "_vula"),
-).fillna(0)
+    # create new column PERIOD_YEAR_MONTH in vula_arpu_df (as integer) and remove year and month columns
+    vula_arpu_df["PERIOD_YEAR_MONTH"] = (vula_arpu_df["YEAR"] * 100 + vula_arpu_df["MONTH"]).astype("int32")
+    vula_arpu_df = vula_arpu_df.drop(columns=["YEAR", "MONTH"])
+
+    return tn_arpu_df.merge(
+        vula_arpu_df,
+        how="left",
+        on=["PERIOD_YEAR_MONTH", "COUNTY_ID", "COUNTY", "MUNICIPAL_ID", "MUNICIPAL", "POSTCODE_ID", "POST_OFFICE"],
+        suffixes=("_tn", "_vula"),
+    ).pipe(fill_numeric)
+
+
+try:
+    tn_vula_arpu_df = tn_vula_arpu_frame(
+        rabatt_run, rabatt_subs_only, tuple(month for month in month_options if month >= first_year_month_plot)
+    )
+except Exception as e:
+    st.error(f"An error occurred while querying BigQuery: {e}")
+    st.stop()
 
 tn_vula_summary = (
     tn_vula_arpu_df.groupby(["PERIOD_YEAR_MONTH"])
@@ -386,31 +407,18 @@ st.title("Geographical TN and VULA ARPU and subs data")
 with st.expander("TN and VULA ARPU and subs data", expanded=False):
     st.dataframe(tn_vula_arpu_df)
 
-county_grp = aggregate_geo(tn_vula_arpu_df, ["COUNTY_ID", "COUNTY", "PERIOD_YEAR_MONTH"])
-county_grp = county_grp.sort_values(by=["COUNTY_ID", "PERIOD_YEAR_MONTH"])
-county_grp["dt"] = pd.to_datetime(county_grp["PERIOD_YEAR_MONTH"].astype(str), format="%Y%m")
-
-municipal_grp = aggregate_geo(
-    tn_vula_arpu_df, ["MUNICIPAL_ID", "MUNICIPAL", "COUNTY_ID", "COUNTY", "PERIOD_YEAR_MONTH"]
-)
-municipal_grp = municipal_grp.sort_values(by=["MUNICIPAL_ID", "PERIOD_YEAR_MONTH"])
-municipal_grp["dt"] = pd.to_datetime(municipal_grp["PERIOD_YEAR_MONTH"].astype(str), format="%Y%m")
-
-postcode_grp = aggregate_geo(
-    tn_vula_arpu_df,
-    ["POSTCODE_ID", "POST_OFFICE", "MUNICIPAL_ID", "MUNICIPAL", "COUNTY_ID", "COUNTY", "PERIOD_YEAR_MONTH"],
-)
-postcode_grp = postcode_grp.sort_values(by=["POSTCODE_ID", "PERIOD_YEAR_MONTH"])
-postcode_grp["dt"] = pd.to_datetime(postcode_grp["PERIOD_YEAR_MONTH"].astype(str), format="%Y%m")
+geo_levels = aggregate_geo(tn_vula_arpu_df, GEO_LEVELS)
+county_grp, municipal_grp, postcode_grp = geo_levels["County"], geo_levels["Municipal"], geo_levels["Postcode"]
+# the county and municipal selectors slice these instead of masking the whole frame
+municipals_by_county = geo_index(municipal_grp, "COUNTY")
+postcodes_by_municipal = geo_index(postcode_grp, "MUNICIPAL")
 
 # CREATE drop down to select between county, municipal and postcode level
 col_a, col_b = st.columns(2)
 with col_a:
     level = st.selectbox("Select level", ["County", "Municipal", "Postcode"], index=0)
-    county_list = list(county_grp["COUNTY"].unique())
-    county_list = sorted(county_list)
-    municipal_list = list(municipal_grp["MUNICIPAL"].unique())
-    municipal_list = sorted(municipal_list)
+    county_list = sorted(municipals_by_county.keys())
+    municipal_list = sorted(postcodes_by_municipal.keys())
     match level:
         case "County":
             filtered_df = county_grp.copy()
@@ -418,15 +426,15 @@ with col_a:
         case "Municipal":
             filtered_county = st.selectbox("Select county", county_list, index=0, key="municipal_county")
             selected_subitem = filtered_county
-            filtered_df = municipal_grp.copy()
-            filtered_df = filtered_df[filtered_df["COUNTY"] == filtered_county]
+            filtered_df = municipals_by_county.rows(filtered_county)
             legend = "MUNICIPAL"
         case "Postcode":
             filtered_municipal = st.selectbox("Select municipal", municipal_list, index=0, key="postcode_municipal")
             selected_subitem = filtered_municipal
-            filtered_df = postcode_grp.copy()
-            filtered_df = filtered_df[filtered_df["MUNICIPAL"] == filtered_municipal]
-            filtered_df["ID_OFFICE"] = filtered_df["POSTCODE_ID"].astype(str) + " - " + filtered_df["POST_OFFICE"]
+            filtered_df = postcodes_by_municipal.rows(filtered_municipal)
+            filtered_df["ID_OFFICE"] = (
+                filtered_df["POSTCODE_ID"].astype(str) + " - " + filtered_df["POST_OFFICE"].astype(str)
+            )
             legend = "ID_OFFICE"
         case _:
             filtered_df = county_grp.copy()
@@ -443,11 +451,6 @@ with col_b:
         options=list(filtered_df["PERIOD_YEAR_MONTH"].sort_values(ascending=False).unique()),
         index=0,
     )
-    first_year_month_plot = st.selectbox(
-        "Select first year/month to plot from",
-        options=list(filtered_df["PERIOD_YEAR_MONTH"].sort_values(ascending=False).unique()),
-        index=24,
-    )
     if first_year_month_plot >= month_year_filter:
         st.warning(
             "First year/month to plot from must be earlier than month/year filter. Resetting to earliest available."
@@ -506,86 +509,61 @@ with tab_summary:
     figs = [make_line_chart(summary_df_grp, p, f"{p} over time", y_percent=percent) for p, percent in chart_list]
     plot_in_columns(figs, cols)
     with st.expander("See data used in plots", expanded=False):
-        st.dataframe(
-            summary_df_grp.style.format(subset=summary_df_grp.columns[1:-1], formatter="{:,.0f}").format(
-                subset=["vula_sub_share"], formatter="{:.1%}"
-            ),
-            use_container_width=True,
+        render_table(
+            summary_df_grp,
+            {**dict.fromkeys(summary_df_grp.columns[1:-1], "thousands"), "vula_sub_share": "percent"},
+            key="tn_vula_summary",
         )
 with tab_geo_type:
     st.header("Geographical ARPU and subscriber trends")
-    col_11, col_12 = st.columns(2)
-    with col_11:
-        fig = px.line(
-            filtered_df,
-            x="dt",
-            y=["arpu_per_abo_tn"],
-            color=legend,
-            markers=True,
-            title=f"ARPU TN - {level} level",
-            labels={"value": "ARPU", "dt": "Date", "variable": "Type"},
-            height=1000,
-        )
-        fig.update_layout(yaxis_title="ARPU", xaxis_title="Date", legend_title=legend)
-        st.plotly_chart(fig, use_container_width=True, height=1000)
-    with col_12:
-        fig2 = px.line(
-            filtered_df,
-            x="dt",
-            y=["arpu_per_abo_vula"],
-            color=legend,
-            markers=True,
-            title=f"ARPU VULA - {level} level",
-            labels={"value": "ARPU", "dt": "Date", "variable": "Type"},
-            height=1000,
-        )
-        fig2.update_layout(yaxis_title="ARPU", xaxis_title="Date", legend_title=legend)
-        st.plotly_chart(fig2, use_container_width=True)
-    with col_11:
-        fig3 = px.line(
-            filtered_df,
-            x="dt",
-            y=["abo_antall_tn"],
-            color=legend,
-            markers=True,
-            title=f"Number of TN subs - {level} level",
-            labels={"value": "Number of subs", "dt": "Date", "variable": "Type"},
-            height=1000,
+    chart_df = filtered_df
+    if filtered_df[legend].nunique() > CHART_MAX_SERIES + 1:
+        # one trace per area gets too heavy for large municipalities, the smallest areas are combined
+        top_n = st.number_input(
+            "Largest areas to show (by subscribers), the others are shown as 'Others'",
+            min_value=1,
+            value=CHART_MAX_SERIES,
+            key="geo_trends_top_n",
         )
-        fig3.update_layout(yaxis_title="Number of TN subs", xaxis_title="Date", legend_title=legend)
-        st.plotly_chart(fig3, use_container_width=True)
-    with col_12:
-        fig4 = px.line(
-            filtered_df,
-            x="dt",
-            y=["abo_antall_vula"],
-            color=legend,
-            markers=True,
-            title=f"Number of VULA subs - {level} level",
-            labels={"value": "Number of subs", "dt": "Date", "variable": "Type"},
-            height=1000,
-        )
-        fig4.update_layout(yaxis_title="Number of VULA subs", xaxis_title="Date", legend_title=legend)
-        st.plotly_chart(fig4, use_container_width=True)
-    # add chart with vula subs share
-    with col_11:
-        fig5 = px.line(
-            filtered_df,
-            x="dt",
-            y=["vula_sub_share"],
-            color=legend,
-            markers=True,
-            title=f"VULA subs share of total subs - {level} level",
-            labels={"value": "VULA subs share", "dt": "Date", "variable": "Type"},
-            height=1000,
-        )
-        fig5.update_layout(yaxis_title="VULA subs share", xaxis_title="Date", legend_title=legend)
-        fig5.update_yaxes(tickformat=".0%")
-        st.plotly_chart(fig5, use_container_width=True)
+        chart_df = top_series(filtered_df, legend, "total_subs", GEO_MEASURES, n=top_n, combine=_add_ratios)
+    trend_charts = [
+        ("arpu_per_abo_tn", f"ARPU TN - {level} level", "ARPU"),
+        ("arpu_per_abo_vula", f"ARPU VULA - {level} level", "ARPU"),
+        ("abo_antall_tn", f"Number of TN subs - {level} level", "Number of TN subs"),
+        ("abo_antall_vula", f"Number of VULA subs - {level} level", "Number of VULA subs"),
+        ("vula_sub_share", f"VULA subs share of total subs - {level} level", "VULA subs share"),
+    ]
+    col_11, col_12 = st.columns(2)
+    for idx, (y_col, title, y_title) in enumerate(trend_charts):
+        fig = area_line_chart(chart_df, y_col, legend, title=title, y_title=y_title, percent=y_col == "vula_sub_share")
+        (col_11, col_12)[idx % 2].plotly_chart(fig, use_container_width=True)
     with st.expander("See data used in plots", expanded=False):
         st.dataframe(filtered_df)
 
 
+# blocks of the Ranked ARPU tab: (value column, number format)
+RANKED_BLOCKS = {
+    "ARPU TN": ("arpu_per_abo_tn", "integer"),
+    "TN subs": ("abo_antall_tn", "thousands"),
+    "VULA subs": ("abo_antall_vula", "thousands"),
+    "VULA share": ("vula_sub_share", "percent"),
+}
+RANKED_HEADERS = {
+    "ARPU TN": "ARPU TN",
+    "TN subs": "Number of TN subs",
+    "VULA subs": "Number of VULA subs",
+    "VULA share": "VULA subs share of total subs",
+}
+
+
+@derived_frame
+def ranked_pivot(grouped_df: pd.DataFrame, index_list: list[str], first_month: int) -> pd.DataFrame:
+    # all blocks in one pivot over shared row and month codes, so they stay aligned when rows are filtered
+    df = grouped_df[grouped_df["PERIOD_YEAR_MONTH"] >= first_month]
+    blocks = {name: value for name, (value, _) in RANKED_BLOCKS.items()}
+    return measure_pivot(df, index_list, blocks, total_row=False)
+
+
 def plot_ranked_arpu_and_subs(grouped_df: pd.DataFrame, level: str) -> None:
     match level:
         case "County":
@@ -594,99 +572,41 @@ def plot_ranked_arpu_and_subs(grouped_df: pd.DataFrame, level: str) -> None:
             index_list = ["MUNICIPAL_ID", "MUNICIPAL", "COUNTY"]
         case "Postcode":
             index_list = ["POSTCODE_ID", "POST_OFFICE", "MUNICIPAL"]
-    filtered_df = grouped_df.copy()
-    filtered_df = filtered_df[filtered_df["PERIOD_YEAR_MONTH"] >= first_year_month_plot]
-    if filtered_df.empty:
+    wide = ranked_pivot(grouped_df, index_list, first_year_month_plot)
+    if wide.empty:
         st.warning("No data available for the selected first year/month to plot from.")
-    filtered_arpu_pivot = filtered_df.pivot_table(
-        index=index_list,
-        columns=["PERIOD_YEAR_MONTH"],
-        values="arpu_per_abo_tn",
-        aggfunc="sum",
-        fill_value=0,
-    ).reset_index()
-    # order pivot based on arpu in selected Period_YEAR_MONTH
-    filtered_arpu_pivot = filtered_arpu_pivot[filtered_arpu_pivot[month_year_filter].between(arpu_min, arpu_max)]
-    filtered_arpu_pivot = filtered_arpu_pivot.sort_values(by=month_year_filter, ascending=True)
-    filter_tn_subs_pivot = filtered_df.pivot_table(
-        index=index_list,
-        columns=["PERIOD_YEAR_MONTH"],
-        values="abo_antall_tn",
-        aggfunc="sum",
-        fill_value=0,
-    ).reset_index()
-    # sort filter_tn_subs_pivot based on index in filtered_arpu_pivot
-    filter_tn_subs_pivot = (
-        filter_tn_subs_pivot.set_index(index_list)
-        .reindex(filtered_arpu_pivot.set_index(index_list).index)
-        .reset_index()
-    )
-    filter_vula_subs_pivot = filtered_df.pivot_table(
-        index=index_list,
-        columns=["PERIOD_YEAR_MONTH"],
-        values="abo_antall_vula",
-        aggfunc="sum",
-        fill_value=0,
-    ).reset_index()
-    filter_vula_subs_pivot = (
-        filter_vula_subs_pivot.set_index(index_list)
-        .reindex(filtered_arpu_pivot.set_index(index_list).index)
-        .reset_index()
-    )
-    filter_vula_sub_share_pivot = filtered_df.pivot_table(
-        index=index_list,
-        columns=["PERIOD_YEAR_MONTH"],
-        values="vula_sub_share",
-        aggfunc="sum",
-        fill_value=0,
-    ).reset_index()
-    filter_vula_sub_share_pivot = (
-        filter_vula_sub_share_pivot.set_index(index_list)
-        .reindex(filtered_arpu_pivot.set_index(index_list).index)
-        .reset_index()
-    )
-
-    height = 35 * (len(filtered_arpu_pivot) + 1)
-    st.header("ARPU TN")
-    st.dataframe(
-        filtered_arpu_pivot.style.format(subset=filtered_arpu_pivot.columns[3:], formatter="{:.0f}"),
-        use_container_width=True,
-        height=height,
-    )
-    st.header("Number of TN subs")
-    st.dataframe(
-        filter_tn_subs_pivot.style.format(subset=filter_tn_subs_pivot.columns[3:], formatter="{:,.0f}"),
-        use_container_width=True,
-        height=height,
-    )
-    st.header("Number of VULA subs")
-    st.dataframe(
-        filter_vula_subs_pivot.style.format(subset=filter_vula_subs_pivot.columns[3:], formatter="{:,.0f}"),
-        use_container_width=True,
-        height=height,
-    )
-    st.header("VULA subs share of total subs")
-    st.dataframe(
-        filter_vula_sub_share_pivot.style.format(subset=filter_vula_sub_share_pivot.columns[3:], formatter="{:.1%}"),
-        use_container_width=True,
-        height=height,
-    )
+        return
+    # rank on ARPU in the selected month, the other blocks follow without realignment
+    ranking = wide[("ARPU TN", month_year_filter)]
+    ranked = wide[ranking.between(arpu_min, arpu_max)].sort_values(("ARPU TN", month_year_filter), kind="stable")
+    tables = {name: ranked[name].reset_index() for name in RANKED_BLOCKS}
+
+    for name, (_, number_format) in RANKED_BLOCKS.items():
+        st.header(RANKED_HEADERS[name])
+        table = tables[name]
+        render_table(
+            table,
+            dict.fromkeys(table.columns[len(index_list) :], number_format),
+            key=f"ranked_{name.lower().replace(' ', '_')}",
+            fit_rows=True,
+        )
+    export_buttons(lambda: tables, f"ranked_arpu_{level.lower()}_{month_year_filter}", key="ranked")
 
 
 with tab_arpu_ranked:
     st.header("ARPU and subscribes (Telenor retail and Vula) - ranked based on selected month/year and ARPU range")
     match level:
         case "County":
-            plot_ranked_arpu_and_subs(county_grp.copy(), level="County")
+            plot_ranked_arpu_and_subs(county_grp, level="County")
         case "Municipal":
-            plot_ranked_arpu_and_subs(municipal_grp.copy(), level="Municipal")
+            plot_ranked_arpu_and_subs(municipal_grp, level="Municipal")
         case "Postcode":
-            plot_ranked_arpu_and_subs(postcode_grp.copy(), level="Postcode")
+            plot_ranked_arpu_and_subs(postcode_grp, level="Postcode")
         case _:
             st.warning("Please select a level to display ranked ARPU.")
 with tab_invoice_line_data:
     st.header("Based on all  'fakturalinjer' for selected month/year")
-    year_month_lst = cached_query(month_year_query())
+    year_month_lst = query_result(month_job, "invoice months")
     today = datetime.today()
     current_year_month = today.year * 100 + today.month
     year_month_lst = year_month_lst[year_month_lst["PERIOD_YEAR_MONTH"] <= current_year_month]
@@ -694,9 +614,12 @@ with tab_invoice_line_data:
     invoice_year_month = st.selectbox(
         "Select invoice year month", options=year_month_lst, index=0, key="invoice_line_year_month"
     )
-    invoice_line_df = cached_query(abo_query(invoice_year_month))
+    if invoice_year_month not in invoice_jobs:
+        invoice_jobs[invoice_year_month] = submit_invoice_jobs(invoice_year_month)
+    with st.spinner("Loading invoice lines..."):
+        invoice_line_df = query_result(invoice_jobs[invoice_year_month]["invoice_lines"], "invoice lines")
     sub_options = list(invoice_line_df["subscription_type"].unique())
-    sub_options_filtered = [x for x in sub_options if x not in ["Grunnpakke TV", "Digital Grunnpakke B2B"]]
+    sub_options_filtered = [x for x in sub_options if x not in HIDDEN_SUBSCRIPTION_TYPES]
     subscriptions_drop_down = st.multiselect(
         "Filter on subscription types",
         options=sub_options,
@@ -704,12 +627,9 @@ with tab_invoice_line_data:
         key="invoice_line_subscription_type",
     )
     invoice_line_df = invoice_line_df[invoice_line_df["subscription_type"].isin(subscriptions_drop_down)]
-    sub_total = 0
-    for i in subscriptions_drop_down:
-        add_subs = invoice_line_df[
-            (invoice_line_df["subscription_type"] == i) & (invoice_line_df["invoice_line_name"] == i)
-        ]["units"].sum()
-        sub_total += add_subs
+    # every invoice line is classified once, the per subscription type sections look up their rows
+    breakdown = subscription_breakdown(invoice_line_df)
+    sub_total = breakdown["total_subs"][breakdown.index.get_level_values("tv_subsc") == "YES&NO"].sum()
     st.write(f"Total subscriptions for selected subscription types: {sub_total:,}")
     invoice_line_grp = (
         invoice_line_df.groupby(["invoice_line_name"]).agg({"units": "sum", "tot_rev_nok_ex_vat": "sum"}).reset_index()
@@ -736,129 +656,85 @@ with tab_invoice_line_data:
     ):
         st.dataframe(invoice_line_df)
 
-    def subsription_presenter(subscription_type: str, _df: pd.DataFrame) -> str:
-        df_tmp = _df[_df["subscription_type"] == subscription_type]
-        plot_df = pd.DataFrame(columns=["Total_revenues_ex_vat", "Total_subscriptions", "NOK_per_sub_ex_vat"])
-        if df_tmp.empty:
+    def subsription_presenter(subscription_type: str, tv: str) -> str:
+        if (subscription_type, tv) not in breakdown.index:
             return "No data"
-        total_subs = df_tmp[df_tmp["invoice_line_name"] == subscription_type]["units"].sum()
-        tv_subs = df_tmp[df_tmp["invoice_line_name"].isin(["Grunnpakke TV"])]["units"].sum()
-        tv_rev = df_tmp[
-            (df_tmp["invoice_line_name"].str.contains("tv", case=False, na=False)) & (df_tmp["tot_rev_nok_ex_vat"] > 0)
-        ]["tot_rev_nok_ex_vat"].sum()
-        net_total = df_tmp["tot_rev_nok_ex_vat"].sum()
-        sum_neg_items = df_tmp[df_tmp["tot_rev_nok_ex_vat"] < 0]["tot_rev_nok_ex_vat"].sum()
-        sum_pos_items = df_tmp[df_tmp["tot_rev_nok_ex_vat"] > 0]["tot_rev_nok_ex_vat"].sum()
-        headline_subscription = df_tmp[df_tmp["invoice_line_name"] == subscription_type]["tot_rev_nok_ex_vat"].sum()
-        bb_tv_rabatt = df_tmp[df_tmp["invoice_line_name"] == "Bredbåndsrabatt med TV"]["tot_rev_nok_ex_vat"].sum()
-        kabeltv_rabatt = df_tmp[df_tmp["invoice_line_name"] == "Rabatt Kabel-TV"]["tot_rev_nok_ex_vat"].sum()
-        rabatt_lines = df_tmp[df_tmp["invoice_line_name"].str.contains("rabatt", case=False, na=False)][
-            "tot_rev_nok_ex_vat"
-        ].sum()
-        rabatt_ex_tv = rabatt_lines - bb_tv_rabatt - kabeltv_rabatt
-        neg_rabatt_adjusted = sum_neg_items - rabatt_lines
-        pos_headline_adjusted = sum_pos_items - headline_subscription - tv_rev
-
-        plot_df.loc["Total net revenues", "Total_revenues_ex_vat"] = net_total
-        plot_df.loc["Headline price", "Total_revenues_ex_vat"] = headline_subscription
-        plot_df.loc["TV revenues", "Total_revenues_ex_vat"] = tv_rev
-        plot_df.loc["Other revenues", "Total_revenues_ex_vat"] = pos_headline_adjusted
-        plot_df.loc["Rabatt-GrunnpakkeTV", "Total_revenues_ex_vat"] = bb_tv_rabatt
-        plot_df.loc["Rabatt-KabelTV", "Total_revenues_ex_vat"] = kabeltv_rabatt
-        plot_df.loc["Andre Rabatter", "Total_revenues_ex_vat"] = rabatt_ex_tv
-        plot_df.loc["Other negative items", "Total_revenues_ex_vat"] = neg_rabatt_adjusted
-        plot_df.loc[:, "Total_subscriptions"] = total_subs
-        plot_df.loc[:, "NOK_per_sub_ex_vat"] = plot_df["Total_revenues_ex_vat"] / total_subs
+        total_subs = breakdown.loc[(subscription_type, tv), "total_subs"]
+        tv_subs = breakdown.loc[(subscription_type, tv), "tv_subs"]
         st.subheader(f"{subscription_type}")
         # thousand separator for total_subs and tv_subs
 
         st.write(
             f"Total subscriptions: {total_subs:,}. TV subs: {tv_subs:,}. TV share of total subs: {tv_subs / total_subs:.1%}"
         )
-        st.dataframe(plot_df.style.format(subset=plot_df.columns, formatter="{:,.0f}"), use_container_width=True)
+        render_table(
+            breakdown_table(breakdown.loc[(subscription_type, tv)]), key=f"subscription_{subscription_type}_{tv}"
+        )
         return subscription_type
 
     with st.expander("Subscription type details", expanded=False):
         col_1, col_2, col_3 = st.columns(3)
+        tv_columns = {
+            "YES": (col_1, "Subscriptions with TV."),
+            "NO": (col_2, "Subscriptions without TV."),
+            "YES&NO": (col_3, "With and without TV."),
+        }
         for i in subscriptions_drop_down:
-            if i == "Grunnpakke TV":
-                pass
-            else:
-                for tv in ["YES", "NO", "YES&NO"]:
-                    if tv == "YES&NO":
-                        with col_3:
-                            with st.expander("With and without TV.", expanded=True):
-                                df_tv_filter = invoice_line_df.copy()
-                                subsription_presenter(i, df_tv_filter)
-                    else:
-                        if tv == "YES":
-                            with col_1:
-                                with st.expander("Subscriptions with TV.", expanded=True):
-                                    df_tv_filter = invoice_line_df[invoice_line_df["tv_subsc"] == tv]
-                                    subsription_presenter(i, df_tv_filter)
-                        else:
-                            with col_2:
-                                with st.expander("Subscriptions without TV.", expanded=True):
-                                    df_tv_filter = invoice_line_df[invoice_line_df["tv_subsc"] == tv]
-                                    subsription_presenter(i, df_tv_filter)
+            if i == TV_PACKAGE:
+                continue
+            for tv, (column, title) in tv_columns.items():
+                with column:
+                    with st.expander(title, expanded=True):
+                        subsription_presenter(i, tv)
 
     # adjust height so that all rows are visible
 
     with st.expander("Invoice line data summary accross all subscription types", expanded=False):
-        st.dataframe(
-            invoice_line_grp.reset_index(drop=True).style.format(
-                subset=invoice_line_grp.columns[1:], formatter="{:,.0f}"
-            ),
-            use_container_width=True,
-            height=35 + 35 * len(invoice_line_grp),
+        render_table(
+            invoice_line_grp.reset_index(drop=True),
+            dict.fromkeys(invoice_line_grp.columns[1:], "thousands"),
+            key="invoice_line_summary",
+            fit_rows=True,
         )
 
     with st.expander("Time development", expanded=False):
         # create line charts for development over time (for every month and year since 2022) for count of Grunnpakke TV subscriptions and total subscriptions
         # line chart for total subscriptions over time
         st.header("Development of total subscriptions and Grunnpakke TV subscriptions over time")
-        total_subs_list = []
-        tv_subs_list = []
-        tilknytninger_list = []
-        tilknytning_rev_list = []
-        for yr in range(2022, int(pd.Timestamp.now().strftime("%Y")) + 1):
-            for m in range(1, 13):
-                ym = yr * 100 + m
-                if ym > int(pd.Timestamp.now().strftime("%Y%m")):
-                    continue
-                invoice_line_df_tmp = cached_query(abo_query(ym))
-                if invoice_line_df_tmp.empty:
-                    continue
-                else:
-                    invoice_line_df_tmp = invoice_line_df_tmp[
-                        invoice_line_df_tmp["subscription_type"].isin(subscriptions_drop_down)
-                    ]
-                    total_subs = invoice_line_df_tmp[
-                        invoice_line_df_tmp["invoice_line_name"].isin(subscriptions_drop_down)
-                    ]["units"].sum()
-                    tv_subs = invoice_line_df_tmp[
-                        (invoice_line_df_tmp["invoice_line_name"] == "Grunnpakke TV")
-                        | (invoice_line_df_tmp["invoice_line_name"].str.contains("T-We & Streaming", na=False))
-                    ]["units"].sum()
-                    tilknytninger = invoice_line_df_tmp[
-                        (invoice_line_df_tmp["invoice_line_name"].str.contains("tilknytning", case=False, na=False))
-                        & (invoice_line_df_tmp["tot_rev_nok_ex_vat"] > 0)
-                    ]["units"].sum()
-                    tilknytning_rev = invoice_line_df_tmp[
-                        (invoice_line_df_tmp["invoice_line_name"].str.contains("tilknytning", case=False, na=False))
-                        & (invoice_line_df_tmp["tot_rev_nok_ex_vat"] > 0)
-                    ]["tot_rev_nok_ex_vat"].sum()
-                    total_subs_list.append({"PERIOD_YEAR_MONTH": ym, "total_subs": total_subs})
-                    tv_subs_list.append({"PERIOD_YEAR_MONTH": ym, "tv_subs": tv_subs})
-                    tilknytninger_list.append({"PERIOD_YEAR_MONTH": ym, "tilknytninger": tilknytninger})
-                    tilknytning_rev_list.append({"PERIOD_YEAR_MONTH": ym, "tilknytning_rev": tilknytning_rev})
-
-        total_subs_df = pd.DataFrame(total_subs_list)
-        tv_subs_df = pd.DataFrame(tv_subs_list)
+        current_ym = int(pd.Timestamp.now().strftime("%Y%m"))
+        month_list = [
+            yr * 100 + m
+            for yr in range(2022, int(pd.Timestamp.now().strftime("%Y")) + 1)
+            for m in range(1, 13)
+            if yr * 100 + m <= current_ym
+        ]
+        # monthly aggregates are materialized incrementally, only months not stored yet are queried
+        invoice_line_summary = load_invoice_line_summary(month_list)
+        months_with_data = invoice_line_summary["PERIOD_YEAR_MONTH"].unique()
+        invoice_line_summary = invoice_line_summary[
+            invoice_line_summary["subscription_type"].isin(subscriptions_drop_down)
+        ]
+        invoice_line_summary = invoice_line_summary.assign(
+            total_subs=invoice_line_summary["subscription_units"].where(
+                invoice_line_summary["subscription_line"].isin(subscriptions_drop_down), 0
+            )
+        )
+        monthly_summary = (
+            invoice_line_summary.groupby("PERIOD_YEAR_MONTH")[
+                ["total_subs", "tv_subs", "tilknytninger", "tilknytning_rev"]
+            ]
+            .sum()
+            .reindex(months_with_data, fill_value=0)
+            .rename_axis("PERIOD_YEAR_MONTH")
+            .reset_index()
+        )
+
+        total_subs_df = monthly_summary[["PERIOD_YEAR_MONTH", "total_subs"]].copy()
+        tv_subs_df = monthly_summary[["PERIOD_YEAR_MONTH", "tv_subs"]].copy()
         tv_share_df = total_subs_df.merge(tv_subs_df, how="left", on=["PERIOD_YEAR_MONTH"]).fillna(0)
         tv_share_df["tv_subs_share"] = tv_share_df["tv_subs"] / tv_share_df["total_subs"]
-        tilknytninger_df = pd.DataFrame(tilknytninger_list)
-        tilknytning_rev_df = pd.DataFrame(tilknytning_rev_list)
+        tilknytninger_df = monthly_summary[["PERIOD_YEAR_MONTH", "tilknytninger"]].copy()
+        tilknytning_rev_df = monthly_summary[["PERIOD_YEAR_MONTH", "tilknytning_rev"]].copy()
         # create datetime column from PERIOD_YEAR_MONTH
         tv_share_df["dt"] = pd.to_datetime(tv_share_df["PERIOD_YEAR_MONTH"].astype(str), format="%Y%m")
         total_subs_df["dt"] = pd.to_datetime(total_subs_df["PERIOD_YEAR_MONTH"].astype(str), format="%Y%m")
@@ -935,8 +811,12 @@ with tab_invoice_line_data:
             st.plotly_chart(fig_rev_per_tilknytning, use_container_width=True)
 with tab_new_invoice_data_sql:
     st.header("SQL query for invoice line data")
-    invoice_line_postcode_df = cached_query(invoice_postcode_query(invoice_year_month))
-    st.dataframe(
-        invoice_line_postcode_df.style.format(subset=invoice_line_postcode_df.columns[7:], formatter="{:,.0f}"),
-        use_container_width=True,
+    with st.spinner("Loading invoice data per postcode..."):
+        invoice_line_postcode_df = query_result(
+            invoice_jobs[invoice_year_month]["invoice_postcode"], "invoice data per postcode"
+        )
+    render_table(
+        invoice_line_postcode_df,
+        dict.fromkeys(invoice_line_postcode_df.columns[7:], "thousands"),
+        key="invoice_postcode",
     )
@@ -1,4 +1,5 @@
 import datetime as dt
+from concurrent.futures import Future
 
 import pandas as pd
 import plotly.express as px
@@ -6,9 +7,11 @@ import plotly.graph_objects as go
 import streamlit as st
 from sads_api_schemas.enums import FinanceKPIs, Periodicity, QueryMetric
 from sads_api_schemas.request.input_classes import SpectrumRequest
-from sadsapi.financial import get_company_info
-from sadsapi.gsmai import get_datasets, get_gsmai_data
-from sadsapi.spectrum.confidential import make_spectrum_api_call
+
+from common.data_queries import iter_completed, query_result, submit_query
+from common.export import export_buttons
+from common.sadsapi_queries import get_company_info, get_datasets, get_gsmai_data, make_spectrum_api_call
+from common.tables import render_table
 
 comp_info = get_company_info()
 telenor_ops = comp_info[(comp_info["group_id"] == 1) & (comp_info["network_id"] > 1)]
@@ -91,14 +94,16 @@ item_list = [
 ]
 
 
-def spend_annual_fee_creator(metric, financial_measure, start_year, end_year, key):
-    operator_list = tn_op_lst
+def submit_spend_requests(
+    metric: QueryMetric, financial_measure: FinanceKPIs, start_year: int, end_year: int
+) -> dict[str, Future[pd.DataFrame]]:
+    # committed and forecast figures are separate API calls, both are started right away
     periodicity = Periodicity.Annual
 
     detailed_outputs = True
     extrapolation_fx_calc_date = None
 
-    emp_lst = []
+    jobs: dict[str, Future[pd.DataFrame]] = {}
     for c in ["committed", "forecast"]:
         if c == "committed":
             include_forecast = False
@@ -108,7 +113,7 @@ def spend_annual_fee_creator(metric, financial_measure, start_year, end_year, ke
             include_historic = False
 
         req = SpectrumRequest(
-            operators=operator_list,
+            operators=tn_op_lst,
             metric_query=metric,
             periodicity_query=periodicity,
             financial_metric=financial_measure,
@@ -119,10 +124,31 @@ def spend_annual_fee_creator(metric, financial_measure, start_year, end_year, ke
             end_year=end_year,
             extrapolation_fx_calc_date=extrapolation_fx_calc_date,
         )
+        jobs[c] = submit_query(make_spectrum_api_call, req)
+    return jobs
+
+
+def spend_annual_fee_creator(
+    jobs: dict[str, Future[pd.DataFrame]],
+    metric: QueryMetric,
+    financial_measure: FinanceKPIs,
+    start_year: int,
+    end_year: int,
+    key: str,
+) -> pd.DataFrame:
+    operator_list = tn_op_lst
 
-        spend_forecast_df_tmp = make_spectrum_api_call(req)
+    emp_lst = []
+    for c, job in jobs.items():
+        with st.spinner(f"Loading {c} figures..."):
+            spend_forecast_df_tmp = query_result(job, f"{c} figures")
+        if spend_forecast_df_tmp.empty:
+            continue
         spend_forecast_df_tmp["status"] = c
         emp_lst.append(spend_forecast_df_tmp)
+    if not emp_lst:
+        st.info(f"No spectrum data for the period {start_year}-{end_year}.")
+        return pd.DataFrame()
 
     spend_forecast_df = pd.concat(emp_lst)
 
@@ -152,23 +178,19 @@ def spend_annual_fee_creator(metric, financial_measure, start_year, end_year, ke
     totals.name = ("Total", "", "", "", "", "", "", "", "")
     spend_forecast_table = pd.concat([spend_forecast_table, totals.to_frame().T])
 
-    row_cnt = len(spend_forecast_table)
-
     with st.expander("Spectrum spend forecast", expanded=False):
         st.subheader(
             f"Total {financial_measure.name.replace('_', ' ')} (million) in {metric.name[-3:]} for the period \
                 {start_year}-{end_year}"
         )
-        st.dataframe(spend_forecast_table.style.format("{:,.1f}"), height=35 * row_cnt + 38, use_container_width=True)
+        render_table(spend_forecast_table, "thousands_1", key=f"{key}_forecast", fit_rows=True)
     with st.expander("Summary per country", expanded=False):
         st.subheader(
             f"Summary per country: Total {financial_measure.name.replace('_', ' ')} (million) in {metric.name[-3:]} \
                 for the period {start_year}-{end_year}"
         )
         summary_spend_df = spend_forecast_table.groupby(["country_name"]).sum()
-        st.dataframe(
-            summary_spend_df.style.format("{:,.0f}"), height=35 * len(summary_spend_df) + 38, use_container_width=True
-        )
+        render_table(summary_spend_df, key=f"{key}_per_country", fit_rows=True)
     with st.expander("Summary per operator", expanded=False):
         st.subheader(
             f"Summary per operator: Total {financial_measure.name.replace('_', ' ')} (million) in {metric.name[-3:]} \
@@ -187,13 +209,11 @@ def spend_annual_fee_creator(metric, financial_measure, start_year, end_year, ke
             if df_oper_plot.empty:
                 st.markdown("<span style='color:red'> No data </span>", unsafe_allow_html=True)
                 continue
-            st.dataframe(
-                df_oper_plot.style.format("{:,.0f}"),
-                height=35 * len(df_oper_plot) + 38,
-                use_container_width=True,
-            )
+            render_table(df_oper_plot, key=f"{key}_per_operator_{c}", fit_rows=True)
 
-    per_mhz_table = spend_forecast_table.copy()
+    # amount per MHz, the MHz of each row is the last index level (empty for the Total row)
+    bandwidth = pd.to_numeric(spend_forecast_table.index.get_level_values(8), errors="coerce")
+    per_mhz_table = spend_forecast_table.mul(1000000).div(bandwidth, axis=0)
 
     with st.expander("Per MHz amount", expanded=False):
         st.subheader(
@@ -202,12 +222,18 @@ def spend_annual_fee_creator(metric, financial_measure, start_year, end_year, ke
             -{end_year}"
         )
 
-        for i in range(len(spend_forecast_table)):
-            per_mhz_table.to_numpy()[i] = (
-                1000000 * spend_forecast_table.to_numpy()[i] / spend_forecast_table.index.get_level_values(8)[i]
-            )
-
-        st.dataframe(per_mhz_table.style.format("{:,.0f}"), height=35 * row_cnt + 38, use_container_width=True)
+        render_table(per_mhz_table, key=f"{key}_per_mhz", fit_rows=True)
+
+    export_buttons(
+        lambda: {
+            "Spend forecast": spend_forecast_table,
+            "Per country": summary_spend_df,
+            "Per operator": summary_op_spend_df,
+            "Per MHz": per_mhz_table,
+        },
+        f"spectrum_{key}_{metric.name[-3:]}_{start_year}_{end_year}",
+        key=f"{key}_export",
+    )
 
     summary_band_spend_df = (
         spend_forecast_df.groupby(["country_name", "name", "operator_id", "reporting_currency_id", "band", "year"])
@@ -248,18 +274,19 @@ def spend_annual_fee_creator(metric, financial_measure, start_year, end_year, ke
     return spend_forecast_table
 
 
-def start_expiry_table_creator(
-    operator_list,
-    metric,
-    periodicity,
-    include_forecast,
-    include_historic,
-    detailed_outputs,
-    financial_measure,
-    start_year,
-    end_year,
-    extrapolation_fx_calc_date,
-):
+def submit_start_expiry_request(
+    *,
+    operator_list: list[int],
+    metric: QueryMetric,
+    periodicity: Periodicity,
+    include_forecast: bool,
+    include_historic: bool,
+    detailed_outputs: bool,
+    financial_measure: FinanceKPIs,
+    start_year: int,
+    end_year: int,
+    extrapolation_fx_calc_date: dt.date | None,
+) -> Future[pd.DataFrame]:
     req = SpectrumRequest(
         operators=operator_list,
         metric_query=metric,
@@ -272,124 +299,42 @@ def start_expiry_table_creator(
         end_year=end_year,
         extrapolation_fx_calc_date=extrapolation_fx_calc_date,
     )
-    start_expiry_df = make_spectrum_api_call(req)
-    return start_expiry_df
-
-
-tab_GSAM_data, tab_spectrum_data, tab_fiber = st.tabs(["GSMAI", "Spectrum", "fiber"])
-
-with tab_GSAM_data:
-    tab_gsmai, tab_gsmai_selected = st.tabs(["GSMAI data", "GSMAI selected"])
-
-    st.write("c")
-    st.dataframe(get_datasets(lcu=False))
-    with tab_gsmai:
-        df_sets = get_datasets(lcu=False)
-        st.dataframe(df_sets)
-        index_default = df_sets["dataset_name"][df_sets["dataset_name"] == "Total revenue; cellular"].index[0].item()
-
-        empty = []
-        for i in item_list:
-            data_set_id_selected = df_sets[df_sets["dataset_name"] == i]["dataset_id"].item()
-
-            df_set_usd = get_gsmai_data(
-                country=list(country_dict.keys()),
-                lcu=False,
-                dataset_id=data_set_id_selected,
-                start_year=2008,
-                end_year=2050,
-                periodicity=Periodicity.Quarterly,
-            )
-            df_set_usd["item"] = i
-            df_set_usd["country_name"] = df_set_usd["country_code"].map(country_dict)
-
-            df_set_lcu = get_gsmai_data(
-                country=list(country_dict.keys()),
-                lcu=True,
-                dataset_id=data_set_id_selected,
-                start_year=2008,
-                end_year=2050,
-                periodicity=Periodicity.Quarterly,
-            )
-
-            df_set = df_set_usd.merge(
-                df_set_lcu[["country_code", "year", "quarter", "value"]],
-                on=["country_code", "year", "quarter"],
-                suffixes=("_usd", "_lcu"),
-            )
-            df_set = df_set.sort_values(by=["country_code", "year", "quarter"])
-            df_set["exc_rate"] = df_set["value_lcu"] / df_set["value_usd"]
-            df_set["year_quarter"] = df_set["year"].astype(str) + "Q" + df_set["quarter"].astype(str)
-
-            st.dataframe(df_set)
-            df_set_pivot = df_set.pivot_table(
-                index=["item", "country_code", "country_name"], columns="year_quarter", values="value_usd"
-            )
-            # df_set_pivot = df_set.pivot_table(
-            #     index=["item", "country_code", "country_name"], columns="year_quarter", values="value_lcu"
-            # )
+    return submit_query(make_spectrum_api_call, req)
 
-            empty.append(df_set_pivot)
 
-        df_gsmai_data = pd.concat(empty)
-        st.dataframe(df_gsmai_data)
+def gsmai_item_frame(item: str, dataset_id: int) -> pd.DataFrame:
+    df_set_usd = get_gsmai_data(
+        country=list(country_dict.keys()),
+        lcu=False,
+        dataset_id=dataset_id,
+        start_year=2008,
+        end_year=2050,
+        periodicity=Periodicity.Quarterly,
+    )
+    df_set_usd["item"] = item
+    df_set_usd["country_name"] = df_set_usd["country_code"].map(country_dict)
+
+    df_set_lcu = get_gsmai_data(
+        country=list(country_dict.keys()),
+        lcu=True,
+        dataset_id=dataset_id,
+        start_year=2008,
+        end_year=2050,
+        periodicity=Periodicity.Quarterly,
+    )
 
-    with tab_gsmai_selected:
-        data_set_name_selected = st.multiselect(
-            "Select a dataset",
-            df_sets["dataset_name"],
-            default=["2G connections", "3G connections", "4G connections", "5G connections"],
-        )
-        data_set_name_selected = (
-            list(data_set_name_selected) if len(data_set_name_selected) == 1 else data_set_name_selected
-        )
-        country_id_list_selected = st.multiselect(
-            "Select countries", list(country_dict.keys()), default=["NO", "SE", "DK", "FI", "PK", "BD"]
-        )
-        lcu_selcted = st.checkbox("Select LCU", value=False)
-        data_set_id_selected = list(df_sets[df_sets["dataset_name"].isin(data_set_name_selected)]["dataset_id"])
+    df_set = df_set_usd.merge(
+        df_set_lcu[["country_code", "year", "quarter", "value"]],
+        on=["country_code", "year", "quarter"],
+        suffixes=("_usd", "_lcu"),
+    )
+    df_set = df_set.sort_values(by=["country_code", "year", "quarter"])
+    df_set["exc_rate"] = df_set["value_lcu"] / df_set["value_usd"]
+    df_set["year_quarter"] = df_set["year"].astype(str) + "Q" + df_set["quarter"].astype(str)
+    return df_set
 
-        emp_lst = []
-        for i in data_set_id_selected:
-            item_name = df_sets[df_sets["dataset_id"] == i]["dataset_name"].item()
-            df_set_aux = get_gsmai_data(
-                country=list(country_dict.keys()),
-                lcu=lcu_selcted,
-                by_operator=True,
-                dataset_id=i,
-                start_year=2008,
-                end_year=2050,
-                periodicity=Periodicity.Quarterly,
-            )
-            df_set_aux["item"] = item_name
-            emp_lst.append(df_set_aux)
-        df_set = pd.concat(emp_lst)
-        df_set["year_quarter"] = df_set["year"].astype(str) + "Q" + df_set["quarter"].astype(str)
-        st.subheader(f"{data_set_name_selected} - {'LCU' if not lcu_selcted else 'USD'} - {country_id_list_selected}")
-        df_filter = df_set[df_set["country_code"].isin(country_id_list_selected)].sort_values(
-            by=[
-                "country_code",
-                "item",
-                "year",
-                "quarter",
-                "operator_id",
-            ]
-        )
-        st.dataframe(df_filter, use_container_width=True)
-        st.dataframe(
-            df_filter.pivot_table(
-                index=[
-                    "item",
-                    "country_code",
-                    "operator_id",
-                    "name",
-                ],
-                columns="year_quarter",
-                values="value",
-            ),
-            use_container_width=True,
-        )
 
+tab_GSAM_data, tab_spectrum_data, tab_fiber = st.tabs(["GSMAI", "Spectrum", "fiber"])
 
 with tab_spectrum_data:
     tn_op_lst = st.selectbox(
@@ -412,8 +357,6 @@ with tab_spectrum_data:
             format_func=lambda x: x.name[-3:],
             key="metric_spend",
         )
-
-        spend_annual_fee_creator(metric_spend, FinanceKPIs.SPECTRUM_PAYMENT, start_year, end_year, key="spend")
     with tab_annual_fee:
         metric_annual_fee = st.selectbox(
             "Select metric",
@@ -422,9 +365,6 @@ with tab_spectrum_data:
             format_func=lambda x: x.name[-3:],
             key="metric_annual_fee",
         )
-        spend_annual_fee_creator(
-            metric_annual_fee, FinanceKPIs.SPECTRUM_ANNUAL_FEE, start_year, end_year, key="annual_fee"
-        )
     with tab_capex:
         metric_capex = st.selectbox(
             "Select metric",
@@ -433,7 +373,6 @@ with tab_spectrum_data:
             format_func=lambda x: x.name[-3:],
             key="metric_capex",
         )
-        spend_annual_fee_creator(metric_capex, FinanceKPIs.SPECTRUM_CAPEX, start_year, end_year, key="capex")
     with tab_commitment:
         metric_commit = st.selectbox(
             "Select metric",
@@ -442,7 +381,6 @@ with tab_spectrum_data:
             format_func=lambda x: x.name[-3:],
             key="metric_commit",
         )
-        spend_annual_fee_creator(metric_commit, FinanceKPIs.SPECTRUM_COMMITMENT, start_year, end_year, key="commitment")
     with tab_ir_web:
         metric_IR_report = st.selectbox(
             "Select metric",
@@ -451,52 +389,209 @@ with tab_spectrum_data:
             format_func=lambda x: x.name[-3:],
             key="metric_IR_report",
         )
+
+    # all spectrum requests are started before anything is rendered, so they run while the GSMAI tab loads
+    spectrum_jobs = {
+        "spend": submit_spend_requests(metric_spend, FinanceKPIs.SPECTRUM_PAYMENT, start_year, end_year),
+        "annual_fee": submit_spend_requests(metric_annual_fee, FinanceKPIs.SPECTRUM_ANNUAL_FEE, start_year, end_year),
+        "capex": submit_spend_requests(metric_capex, FinanceKPIs.SPECTRUM_CAPEX, start_year, end_year),
+        "commitment": submit_spend_requests(metric_commit, FinanceKPIs.SPECTRUM_COMMITMENT, start_year, end_year),
+        "ir_report": submit_spend_requests(metric_IR_report, FinanceKPIs.SPECTRUM_COMMITMENT, 2008, 2050),
+    }
+    start_expiry_job = submit_start_expiry_request(
+        operator_list=tn_op_lst,
+        metric=QueryMetric.VAL_LCU,
+        periodicity=Periodicity.Annual,
+        include_forecast=True,
+        include_historic=True,
+        detailed_outputs=True,
+        financial_measure=FinanceKPIs.SPECTRUM_ANNUAL_FEE,
+        start_year=start_year,
+        end_year=end_year,
+        extrapolation_fx_calc_date=None,
+    )
+
+with tab_GSAM_data:
+    tab_gsmai, tab_gsmai_selected = st.tabs(["GSMAI data", "GSMAI selected"])
+
+    df_sets = get_datasets(lcu=False)
+    st.write("c")
+    st.dataframe(df_sets)
+    gsmai_item_jobs = {
+        i: submit_query(gsmai_item_frame, i, df_sets[df_sets["dataset_name"] == i]["dataset_id"].item())
+        for i in item_list
+    }
+    with tab_gsmai_selected:
+        data_set_name_selected = st.multiselect(
+            "Select a dataset",
+            df_sets["dataset_name"],
+            default=["2G connections", "3G connections", "4G connections", "5G connections"],
+        )
+        data_set_name_selected = (
+            list(data_set_name_selected) if len(data_set_name_selected) == 1 else data_set_name_selected
+        )
+        country_id_list_selected = st.multiselect(
+            "Select countries", list(country_dict.keys()), default=["NO", "SE", "DK", "FI", "PK", "BD"]
+        )
+        lcu_selcted = st.checkbox("Select LCU", value=False)
+        data_set_id_selected = list(df_sets[df_sets["dataset_name"].isin(data_set_name_selected)]["dataset_id"])
+        selected_jobs = {
+            i: submit_query(
+                get_gsmai_data,
+                country=list(country_dict.keys()),
+                lcu=lcu_selcted,
+                by_operator=True,
+                dataset_id=i,
+                start_year=2008,
+                end_year=2050,
+                periodicity=Periodicity.Quarterly,
+            )
+            for i in data_set_id_selected
+        }
+
+    with tab_gsmai:
+        st.dataframe(df_sets)
+        index_default = df_sets["dataset_name"][df_sets["dataset_name"] == "Total revenue; cellular"].index[0].item()
+
+        # the items are fetched concurrently and each one is shown as soon as it lands
+        item_slots = {i: st.empty() for i in item_list}
+        for i, slot in item_slots.items():
+            slot.info(f"Loading {i}...")
+
+        empty = {}
+        for i, df_set in iter_completed(gsmai_item_jobs):
+            if df_set.empty:
+                item_slots[i].warning(f"No data for {i}")
+                continue
+            item_slots[i].dataframe(df_set)
+            df_set_pivot = df_set.pivot_table(
+                index=["item", "country_code", "country_name"], columns="year_quarter", values="value_usd"
+            )
+            # df_set_pivot = df_set.pivot_table(
+            #     index=["item", "country_code", "country_name"], columns="year_quarter", values="value_lcu"
+            # )
+
+            empty[i] = df_set_pivot
+
+        if empty:
+            df_gsmai_data = pd.concat([empty[i] for i in item_list if i in empty])
+            st.dataframe(df_gsmai_data)
+        else:
+            st.info("No GSMAI data for the selected items.")
+
+    with tab_gsmai_selected:
+        emp_lst = []
+        for i, job in selected_jobs.items():
+            item_name = df_sets[df_sets["dataset_id"] == i]["dataset_name"].item()
+            with st.spinner(f"Loading {item_name}..."):
+                df_set_aux = query_result(job, item_name)
+            if df_set_aux.empty:
+                continue
+            df_set_aux["item"] = item_name
+            emp_lst.append(df_set_aux)
+        if not emp_lst:
+            st.info("No data for the selected datasets.")
+        else:
+            df_set = pd.concat(emp_lst)
+            df_set["year_quarter"] = df_set["year"].astype(str) + "Q" + df_set["quarter"].astype(str)
+            st.subheader(
+                f"{data_set_name_selected} - {'LCU' if not lcu_selcted else 'USD'} - {country_id_list_selected}"
+            )
+            df_filter = df_set[df_set["country_code"].isin(country_id_list_selected)].sort_values(
+                by=[
+                    "country_code",
+                    "item",
+                    "year",
+                    "quarter",
+                    "operator_id",
+                ]
+            )
+            st.dataframe(df_filter, use_container_width=True)
+            st.dataframe(
+                df_filter.pivot_table(
+                    index=[
+                        "item",
+                        "country_code",
+                        "operator_id",
+                        "name",
+                    ],
+                    columns="year_quarter",
+                    values="value",
+                ),
+                use_container_width=True,
+            )
+
+
+with tab_spectrum_data:
+    with tab_spend:
+        spend_annual_fee_creator(
+            spectrum_jobs["spend"], metric_spend, FinanceKPIs.SPECTRUM_PAYMENT, start_year, end_year, key="spend"
+        )
+    with tab_annual_fee:
+        spend_annual_fee_creator(
+            spectrum_jobs["annual_fee"],
+            metric_annual_fee,
+            FinanceKPIs.SPECTRUM_ANNUAL_FEE,
+            start_year,
+            end_year,
+            key="annual_fee",
+        )
+    with tab_capex:
+        spend_annual_fee_creator(
+            spectrum_jobs["capex"], metric_capex, FinanceKPIs.SPECTRUM_CAPEX, start_year, end_year, key="capex"
+        )
+    with tab_commitment:
+        spend_annual_fee_creator(
+            spectrum_jobs["commitment"],
+            metric_commit,
+            FinanceKPIs.SPECTRUM_COMMITMENT,
+            start_year,
+            end_year,
+            key="commitment",
+        )
+    with tab_ir_web:
         df_ir_report = spend_annual_fee_creator(
-            metric_IR_report, FinanceKPIs.SPECTRUM_COMMITMENT, 2008, 2050, key="ir_report"
-        ).reset_index()
-        df_ir_report = df_ir_report[df_ir_report["status"] == "committed"][
-            [
-                "country_name",
-                "name",
-                "reporting_currency_id",
-                "status",
-                "start_date",
-                "stop_date",
-                "band",
-                "bandwidth",
-                "Total",
-            ]
-        ].sort_values(by=["country_name", "name", "band", "stop_date", "start_date"])
-        df_ir_report["Total"] = df_ir_report["Total"].round(0)
-        df_ir_report[["start_date", "stop_date"]] = df_ir_report[["start_date", "stop_date"]].astype(int)
-        df_ir_report = df_ir_report.set_index(
-            [
-                "country_name",
-                "name",
-                "reporting_currency_id",
-                "status",
-                "start_date",
-                "stop_date",
-                "band",
-                "bandwidth",
-            ]
+            spectrum_jobs["ir_report"], metric_IR_report, FinanceKPIs.SPECTRUM_COMMITMENT, 2008, 2050, key="ir_report"
         )
+        if not df_ir_report.empty:
+            df_ir_report = df_ir_report.reset_index()
+            df_ir_report = df_ir_report[df_ir_report["status"] == "committed"][
+                [
+                    "country_name",
+                    "name",
+                    "reporting_currency_id",
+                    "status",
+                    "start_date",
+                    "stop_date",
+                    "band",
+                    "bandwidth",
+                    "Total",
+                ]
+            ].sort_values(by=["country_name", "name", "band", "stop_date", "start_date"])
+            df_ir_report["Total"] = df_ir_report["Total"].round(0)
+            df_ir_report[["start_date", "stop_date"]] = df_ir_report[["start_date", "stop_date"]].astype(int)
+            df_ir_report = df_ir_report.set_index(
+                [
+                    "country_name",
+                    "name",
+                    "reporting_currency_id",
+                    "status",
+                    "start_date",
+                    "stop_date",
+                    "band",
+                    "bandwidth",
+                ]
+            )
 
-        st.write("Investor relations web report")
-        st.dataframe(df_ir_report.style.format("{:,.0f}"), use_container_width=True, height=35 * len(df_ir_report) + 38)
+            st.write("Investor relations web report")
+            render_table(df_ir_report, key="ir_report", fit_rows=True)
     with tab_start_expiries:
-        start_exp_df = start_expiry_table_creator(
-            operator_list=tn_op_lst,
-            metric=QueryMetric.VAL_LCU,
-            periodicity=Periodicity.Annual,
-            include_forecast=True,
-            include_historic=True,
-            detailed_outputs=True,
-            financial_measure=FinanceKPIs.SPECTRUM_ANNUAL_FEE,
-            start_year=start_year,
-            end_year=end_year,
-            extrapolation_fx_calc_date=None,
-        )
+        with st.spinner("Loading start and expiry dates..."):
+            start_exp_df = query_result(start_expiry_job, "start and expiry dates")
+        if start_exp_df.empty:
+            st.info("No start and expiry dates for the selected operators.")
+            # last section of the page
+            st.stop()
         start_exp_df["start_date"] = start_exp_df["start_date"].dt.date
         start_exp_df["stop_date"] = start_exp_df["stop_date"].dt.date
 
@@ -1,7 +1,7 @@
 import streamlit as st
-from sadsapi.financial import get_company_info
 
 from common.data_queries import example_bigquery_function, example_sql_function
+from common.sadsapi_queries import get_company_info
 
 st.subheader("This is page 1")
 st.info("We perform some sample queries to show that the connectivity works.")
@@ -1,4 +0,0 @@
-import streamlit as st
-
-st.subheader("This is page 2")
-st.write("Nothing on this page yet")
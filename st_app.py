@@ -1,5 +1,10 @@
+import pandas as pd
 import streamlit as st
 
+# Base frames are shared between sessions (see common.frame_cache.shared_frame), copy-on-write keeps
+# a page that modifies its frame from changing the shared one
+pd.options.mode.copy_on_write = True
+
 st.set_page_config(page_title="ADS Template App", layout="wide")
 
 pg = st.navigation(
@@ -8,7 +13,7 @@ pg = st.navigation(
         st.Page("gui_pages/geo_tn_vula_arpu.py", title="TN and VULA ARPU Data"),
         st.Page("gui_pages/gsmai_data_collector.py", title="GSMAI Data Collector"),
         st.Page("gui_pages/fiber_sdu_discounts.py", title="Fiber SDU rabatter"),
-        st.Page("gui_pages/test.py", title="Test Page"),
+        st.Page("gui_pages/diagnostics.py", title="Query Diagnostics"),
     ]
 )
 pg.run()
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+from common.frame_cache import adopt_fingerprint, frame_fingerprint, stamp_query_fingerprint
+
+
+def _stamped_frame() -> pd.DataFrame:
+    df = pd.DataFrame({"a": np.arange(100_000), "b": np.zeros(100_000)})
+    return stamp_query_fingerprint(df, "query")
+
+
+def test_stamp_is_used_as_fingerprint() -> None:
+    df = _stamped_frame()
+    assert frame_fingerprint(df) == df.attrs["fingerprint"]["fingerprint"]
+
+
+def test_modified_copy_gets_new_fingerprint() -> None:
+    df = _stamped_frame()
+    changed = df.copy()
+    # none of these rows is in the signature sample
+    changed.loc[500:1000, "b"] = 5.0
+    assert frame_fingerprint(changed) != frame_fingerprint(df)
+
+
+def test_filtered_frame_gets_new_fingerprint() -> None:
+    df = _stamped_frame()
+    assert frame_fingerprint(df[df["a"] != 700]) != frame_fingerprint(df)
+
+
+def test_adopted_copy_shares_fingerprint() -> None:
+    df = _stamped_frame()
+    assert frame_fingerprint(adopt_fingerprint(df.copy())) == frame_fingerprint(df)
+
+
+def test_copy_is_hashed_once() -> None:
+    copy = _stamped_frame().copy()
+    assert frame_fingerprint(copy) == frame_fingerprint(copy)
+
+
+def test_in_place_change_of_sampled_row_is_detected() -> None:
+    df = _stamped_frame()
+    before = frame_fingerprint(df)
+    df.loc[0, "b"] = 5.0
+    assert frame_fingerprint(df) != before
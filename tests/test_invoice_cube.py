@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from common.invoice_cube import InvoiceCube
+
+LEVELS = {
+    "Postnummer": ["postcode", "post_office"],
+    "Kommune": ["kommune_id", "kommune"],
+    "Nasjonalt": ["country"],
+}
+MONTH = "PERIOD_YEAR_MONTH"
+
+
+@pytest.fixture(scope="module")
+def invoice_rows() -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    n = 5000
+    postcode = rng.integers(0, 60, n)
+    package = rng.integers(0, 5, n)
+    product = rng.integers(0, 12, n)
+    df = pd.DataFrame(
+        {
+            MONTH: 202400 + rng.integers(1, 13, n),
+            "product_id": product * 10 + 2292,
+            # several product ids share a name
+            "product_name": [f"P{p % 8}" for p in product],
+            # packages are sold under several package ids
+            "subscription_package_ids": [str(p * 3 + i) for p, i in zip(package, rng.integers(0, 3, n), strict=True)],
+            "subscription_package": [f"pkg{p}" for p in package],
+            "postcode": [f"{p:04d}" for p in postcode],
+            "post_office": [f"PO{p}" for p in postcode],
+            "kommune_id": postcode // 6,
+            "kommune": [f"K{p // 6}" for p in postcode],
+            "country": "Norway",
+            "rev_tot": rng.normal(-100, 50, n),
+            "unique_subs": rng.integers(0, 30, n).astype(float),
+        }
+    )
+    # categorical inputs, as normalize_frame loads them
+    categorical = ["product_name", "subscription_package_ids", "subscription_package", "postcode", "post_office"]
+    return df.astype(dict.fromkeys(categorical, "category"))
+
+
+@pytest.fixture(scope="module")
+def products(invoice_rows: pd.DataFrame) -> list[int]:
+    return sorted(invoice_rows["product_id"].unique())[:5]
+
+
+def _reference(df: pd.DataFrame, area: list[str], by: list[str], products: list[int] | None) -> pd.DataFrame:
+    # the page definition in pandas: total subscribers are the max over all products per (month, package ids,
+    # package, area), summed over the ids, for the (month, package, area) that have the selected products
+    keys = [MONTH, "subscription_package", *area]
+    per_product = df.groupby([*keys, "subscription_package_ids", "product_id"], observed=True)["unique_subs"].sum()
+    total_subs = per_product.groupby([*keys, "subscription_package_ids"], observed=True).max()
+    total_subs = total_subs.groupby(keys, observed=True).sum().rename("total_subs").reset_index()
+    selected = df if products is None else df[df["product_id"].isin(products)]
+    sums = selected.groupby(keys, observed=True, as_index=False)[["rev_tot", "unique_subs"]].sum()
+    sums = sums.merge(total_subs, on=keys, how="left")
+    return sums.groupby([MONTH, *by], observed=True, as_index=False)[["rev_tot", "unique_subs", "total_subs"]].sum()
+
+
+def _assert_same(result: pd.DataFrame, expected: pd.DataFrame) -> None:
+    keys = [col for col in result.columns if col not in ("rev_tot", "unique_subs", "total_subs")]
+    result = result.astype(dict.fromkeys(keys, str)).sort_values(keys).reset_index(drop=True)
+    expected = expected[result.columns].astype(dict.fromkeys(keys, str)).sort_values(keys).reset_index(drop=True)
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+
+@pytest.mark.parametrize("level", list(LEVELS))
+def test_rollup_by_area(invoice_rows: pd.DataFrame, products: list[int], level: str) -> None:
+    cube = InvoiceCube(invoice_rows, LEVELS)
+    area = LEVELS[level]
+    _assert_same(cube.rollup(level, by="area", products=products), _reference(invoice_rows, area, area, products))
+
+
+def test_rollup_by_package_counts_every_package_id(invoice_rows: pd.DataFrame) -> None:
+    cube = InvoiceCube(invoice_rows, LEVELS)
+    expected = _reference(invoice_rows, ["country"], ["subscription_package"], None)
+    _assert_same(cube.rollup("Nasjonalt", by="subscription_package"), expected)
+    # the max is taken per package id, which gives more subscribers than a max over the ids together
+    per_product = invoice_rows.groupby([MONTH, "subscription_package", "product_id"], observed=True)["unique_subs"]
+    assert expected["total_subs"].sum() > per_product.sum().groupby(level=[0, 1], observed=True).max().sum()
+
+
+def test_rollup_by_product_name(invoice_rows: pd.DataFrame, products: list[int]) -> None:
+    cube = InvoiceCube(invoice_rows, LEVELS)
+    selected = invoice_rows[invoice_rows["product_id"].isin(products)]
+    expected = selected.groupby([MONTH, "product_name"], observed=True, as_index=False)[
+        ["rev_tot", "unique_subs"]
+    ].sum()
+    _assert_same(cube.rollup("Nasjonalt", by="product_name", products=products), expected)
+
+
+def test_area_drill_down(invoice_rows: pd.DataFrame, products: list[int]) -> None:
+    cube = InvoiceCube(invoice_rows, LEVELS)
+    area = LEVELS["Kommune"]
+    rows = invoice_rows[invoice_rows["kommune_id"] == 3]
+    expected = _reference(rows, area, ["subscription_package"], products)
+    _assert_same(cube.rollup("Kommune", by="subscription_package", products=products, area_id=3), expected)
+
+
+def test_min_subs(invoice_rows: pd.DataFrame, products: list[int]) -> None:
+    cube = InvoiceCube(invoice_rows, LEVELS)
+    area = LEVELS["Postnummer"]
+    expected = _reference(invoice_rows, area, area, products)
+    expected = expected[expected["total_subs"] >= 40]
+    _assert_same(cube.rollup("Postnummer", by="area", products=products, min_subs=40), expected)
+
+
+def test_concat_matches_one_cube(invoice_rows: pd.DataFrame, products: list[int]) -> None:
+    first_half = invoice_rows[MONTH] <= 202406
+    # the second half lacks one product and one area, so the labels of the two cubes differ
+    second_half = ~first_half & (invoice_rows["product_id"] != products[0]) & (invoice_rows["kommune_id"] != 0)
+    rows = invoice_rows[first_half | second_half]
+    halves = [InvoiceCube(invoice_rows[first_half], LEVELS), InvoiceCube(invoice_rows[second_half], LEVELS)]
+    cube = InvoiceCube.concat(halves)
+    for level, area in LEVELS.items():
+        _assert_same(cube.rollup(level, by="area", products=products), _reference(rows, area, area, products))
+    _assert_same(
+        cube.rollup("Nasjonalt", by="subscription_package"),
+        _reference(rows, ["country"], ["subscription_package"], None),
+    )
+
+
+def test_empty_cube() -> None:
+    columns = [MONTH, "product_id", "product_name", "subscription_package_ids", "subscription_package", "country"]
+    empty = pd.DataFrame(columns=[*columns, "rev_tot", "unique_subs"])
+    assert InvoiceCube(empty, {"Nasjonalt": ["country"]}).rollup("Nasjonalt", by="area").empty
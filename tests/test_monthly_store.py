@@ -0,0 +1,128 @@
+from collections.abc import Callable, Mapping
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from common import monthly_store, result_cache
+from common.monthly_store import load_monthly
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+        self.year_month = 0
+
+    def set(self, year: int, month: int, day: int, seconds: float = 0) -> None:
+        self.now = datetime(year, month, day).timestamp() + seconds
+        self.year_month = year * 100 + month
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> Clock:
+    # a local Parquet store per test and an empty memory layer
+    monkeypatch.setattr(result_cache, "QUERY_CACHE_ENABLED", True)
+    monkeypatch.setattr(result_cache, "QUERY_CACHE_BUCKET", "")
+    monkeypatch.setattr(result_cache, "QUERY_CACHE_DIR", tmp_path)
+    monthly_store._memory_store.clear()  # noqa: SLF001
+    clock = Clock()
+    monkeypatch.setattr(monthly_store.time, "time", lambda: clock.now)
+    monkeypatch.setattr(monthly_store, "current_year_month", lambda: clock.year_month)
+    return clock
+
+
+class Compute:
+    """Records the months it is asked for and returns `rows` rows per month (months in `skip` fail)."""
+
+    def __init__(self, rows: int = 1, skip: tuple[int, ...] = ()) -> None:
+        self.rows = rows
+        self.skip = skip
+        self.calls: list[list[int]] = []
+
+    def __call__(self, months: list[int]) -> Mapping[int, pd.DataFrame]:
+        self.calls.append(months)
+        return {m: pd.DataFrame({"month": [m] * self.rows}) for m in months if m not in self.skip}
+
+
+def _forget_memory() -> None:
+    # as after a restart, only the Parquet store is left
+    monthly_store._memory_store.clear()  # noqa: SLF001
+
+
+def _load(months: list[int], compute: Callable[[list[int]], Mapping[int, pd.DataFrame]]) -> pd.DataFrame:
+    return load_monthly("test", months, compute)
+
+
+def test_months_are_computed_once(clock: Clock) -> None:
+    clock.set(2024, 9, 1)
+    compute = Compute()
+    assert list(_load([202401, 202402], compute)["month"]) == [202401, 202402]
+    assert list(_load([202402, 202403], compute)["month"]) == [202402, 202403]
+    _forget_memory()
+    _load([202401, 202402, 202403], compute)
+    assert compute.calls == [[202401, 202402], [202403]]
+
+
+def test_open_month_is_recomputed_after_ttl(clock: Clock) -> None:
+    clock.set(2024, 9, 10)
+    compute = Compute()
+    _load([202409], compute)
+    clock.set(2024, 9, 10, monthly_store.MONTHLY_STORE_OPEN_MONTH_TTL_SECONDS - 1)
+    _load([202409], compute)
+    clock.set(2024, 9, 10, monthly_store.MONTHLY_STORE_OPEN_MONTH_TTL_SECONDS + 1)
+    _load([202409], compute)
+    assert compute.calls == [[202409], [202409]]
+
+
+def test_closed_month_is_final_only_after_grace_period(clock: Clock) -> None:
+    grace_days = monthly_store.MONTHLY_STORE_CLOSE_GRACE_DAYS
+    compute = Compute()
+    # within the grace period billing for August can still land, so it is recomputed after the TTL
+    clock.set(2024, 9, grace_days - 1)
+    _load([202408], compute)
+    clock.set(2024, 9, grace_days)
+    _load([202408], compute)
+    # the grace period ends at the start of day grace_days + 1
+    clock.set(2024, 9, grace_days + 1)
+    _load([202408], compute)
+    # computed after the grace period it is never recomputed, also not after a restart
+    clock.set(2024, 12, 1)
+    _forget_memory()
+    _load([202408], compute)
+    assert compute.calls == [[202408], [202408], [202408]]
+
+
+def test_empty_recent_month_is_not_stored(clock: Clock) -> None:
+    clock.set(2024, 9, 20)
+    empty = Compute(rows=0)
+    assert _load([202408], empty).empty
+    _forget_memory()
+    _load([202408], empty)
+    # in memory it is kept for the TTL, but it is never final
+    clock.set(2024, 9, 20, monthly_store.MONTHLY_STORE_OPEN_MONTH_TTL_SECONDS + 1)
+    _load([202408], empty)
+    assert empty.calls == [[202408], [202408], [202408]]
+
+
+def test_missing_month_is_retried_and_outdated_frame_returned(clock: Clock) -> None:
+    clock.set(2024, 9, 10)
+    _load([202409], Compute(rows=2))
+    clock.set(2024, 9, 11)
+    failing = Compute(rows=3, skip=(202409,))
+    # the outdated September is returned while its recompute fails
+    assert list(_load([202409, 202401], failing)["month"]) == [202409, 202409, 202401, 202401, 202401]
+    _load([202409, 202401], failing)
+    assert failing.calls == [[202409, 202401], [202409]]
+
+
+def test_memory_layer_is_bounded(clock: Clock, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(monthly_store, "MONTHLY_STORE_MEMORY_MONTHS", 2)
+    clock.set(2024, 9, 1)
+    compute = Compute()
+    _load([202401, 202402, 202403], compute)
+    frames, _ = monthly_store._memory_store()  # noqa: SLF001
+    assert list(frames) == [("test", 202402), ("test", 202403)]
+    # evicted months are read back from the Parquet store
+    _load([202401], compute)
+    assert compute.calls == [[202401, 202402, 202403]]
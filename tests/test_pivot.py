@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from common.pivot import TOTAL_LABEL, measure_pivot
+
+MONTH = "PERIOD_YEAR_MONTH"
+BLOCKS = {"ARPU": ("rev", "subs"), "Revenue": "rev", "Subscribers": "subs"}
+
+
+@pytest.fixture
+def report_rows() -> pd.DataFrame:
+    # one row per (area, month); area 2 has no row for 202402 and no subscribers in 202403
+    return pd.DataFrame(
+        {
+            "area_id": [1, 1, 1, 2, 2, 3, 3, 3],
+            "area": ["A", "A", "A", "B", "B", "C", "C", "C"],
+            MONTH: [202401, 202402, 202403, 202401, 202403, 202401, 202402, 202403],
+            "rev": [100.0, 120.0, 90.0, 50.0, 30.0, 10.0, 20.0, 60.0],
+            "subs": [10.0, 12.0, 9.0, 5.0, 0.0, 2.0, 4.0, 6.0],
+        }
+    )
+
+
+def _reference(df: pd.DataFrame, index: list[str], value: str) -> pd.DataFrame:
+    return df.pivot_table(index=index, columns=MONTH, values=value, aggfunc="sum", fill_value=0)
+
+
+def test_blocks_and_total_row(report_rows: pd.DataFrame) -> None:
+    result = measure_pivot(report_rows, ["area"], BLOCKS)
+
+    assert result.index[0] == TOTAL_LABEL
+    for block, value in (("Revenue", "rev"), ("Subscribers", "subs")):
+        expected = _reference(report_rows, ["area"], value)
+        np.testing.assert_allclose(result[block].iloc[1:].to_numpy(), expected.to_numpy())
+        np.testing.assert_allclose(result[block].iloc[0].to_numpy(), expected.sum().to_numpy())
+
+
+def test_ratio_from_totals_and_zero_denominator(report_rows: pd.DataFrame) -> None:
+    result = measure_pivot(report_rows, ["area"], BLOCKS)
+
+    # the Total row ratio is total revenue over total subscribers, not a sum or mean of the row ratios
+    np.testing.assert_allclose(
+        result["ARPU"].loc[TOTAL_LABEL].to_numpy(),
+        result["Revenue"].loc[TOTAL_LABEL].to_numpy() / result["Subscribers"].loc[TOTAL_LABEL].to_numpy(),
+    )
+    # no subscribers, or no row at all, gives 0
+    assert result["ARPU"].loc["B", 202403] == 0
+    assert result["ARPU"].loc["B", 202402] == 0
+    assert result["ARPU"].loc["A", 202401] == pytest.approx(10.0)
+
+
+def test_total_mean(report_rows: pd.DataFrame) -> None:
+    result = measure_pivot(report_rows, ["area"], BLOCKS, total_mean=["subs"])
+
+    expected = _reference(report_rows, ["area"], "subs").mean()
+    np.testing.assert_allclose(result["Subscribers"].loc[TOTAL_LABEL].to_numpy(), expected.to_numpy())
+    np.testing.assert_allclose(
+        result["ARPU"].loc[TOTAL_LABEL].to_numpy(),
+        _reference(report_rows, ["area"], "rev").sum().to_numpy() / expected.to_numpy(),
+    )
+
+
+def test_sort_by_last_column(report_rows: pd.DataFrame) -> None:
+    result = measure_pivot(report_rows, ["area"], BLOCKS, sort_by="Revenue")
+
+    assert list(result.index) == [TOTAL_LABEL, "B", "C", "A"]
+
+
+def test_multi_level_index_labels_are_text(report_rows: pd.DataFrame) -> None:
+    result = measure_pivot(report_rows, ["area_id", "area"], {"Revenue": "rev"})
+
+    assert result.index[0] == (TOTAL_LABEL, "")
+    assert list(result.index[1:]) == [("1", "A"), ("2", "B"), ("3", "C")]
+    assert list(result.columns) == [("Revenue", 202401), ("Revenue", 202402), ("Revenue", 202403)]
+
+
+def test_without_total_row(report_rows: pd.DataFrame) -> None:
+    result = measure_pivot(report_rows, ["area_id"], {"Revenue": "rev"}, total_row=False)
+
+    assert list(result.index) == [1, 2, 3]
+    np.testing.assert_allclose(result["Revenue"].to_numpy(), _reference(report_rows, ["area_id"], "rev").to_numpy())
+
+
+def test_empty_frame(report_rows: pd.DataFrame) -> None:
+    result = measure_pivot(report_rows.iloc[:0], ["area"], BLOCKS)
+
+    assert list(result.index) == [TOTAL_LABEL]
+    assert result.shape[1] == 0